@@ -8,6 +8,10 @@ from .io import TrainingGenerator, DataGenerator
 from . import models
 from . import utils
 from . import callbacks
+from . import inference
+from . import benchmark
+from . import search
+from . import profiler
 
 from . import augment
 from .augment import Augmenter, FlipAxis
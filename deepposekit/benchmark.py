@@ -0,0 +1,942 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import os
+import tempfile
+import time
+
+from .models.session import SessionConfig, clone_predict_model
+
+__all__ = ['BenchmarkGenerator', 'time_function',
+           'benchmark_threads', 'benchmark_architectures',
+           'benchmark_optimization', 'benchmark_loading', 'benchmark_subpixel',
+           'benchmark_subpixel_constants', 'benchmark_egocentric',
+           'moving_target_video', 'benchmark_tracking',
+           'benchmark_coarse_to_fine', 'benchmark_early_exit']
+
+
+class BenchmarkGenerator:
+    """
+    Describes the input and output shapes of a dataset without
+    any annotation data, for building models to benchmark.
+
+    This provides the attributes of TrainingGenerator that are
+    used when building models, so models can be constructed for
+    arbitrary frame sizes. It cannot be used for training.
+
+    Parameters
+    ----------
+    height : int, default = 256
+        The height of the input images.
+    width : int, default = 256
+        The width of the input images.
+    n_channels : int, default = 1
+        The number of channels of the input images.
+    n_keypoints : int, default = 32
+        The number of keypoints.
+    downsample_factor : int, default = 2
+        The output shape of the confidence maps is
+        shape // 2**downsample_factor
+    sigma : float, default = 5
+        The standard deviation of the confidence peaks.
+    n_output_channels : int, default = None
+        The number of confidence map channels. Default is None,
+        which uses `n_keypoints` plus the channels needed for
+        a graph with one edge per keypoint.
+    """
+    def __init__(self, height=256, width=256, n_channels=1, n_keypoints=32,
+                 downsample_factor=2, sigma=5, n_output_channels=None):
+        self.height = height
+        self.width = width
+        self.n_channels = n_channels
+        self.n_keypoints = n_keypoints
+        self.downsample_factor = downsample_factor
+        self.sigma = sigma
+        self.output_sigma = sigma / 2.**downsample_factor
+        self.output_shape = (height // 2**downsample_factor,
+                             width // 2**downsample_factor)
+        if n_output_channels is None:
+            n_output_channels = n_keypoints * 2 + 3
+        self.n_output_channels = n_output_channels
+
+    def random_images(self, n_samples, random_seed=None):
+        """Returns random uint8 images with the input shape"""
+        random_state = np.random.RandomState(random_seed)
+        shape = (n_samples, self.height, self.width, self.n_channels)
+        return random_state.randint(0, 256, size=shape).astype(np.uint8)
+
+    def get_config(self):
+        config = {'height': self.height,
+                  'width': self.width,
+                  'n_channels': self.n_channels,
+                  'downsample_factor': self.downsample_factor,
+                  'sigma': self.sigma,
+                  'output_shape': self.output_shape,
+                  'n_output_channels': self.n_output_channels,
+                  'n_keypoints': self.n_keypoints}
+        return config
+
+
+def time_function(function, n_runs=50, warmup=5):
+    """
+    Times repeated calls of a function.
+
+    Parameters
+    ----------
+    function : callable
+        A function with no arguments.
+    n_runs : int, default = 50
+        The number of timed calls.
+    warmup : int, default = 5
+        The number of untimed calls before timing,
+        to exclude one-time initialization costs.
+
+    Returns
+    -------
+    times : array, shape = (n_runs,)
+        The time for each call in seconds.
+    """
+    for idx in range(warmup):
+        function()
+    times = np.zeros(n_runs)
+    for idx in range(n_runs):
+        start = time.perf_counter()
+        function()
+        times[idx] = time.perf_counter() - start
+    return times
+
+
+def _default_n_threads():
+    n_cores = os.cpu_count() or 1
+    n_threads = [1]
+    while n_threads[-1] * 2 <= n_cores:
+        n_threads.append(n_threads[-1] * 2)
+    if n_threads[-1] != n_cores:
+        n_threads.append(n_cores)
+    return n_threads
+
+
+def benchmark_threads(model, n_threads=None, batch_size=1, n_runs=50,
+                      warmup=5, verbose=True):
+    """
+    Measures prediction throughput for increasing numbers of threads.
+
+    For each thread count the predict model is rebuilt in a new
+    session with `intra_op_threads` and `inter_op_threads` set
+    to that count, and run on random images.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`.
+    n_threads : list of int, default = None
+        The thread counts to benchmark. Default is None, which uses
+        powers of two up to the number of available cores.
+    batch_size : int, default = 1
+        The number of images per prediction.
+    n_runs : int, default = 50
+        The number of timed predictions for each thread count.
+    warmup : int, default = 5
+        The number of untimed predictions for each thread count.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : list of dict
+        The thread count, throughput (frames per second), mean and
+        median latency per batch (ms), and speedup relative to the
+        first thread count.
+    """
+    if n_threads is None:
+        n_threads = _default_n_threads()
+
+    # models with a variable shape are benchmarked at the training shape
+    input_shape = model.fixed_input_shape
+    random_state = np.random.RandomState(0)
+    images = random_state.randint(0, 256, size=(batch_size,) + tuple(input_shape))
+    images = images.astype(np.uint8)
+
+    results = []
+    for threads in n_threads:
+        config = SessionConfig(intra_op_threads=threads,
+                               inter_op_threads=threads)
+        session = config.create_session()
+        predict_model = clone_predict_model(model, session)
+        predict = session.make_callable(predict_model.outputs[0],
+                                        [predict_model.inputs[0]])
+        times = time_function(lambda: predict(images), n_runs, warmup)
+        session.close()
+
+        results.append({'n_threads': threads,
+                        'throughput': batch_size / times.mean(),
+                        'mean_latency': times.mean() * 1000,
+                        'median_latency': np.median(times) * 1000})
+    for result in results:
+        result['speedup'] = result['throughput'] / results[0]['throughput']
+
+    if verbose:
+        print('{} (batch_size={})'.format(model.__class__.__name__, batch_size))
+        print('{:>10} {:>12} {:>12} {:>10}'.format('n_threads', 'frames/s',
+                                                  'latency(ms)', 'speedup'))
+        for result in results:
+            print('{:>10d} {:>12.1f} {:>12.2f} {:>10.2f}'.format(result['n_threads'],
+                                                                result['throughput'],
+                                                                result['mean_latency'],
+                                                                result['speedup']))
+    return results
+
+
+def benchmark_architectures(data_generator=None, n_threads=None, batch_size=1,
+                            n_runs=50, warmup=5, verbose=True):
+    """
+    Measures thread scaling of prediction throughput for each
+    model architecture with default settings.
+
+    Parameters
+    ----------
+    data_generator : BenchmarkGenerator or TrainingGenerator, default = None
+        Describes the input and output shapes. Default is None, which
+        uses BenchmarkGenerator with default settings.
+        LEAP is benchmarked with a downsample_factor of 0.
+    n_threads, batch_size, n_runs, warmup, verbose :
+        See `benchmark_threads`.
+
+    Returns
+    -------
+    results : dict
+        The results from `benchmark_threads` for each architecture.
+    """
+    from .models import StackedDenseNet, StackedHourglass, LEAP, DeepLabCut
+
+    if data_generator is None:
+        data_generator = BenchmarkGenerator()
+    leap_generator = BenchmarkGenerator(data_generator.height,
+                                        data_generator.width,
+                                        data_generator.n_channels,
+                                        data_generator.n_keypoints,
+                                        downsample_factor=0,
+                                        sigma=data_generator.sigma,
+                                        n_output_channels=data_generator.n_output_channels)
+    architectures = [(StackedDenseNet, data_generator),
+                     (StackedHourglass, data_generator),
+                     (LEAP, leap_generator),
+                     (DeepLabCut, data_generator)]
+
+    results = {}
+    for Model, generator in architectures:
+        model = Model(generator)
+        results[Model.__name__] = benchmark_threads(model, n_threads, batch_size,
+                                                    n_runs, warmup, verbose)
+    return results
+
+
+def benchmark_optimization(data_generator=None, batch_size=1, n_runs=50,
+                           warmup=5, verbose=True):
+    """
+    Reports the number of BatchNormalization layers folded by
+    `optimize_predict_model` and the prediction latency before and
+    after optimization for each model architecture with default settings.
+
+    Parameters
+    ----------
+    data_generator : BenchmarkGenerator or TrainingGenerator, default = None
+        Describes the input and output shapes. Default is None, which
+        uses BenchmarkGenerator with default settings.
+        LEAP is benchmarked with a downsample_factor of 0.
+    batch_size : int, default = 1
+        The number of frames per batch.
+    n_runs, warmup :
+        See `time_function`.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : list of dict
+        The architecture, the number of BatchNormalization layers and the
+        number folded, and the mean latency per batch (ms) of the original
+        and optimized prediction models.
+    """
+    from keras import backend as K
+    from .models import StackedDenseNet, StackedHourglass, LEAP, DeepLabCut
+    from .models.optimize import optimize_predict_model, _count_layers
+    from keras.layers import BatchNormalization
+
+    if data_generator is None:
+        data_generator = BenchmarkGenerator()
+    leap_generator = BenchmarkGenerator(data_generator.height,
+                                        data_generator.width,
+                                        data_generator.n_channels,
+                                        data_generator.n_keypoints,
+                                        downsample_factor=0,
+                                        sigma=data_generator.sigma,
+                                        n_output_channels=data_generator.n_output_channels)
+    architectures = [(StackedDenseNet, data_generator, {}),
+                     (StackedHourglass, data_generator, {}),
+                     (LEAP, leap_generator, {}),
+                     (DeepLabCut, data_generator, {'pretrained': False})]
+
+    results = []
+    for Model, generator, kwargs in architectures:
+        K.clear_session()
+        model = Model(generator, **kwargs)
+        optimized_model = optimize_predict_model(model, verbose=False)
+        images = generator.random_images(batch_size, random_seed=0)
+        n_batchnorm = _count_layers(model.predict_model, BatchNormalization)
+        n_remaining = _count_layers(optimized_model, BatchNormalization)
+        original = time_function(lambda: model.predict_model.predict_on_batch(images),
+                                 n_runs, warmup)
+        optimized = time_function(lambda: optimized_model.predict_on_batch(images),
+                                  n_runs, warmup)
+        results.append({'architecture': Model.__name__,
+                        'batchnorm_layers': n_batchnorm,
+                        'folded_batchnorm': n_batchnorm - n_remaining,
+                        'original_latency': original.mean() * 1000,
+                        'optimized_latency': optimized.mean() * 1000})
+    K.clear_session()
+
+    if verbose:
+        print('{:>16} {:>12} {:>14} {:>14}'.format('architecture', 'folded BN',
+                                                   'latency(ms)', 'optimized(ms)'))
+        for result in results:
+            folded = '{}/{}'.format(result['folded_batchnorm'],
+                                    result['batchnorm_layers'])
+            print('{:>16} {:>12} {:>14.2f} {:>14.2f}'.format(result['architecture'],
+                                                             folded,
+                                                             result['original_latency'],
+                                                             result['optimized_latency']))
+    return results
+
+
+def benchmark_loading(model, n_runs=3, directory=None, verbose=True):
+    """
+    Measures file size and load time of the supported model file formats.
+
+    The model is saved with float32 weights and optimizer state
+    (the format used for resuming training), float32 weights only,
+    float16 weights, and as an exported inference graph. Each file
+    is then loaded `n_runs` times into a fresh keras session.
+    As the files are read from a local temporary directory, the load
+    times exclude network file system latency, which scales with
+    the file size.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The model to save and load.
+    n_runs : int, default = 3
+        The number of timed loads for each format.
+    directory : str, default = None
+        The directory for the model files. Default is None,
+        which uses a temporary directory.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : list of dict
+        The format, file size (MB), file size relative to the
+        float32 file, and mean and minimum load time (s) for each format.
+
+    Note
+    ----
+    The keras session is cleared before each load,
+    so `model` cannot be used afterwards.
+    """
+    from keras import backend as K
+    from .models import load_model, load_exported_model
+
+    if not model.train_model._is_compiled:
+        model.train_model.compile('adam', 'mse')
+        # create the optimizer slots, as for a trained model
+        model.train_model._make_train_function()
+
+    formats = [('float32+optimizer', lambda path: model.save(path, optimizer=True),
+                load_model),
+               ('float32', lambda path: model.save(path, optimizer=False),
+                load_model),
+               ('float16', lambda path: model.save(path, weights_dtype='float16'),
+                load_model),
+               ('exported', model.export,
+                lambda path: load_exported_model(path).close())]
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        paths = []
+        for name, save, load in formats:
+            path = os.path.join(tmpdir, name.replace('+', '_') + '.h5')
+            save(path)
+            paths.append(path)
+
+        # clearing the session invalidates `model`, so save all formats first
+        results = []
+        for (name, save, load), path in zip(formats, paths):
+            times = np.zeros(n_runs)
+            for idx in range(n_runs):
+                K.clear_session()
+                start = time.perf_counter()
+                load(path)
+                times[idx] = time.perf_counter() - start
+            results.append({'format': name,
+                            'size': os.path.getsize(path) / 1e6,
+                            'mean_load_time': times.mean(),
+                            'min_load_time': times.min()})
+        K.clear_session()
+    for result in results:
+        result['relative_size'] = result['size'] / results[1]['size']
+
+    if verbose:
+        print(model.__class__.__name__)
+        print('{:>18} {:>10} {:>10} {:>12}'.format('format', 'size(MB)',
+                                                   'relative', 'load(s)'))
+        for result in results:
+            print('{:>18} {:>10.1f} {:>10.2f} {:>12.2f}'.format(result['format'],
+                                                                result['size'],
+                                                                result['relative_size'],
+                                                                result['mean_load_time']))
+    return results
+
+
+def _draw_peaks(n_samples, height, width, n_keypoints, sigma,
+                noise, random_state):
+    rows = random_state.uniform(sigma, height - 1 - sigma,
+                                size=(n_samples, 1, 1, n_keypoints))
+    cols = random_state.uniform(sigma, width - 1 - sigma,
+                                size=(n_samples, 1, 1, n_keypoints))
+    grid_rows = np.arange(height, dtype=np.float32)[None, :, None, None]
+    grid_cols = np.arange(width, dtype=np.float32)[None, None, :, None]
+    maps = np.exp(-((grid_rows - rows) ** 2 + (grid_cols - cols) ** 2)
+                  / (2 * sigma ** 2))
+    if noise > 0:
+        maps = maps + random_state.normal(0, noise, size=maps.shape)
+    maps = (np.clip(maps, 0, 1) * 255).astype(np.float32)
+    keypoints = np.stack([cols[:, 0, 0], rows[:, 0, 0]], axis=-1)
+    return maps, keypoints
+
+
+def benchmark_subpixel(height=64, width=64, n_keypoints=32, sigma=1.25,
+                       batch_size=16, noise=0.05, n_runs=20, warmup=3,
+                       random_seed=0, verbose=True):
+    """
+    Measures coordinate error and latency of the keypoint readout modes
+    on synthetic confidence maps with known subpixel peak positions.
+
+    Compares integer maxima (`subpixel=False`), quadratic and centroid
+    refinement (`subpixel='quadratic'` or `'centroid'`),
+    full subpixel maxima (`subpixel=True`), and subpixel maxima
+    restricted to a window around each peak (`subpixel='roi'`).
+
+    Parameters
+    ----------
+    height, width : int, default = 64
+        The shape of the confidence maps.
+    n_keypoints : int, default = 32
+        The number of confidence map channels.
+    sigma : float, default = 1.25
+        The standard deviation of the confidence peaks,
+        e.g. `output_sigma` of a TrainingGenerator.
+    batch_size : int, default = 16
+        The number of confidence maps per prediction.
+    noise : float, default = 0.05
+        The standard deviation of gaussian noise added to the maps.
+    n_runs : int, default = 20
+        The number of timed predictions for each mode.
+    warmup : int, default = 3
+        The number of untimed predictions for each mode.
+    random_seed : int, default = 0
+        The seed for drawing the peak positions and noise.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : list of dict
+        The mode, mean and 95th percentile euclidean error (pixels),
+        and mean latency per batch (ms) for each mode.
+    """
+    import tensorflow as tf
+    from keras.layers import Input
+    from .models.layers.convolutional import Maxima2D
+    from .models.layers.subpixel import SubpixelMaxima2D
+    from .utils.image import largest_factor
+
+    random_state = np.random.RandomState(random_seed)
+    maps, keypoints = _draw_peaks(batch_size, height, width, n_keypoints,
+                                  sigma, noise, random_state)
+
+    kernel_size = np.min((height, width))
+    kernel_size = (kernel_size // largest_factor(kernel_size)) + 1
+    roi_size = int(2 * np.ceil(4 * sigma) + 2)
+    modes = [('argmax', lambda: Maxima2D()),
+             ('quadratic', lambda: Maxima2D(refine='quadratic')),
+             ('centroid', lambda: Maxima2D(refine='centroid')),
+             ('subpixel', lambda: SubpixelMaxima2D(kernel_size, sigma,
+                                                   upsample_factor=100)),
+             ('roi', lambda: SubpixelMaxima2D(kernel_size, sigma,
+                                              upsample_factor=100,
+                                              roi_size=roi_size))]
+
+    results = []
+    for name, layer in modes:
+        session = tf.Session(graph=tf.Graph())
+        with session.graph.as_default(), session.as_default():
+            inputs = Input((height, width, n_keypoints))
+            outputs = layer()(inputs)
+        predict = session.make_callable(outputs, [inputs])
+        times = time_function(lambda: predict(maps), n_runs, warmup)
+        predicted = predict(maps)
+        session.close()
+
+        error = np.linalg.norm(predicted[..., :2] - keypoints, axis=-1)
+        results.append({'mode': name,
+                        'mean_error': error.mean(),
+                        'p95_error': np.percentile(error, 95),
+                        'mean_latency': times.mean() * 1000})
+
+    if verbose:
+        print('{}x{}x{} (sigma={}, batch_size={})'.format(height, width,
+                                                         n_keypoints, sigma,
+                                                         batch_size))
+        print('{:>10} {:>12} {:>12} {:>12}'.format('mode', 'error(px)',
+                                                   'p95(px)', 'latency(ms)'))
+        for result in results:
+            print('{:>10} {:>12.3f} {:>12.3f} {:>12.2f}'.format(result['mode'],
+                                                               result['mean_error'],
+                                                               result['p95_error'],
+                                                               result['mean_latency']))
+    return results
+
+
+def benchmark_subpixel_constants(height=64, width=64, n_keypoints=32,
+                                 sigma=1.25, batch_size=16, n_runs=20,
+                                 warmup=3, verbose=True):
+    """
+    Measures the throughput of subpixel maxima with the Gaussian kernel
+    FFT and DFT matrices computed in the graph for every batch
+    (the previous behaviour) and precomputed once when the layer is built.
+    The precomputed version is built with SubpixelMaxima2D.
+
+    Parameters
+    ----------
+    height, width, n_keypoints, sigma, batch_size, n_runs, warmup, verbose :
+        See `benchmark_subpixel`.
+
+    Returns
+    -------
+    results : list of dict
+        The mode (`subpixel` or `roi`), whether the constants were
+        precomputed, throughput (maps per second), mean latency per
+        batch (ms), and maximum coordinate difference (pixels)
+        between the two versions.
+    """
+    import tensorflow as tf
+    from keras.layers import Input
+    from .models.backend import find_subpixel_maxima
+    from .models.layers.subpixel import SubpixelMaxima2D
+    from .utils.image import largest_factor
+
+    random_state = np.random.RandomState(0)
+    maps, _ = _draw_peaks(batch_size, height, width, n_keypoints,
+                          sigma, 0.05, random_state)
+
+    kernel_size = np.min((height, width))
+    kernel_size = (kernel_size // largest_factor(kernel_size)) + 1
+    roi_size = int(2 * np.ceil(4 * sigma) + 2)
+    upsample_factor = 100
+
+    results = []
+    for name, roi in [('subpixel', None), ('roi', roi_size)]:
+        outputs = []
+        for precompute in [False, True]:
+            session = tf.Session(graph=tf.Graph())
+            with session.graph.as_default(), session.as_default():
+                inputs = Input((height, width, n_keypoints))
+                if precompute:
+                    # the layer computes the constants when it is built
+                    keypoints = SubpixelMaxima2D(kernel_size, sigma,
+                                                 upsample_factor,
+                                                 data_format='channels_last',
+                                                 roi_size=roi)(inputs)
+                else:
+                    keypoints = find_subpixel_maxima(inputs, kernel_size, sigma,
+                                                     upsample_factor,
+                                                     data_format='channels_last',
+                                                     roi_size=roi)
+            predict = session.make_callable(keypoints, [inputs])
+            times = time_function(lambda: predict(maps), n_runs, warmup)
+            outputs.append(predict(maps))
+            session.close()
+            results.append({'mode': name,
+                            'precomputed': precompute,
+                            'throughput': batch_size * n_keypoints / times.mean(),
+                            'mean_latency': times.mean() * 1000})
+        difference = np.abs(outputs[0][..., :2] - outputs[1][..., :2]).max()
+        results[-2]['difference'] = results[-1]['difference'] = difference
+
+    if verbose:
+        print('{}x{}x{} (batch_size={})'.format(height, width,
+                                               n_keypoints, batch_size))
+        print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format('mode', 'precomputed',
+                                                          'maps/s', 'latency(ms)',
+                                                          'diff(px)'))
+        for result in results:
+            print('{:>10} {:>12} {:>12.1f} {:>12.2f} {:>12.4f}'.format(result['mode'],
+                                                                      str(result['precomputed']),
+                                                                      result['throughput'],
+                                                                      result['mean_latency'],
+                                                                      result['difference']))
+    return results
+
+
+def benchmark_egocentric(full_model, crop_model, aligner, frames=None,
+                         n_frames=64, batch_size=16, n_runs=5, verbose=True):
+    """
+    Compares end-to-end throughput of full-frame inference with
+    egocentric alignment followed by inference on the crops.
+
+    Parameters
+    ----------
+    full_model : deepposekit BaseModel
+        A model that predicts on full frames.
+    crop_model : deepposekit BaseModel
+        A model that predicts on the egocentric crops of `aligner`.
+    aligner : deepposekit.inference.EgocentricAligner
+        The aligner used to crop the frames.
+    frames : array, default = None
+        The frames to predict. Default is None, which uses random frames.
+    n_frames : int, default = 64
+        The number of random frames when `frames` is None.
+    batch_size : int, default = 16
+        The number of frames per batch.
+    n_runs : int, default = 5
+        The number of timed passes over the frames.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : dict
+        The throughput (frames per second) of full-frame inference,
+        alignment alone, and alignment with crop inference, and the
+        speedup of egocentric over full-frame inference.
+    """
+    if frames is None:
+        random_state = np.random.RandomState(0)
+        shape = (n_frames, aligner.height, aligner.width, aligner.n_channels)
+        frames = random_state.randint(0, 256, size=shape).astype(aligner.dtype)
+    n_frames = frames.shape[0]
+
+    def predict_full():
+        full_model.predict_model.predict(frames, batch_size=batch_size)
+
+    full_times = time_function(predict_full, n_runs, warmup=1)
+    align_times = time_function(lambda: aligner.align(frames, batch_size),
+                                n_runs, warmup=1)
+    crop_times = time_function(lambda: aligner.predict(crop_model, frames,
+                                                       batch_size),
+                               n_runs, warmup=1)
+
+    results = {'full_throughput': n_frames / full_times.mean(),
+               'align_throughput': n_frames / align_times.mean(),
+               'egocentric_throughput': n_frames / crop_times.mean()}
+    results['speedup'] = results['egocentric_throughput'] / results['full_throughput']
+
+    if verbose:
+        print('{:>12} {:>12}'.format('pipeline', 'frames/s'))
+        print('{:>12} {:>12.1f}'.format('full', results['full_throughput']))
+        print('{:>12} {:>12.1f}'.format('align', results['align_throughput']))
+        print('{:>12} {:>12.1f}'.format('egocentric', results['egocentric_throughput']))
+        print('speedup: {:.2f}'.format(results['speedup']))
+    return results
+
+
+def moving_target_video(n_frames=100, height=1024, width=1024, n_channels=1,
+                        target_size=64, speed=5., noise=10., random_seed=0):
+    """
+    Draws a synthetic video of a bright elliptical target moving
+    along a circular path over a noisy background.
+
+    Parameters
+    ----------
+    n_frames : int, default = 100
+        The number of frames.
+    height, width : int, default = 1024
+        The frame shape.
+    n_channels : int, default = 1
+        The number of channels of the frames.
+    target_size : int, default = 64
+        The length of the target in pixels.
+    speed : float, default = 5.
+        The distance moved by the target between frames in pixels.
+    noise : float, default = 10.
+        The standard deviation of the background noise.
+    random_seed : int, default = 0
+        The seed for the background noise.
+
+    Returns
+    -------
+    frames : array, shape = (n_frames, height, width, n_channels)
+        The uint8 frames.
+    centers : array, shape = (n_frames, 2)
+        The [x, y] position of the target in each frame.
+    """
+    random_state = np.random.RandomState(random_seed)
+    radius = (min(height, width) - 2 * target_size) / 3.
+    angles = np.arange(n_frames) * speed / radius
+    centers = np.stack([width / 2. + radius * np.cos(angles),
+                        height / 2. + radius * np.sin(angles)], -1)
+
+    rows = np.arange(height)[:, None]
+    cols = np.arange(width)[None, :]
+    frames = np.zeros((n_frames, height, width, n_channels), dtype=np.uint8)
+    for idx, (x, y) in enumerate(centers):
+        # the target faces the direction of motion
+        cos = -np.sin(angles[idx])
+        sin = np.cos(angles[idx])
+        along = (cols - x) * cos + (rows - y) * sin
+        across = -(cols - x) * sin + (rows - y) * cos
+        target = (along / (target_size / 2.))**2 + (across / (target_size / 6.))**2
+        frame = 200. * np.exp(-2 * target) + 20.
+        frame += random_state.normal(0, noise, size=frame.shape)
+        frames[idx] = np.clip(frame, 0, 255).astype(np.uint8)[..., None]
+    return frames, centers
+
+
+def benchmark_tracking(model, full_model, detector=None, frames=None,
+                       n_frames=100, confidence_threshold=0.3, verbose=True):
+    """
+    Compares throughput of full-frame video inference with
+    tracking-driven crop inference using TrackingPredictor.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The pose model that predicts on crops.
+    full_model : deepposekit BaseModel
+        The pose model that predicts on full frames.
+    detector : deepposekit BaseModel, default = None
+        The detector for TrackingPredictor.
+        Default is None, which uses `full_model`.
+    frames : array, default = None
+        The video frames. Default is None, which draws a synthetic
+        video with `moving_target_video` at the input shape
+        of `full_model`.
+    n_frames : int, default = 100
+        The number of synthetic frames when `frames` is None.
+    confidence_threshold : float, default = 0.3
+        See TrackingPredictor.
+    verbose : bool, default = True
+        Whether to print a summary.
+
+    Returns
+    -------
+    results : dict
+        The throughput (frames per second) of full-frame and tracking
+        inference, the speedup, and the fraction of frames passed to
+        the detector.
+    """
+    from .inference import RealtimePredictor, TrackingPredictor
+
+    if detector is None:
+        detector = full_model
+    if frames is None:
+        height, width, n_channels = full_model.fixed_input_shape
+        frames, _ = moving_target_video(n_frames, height, width, n_channels)
+    n_frames = frames.shape[0]
+
+    # both run one frame at a time, as tracking depends on the previous frame
+    predictor = RealtimePredictor(full_model, warmup=1)
+    start = time.perf_counter()
+    for frame in frames:
+        predictor(frame)
+    full_time = time.perf_counter() - start
+    predictor.close()
+
+    tracker = TrackingPredictor(model, detector,
+                                confidence_threshold=confidence_threshold)
+    tracker(frames[0])
+    tracker.reset()
+    start = time.perf_counter()
+    tracker.predict(frames)
+    tracking_time = time.perf_counter() - start
+    tracker.close()
+
+    results = {'full_throughput': n_frames / full_time,
+               'tracking_throughput': n_frames / tracking_time,
+               'detection_rate': tracker.detection_rate}
+    results['speedup'] = results['tracking_throughput'] / results['full_throughput']
+
+    if verbose:
+        print('{:>12} {:>12}'.format('pipeline', 'frames/s'))
+        print('{:>12} {:>12.1f}'.format('full', results['full_throughput']))
+        print('{:>12} {:>12.1f}'.format('tracking', results['tracking_throughput']))
+        print('speedup: {:.2f}, detection rate: {:.2f}'.format(results['speedup'],
+                                                               results['detection_rate']))
+    return results
+
+
+def benchmark_coarse_to_fine(full_model, predictor, frames=None, keypoints=None,
+                             n_frames=64, batch_size=16, n_runs=5, verbose=True):
+    """
+    Compares throughput and accuracy of full-resolution inference with
+    coarse-to-fine inference using CoarseToFinePredictor.
+
+    Parameters
+    ----------
+    full_model : deepposekit BaseModel
+        A model that predicts on full-resolution frames.
+    predictor : deepposekit.inference.CoarseToFinePredictor
+        The coarse-to-fine predictor.
+    frames : array, default = None
+        The frames to predict. Default is None, which uses
+        random frames at the input shape of `full_model`.
+    keypoints : array, shape = (n_frames, n_keypoints, 2), default = None
+        The annotated [x, y] keypoints for `frames`. If given,
+        the mean keypoint error of each pipeline is also reported.
+    n_frames : int, default = 64
+        The number of random frames when `frames` is None.
+    batch_size : int, default = 16
+        The number of frames per batch.
+    n_runs : int, default = 5
+        The number of timed passes over the frames.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : dict
+        The throughput (frames per second) of full-resolution, coarse,
+        and coarse-to-fine inference, the speedup of coarse-to-fine over
+        full-resolution inference, and the mean keypoint errors in pixels
+        if `keypoints` is given.
+    """
+    if frames is None:
+        random_state = np.random.RandomState(0)
+        shape = (n_frames,) + full_model.fixed_input_shape
+        frames = random_state.randint(0, 256, size=shape).astype(np.uint8)
+    n_frames = frames.shape[0]
+
+    def predict_full():
+        return full_model.predict_model.predict(frames, batch_size=batch_size)
+
+    def predict_coarse():
+        return predictor.predict(frames, batch_size, refine=False)
+
+    def predict_fine():
+        return predictor.predict(frames, batch_size)
+
+    pipelines = [('full', predict_full), ('coarse', predict_coarse),
+                 ('refined', predict_fine)]
+    results = {}
+    for name, function in pipelines:
+        times = time_function(function, n_runs, warmup=1)
+        results[name + '_throughput'] = n_frames / times.mean()
+        if keypoints is not None:
+            error = np.linalg.norm(function()[..., :2] - keypoints[..., :2], axis=-1)
+            results[name + '_error'] = error.mean()
+    results['speedup'] = results['refined_throughput'] / results['full_throughput']
+
+    if verbose:
+        print('{:>12} {:>12} {:>12}'.format('pipeline', 'frames/s', 'error'))
+        for name, _ in pipelines:
+            error = results.get(name + '_error', np.nan)
+            print('{:>12} {:>12.1f} {:>12.2f}'.format(name,
+                                                      results[name + '_throughput'],
+                                                      error))
+        print('speedup: {:.2f}'.format(results['speedup']))
+    return results
+
+
+def benchmark_early_exit(model, frames=None, thresholds=(0.3, 0.5, 0.7),
+                         n_frames=64, batch_size=16, n_runs=5, verbose=True):
+    """
+    Compares throughput of full stacked inference with confidence-gated
+    early exit using EarlyExitPredictor at several thresholds.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A stacked model, e.g. StackedDenseNet or StackedHourglass.
+    frames : array, default = None
+        The frames to predict. Default is None, which uses random
+        frames at the input shape of `model`. Random frames rarely
+        produce confident keypoints, so real frames should be
+        used to measure the exit rate.
+    thresholds : sequence of float, default = (0.3, 0.5, 0.7)
+        The confidence thresholds to benchmark.
+    n_frames : int, default = 64
+        The number of random frames when `frames` is None.
+    batch_size : int, default = 16
+        The number of frames per batch.
+    n_runs : int, default = 5
+        The number of timed passes over the frames.
+    verbose : bool, default = True
+        Whether to print a summary table.
+
+    Returns
+    -------
+    results : list of dict
+        For each threshold, the throughput (frames per second) of full and
+        early exit inference, the speedup, the mean number of stacks
+        executed, and the mean distance in pixels from the keypoints
+        of full inference.
+    """
+    from .inference import EarlyExitPredictor
+
+    if frames is None:
+        random_state = np.random.RandomState(0)
+        shape = (n_frames,) + model.fixed_input_shape
+        frames = random_state.randint(0, 256, size=shape).astype(np.uint8)
+    n_frames = frames.shape[0]
+
+    full_keypoints = model.predict_model.predict(frames, batch_size=batch_size)
+    full_times = time_function(lambda: model.predict_model.predict(frames,
+                                                                   batch_size=batch_size),
+                               n_runs, warmup=1)
+    full_throughput = n_frames / full_times.mean()
+
+    predictor = EarlyExitPredictor(model)
+    results = []
+    for threshold in thresholds:
+        predictor.confidence_threshold = threshold
+        keypoints = predictor.predict(frames, batch_size)
+        predictor.reset_stats()
+        times = time_function(lambda: predictor.predict(frames, batch_size),
+                              n_runs, warmup=0)
+        error = np.linalg.norm(keypoints[..., :2] - full_keypoints[..., :2], axis=-1)
+        result = {'threshold': threshold,
+                  'full_throughput': full_throughput,
+                  'early_exit_throughput': n_frames / times.mean(),
+                  'mean_stacks': predictor.mean_stacks,
+                  'error': error.mean()}
+        result['speedup'] = result['early_exit_throughput'] / full_throughput
+        results.append(result)
+        predictor.reset_stats()
+    predictor.close()
+
+    if verbose:
+        print('full: {:.1f} frames/s, {} stacks'.format(full_throughput,
+                                                        predictor.n_stacks))
+        print('{:>10} {:>12} {:>12} {:>10} {:>10}'.format('threshold', 'frames/s',
+                                                          'mean stacks', 'speedup',
+                                                          'error'))
+        for result in results:
+            print('{:>10.2f} {:>12.1f} {:>12.2f} {:>10.2f} {:>10.2f}'.format(
+                result['threshold'], result['early_exit_throughput'],
+                result['mean_stacks'], result['speedup'], result['error']))
+    return results
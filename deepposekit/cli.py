@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import numpy as np
+import h5py
+import os
+import sys
+import time
+
+__all__ = ['main']
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv', '.mpg', '.mpeg', '.m4v', '.wmv')
+
+
+def _find_inputs(inputs):
+    videos = []
+    datasets = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(os.path.join(path, name))
+        elif not os.path.exists(path):
+            raise ValueError('input does not exist: ' + path)
+        elif path.endswith('.h5') or path.endswith('.hdf5'):
+            datasets.append(path)
+        else:
+            videos.append(path)
+    return videos, datasets
+
+
+def _output_path(path, output_dir):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if output_dir is None:
+        output_dir = os.path.dirname(path)
+    return os.path.join(output_dir, name + '_predictions.h5')
+
+
+def _predict_dataset(model, datapath, dataset, batch_size, output_path):
+    with h5py.File(datapath, 'r') as h5file:
+        images = h5file[dataset]
+        n_samples = images.shape[0]
+        predictions = []
+        for idx in range(0, n_samples, batch_size):
+            batch = images[idx:idx + batch_size]
+            predictions.append(model.predict_on_batch(batch))
+    predictions = np.concatenate(predictions).astype(np.float32)
+    with h5py.File(output_path, 'w') as h5file:
+        h5file.create_dataset('predictions', data=predictions)
+        h5file.attrs['datapath'] = datapath.encode('utf8')
+        h5file.attrs['dataset'] = dataset.encode('utf8')
+    return n_samples
+
+
+def _load_predictor(path, session_config):
+    from .models.export import is_exported_model, load_exported_model
+    from .models.shared import is_shared_model, load_shared_model
+    from .models.loading import load_model
+
+    if is_shared_model(path):
+        return load_shared_model(path, session_config=session_config)
+    elif is_exported_model(path):
+        return load_exported_model(path, session_config=session_config)
+    else:
+        return load_model(path, session_config=session_config)
+
+
+def predict(args):
+    from .models.session import SessionConfig
+    from .inference.BatchScheduler import BatchScheduler
+
+    videos, datasets = _find_inputs(args.inputs)
+    if len(videos) + len(datasets) == 0:
+        raise ValueError('no videos or annotation files found')
+    if args.output_dir is not None and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start_time = time.time()
+    n_frames = 0
+    output_paths = []
+    if len(datasets) > 0:
+        session_config = SessionConfig(intra_op_threads=args.threads,
+                                       inter_op_threads=args.threads,
+                                       set_omp_threads=True)
+        model = _load_predictor(args.model, session_config)
+        for datapath in datasets:
+            output_path = _output_path(datapath, args.output_dir)
+            n_frames += _predict_dataset(model, datapath, args.dataset,
+                                         args.batch_size, output_path)
+            output_paths.append(output_path)
+    if len(videos) > 0:
+        scheduler = BatchScheduler(args.model, n_workers=args.workers,
+                                   n_threads=args.threads,
+                                   batch_size=args.batch_size,
+                                   chunk_size=args.chunk_size,
+                                   verbose=args.verbose)
+        video_outputs = scheduler.run(videos, args.output_dir)
+        # resumed runs only count the frames predicted now
+        n_frames += scheduler.n_predicted
+        output_paths += video_outputs
+    elapsed = time.time() - start_time
+
+    for path in output_paths:
+        print(path)
+    print('predicted {} frames from {} inputs in {:.1f} s '
+          '({:.1f} frames/s)'.format(n_frames, len(output_paths),
+                                     elapsed, n_frames / elapsed))
+
+
+def evaluate(args):
+    from .models.loading import load_model
+    from .models.session import SessionConfig
+
+    session_config = SessionConfig(intra_op_threads=args.threads,
+                                   inter_op_threads=args.threads,
+                                   set_omp_threads=True)
+    model = load_model(args.model, datapath=args.datapath,
+                       session_config=session_config)
+    start_time = time.time()
+    evaluation = model.evaluate(args.batch_size)
+    elapsed = time.time() - start_time
+    n_samples = evaluation['y_pred'].shape[0]
+
+    print('{:>10} {:>10} {:>10} {:>10}'.format('metric', 'mean', 'median', 'p97.5'))
+    for key in ['euclidean', 'mae', 'mse', 'rmse']:
+        values = evaluation[key]
+        print('{:>10} {:>10.4f} {:>10.4f} {:>10.4f}'.format(key, np.mean(values),
+                                                            np.median(values),
+                                                            np.percentile(values, 97.5)))
+    print('evaluated {} samples in {:.1f} s '
+          '({:.1f} frames/s)'.format(n_samples, elapsed, n_samples / elapsed))
+
+
+def benchmark(args):
+    from .benchmark import benchmark_threads, benchmark_architectures
+    from .models.loading import load_model
+
+    if args.model is None:
+        benchmark_architectures(n_threads=args.threads, batch_size=args.batch_size,
+                                n_runs=args.runs)
+    else:
+        model = load_model(args.model)
+        benchmark_threads(model, n_threads=args.threads, batch_size=args.batch_size,
+                          n_runs=args.runs)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='deepposekit',
+                                     description='DeepPoseKit command line tools')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_predict = subparsers.add_parser('predict',
+                                           help='predict keypoints for videos '
+                                                'or annotation files')
+    parser_predict.add_argument('model',
+                                help='a saved or exported model .h5 file, '
+                                     'or a shared weights .mmap file')
+    parser_predict.add_argument('inputs', nargs='+',
+                                help='video files, directories of videos, '
+                                     'or annotation .h5 files')
+    parser_predict.add_argument('-o', '--output-dir', default=None,
+                                help='directory for predictions files '
+                                     '(default: next to each input)')
+    parser_predict.add_argument('--dataset', default='images',
+                                help='image dataset in annotation files')
+    parser_predict.add_argument('-w', '--workers', type=int, default=None,
+                                help='number of worker processes for videos')
+    parser_predict.add_argument('-t', '--threads', type=int, default=None,
+                                help='number of threads per process')
+    parser_predict.add_argument('-b', '--batch-size', type=int, default=32)
+    parser_predict.add_argument('--chunk-size', type=int, default=2048,
+                                help='number of frames per video chunk')
+    parser_predict.add_argument('-q', '--quiet', dest='verbose',
+                                action='store_false')
+    parser_predict.set_defaults(function=predict)
+
+    parser_evaluate = subparsers.add_parser('evaluate',
+                                            help='evaluate keypoint errors on '
+                                                 'the validation set')
+    parser_evaluate.add_argument('model', help='a saved model .h5 file')
+    parser_evaluate.add_argument('datapath', help='the annotation .h5 file')
+    parser_evaluate.add_argument('-t', '--threads', type=int, default=None)
+    parser_evaluate.add_argument('-b', '--batch-size', type=int, default=32)
+    parser_evaluate.set_defaults(function=evaluate)
+
+    parser_benchmark = subparsers.add_parser('benchmark',
+                                             help='measure prediction throughput '
+                                                  'for different thread counts')
+    parser_benchmark.add_argument('model', nargs='?', default=None,
+                                  help='a saved model .h5 file (default: '
+                                       'benchmark each architecture)')
+    parser_benchmark.add_argument('-t', '--threads', type=int, nargs='+',
+                                  default=None)
+    parser_benchmark.add_argument('-b', '--batch-size', type=int, default=1)
+    parser_benchmark.add_argument('-n', '--runs', type=int, default=50)
+    parser_benchmark.set_defaults(function=benchmark)
+
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    args.function(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
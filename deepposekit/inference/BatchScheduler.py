@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import multiprocessing
+import h5py
+import hashlib
+import json
+import os
+import time
+import warnings
+
+from ..io.VideoGenerator import VideoGenerator
+from ..models.session import SessionConfig
+from ..models.export import is_exported_model, load_exported_model
+from ..models.shared import is_shared_model, load_shared_model, get_shared_config
+
+__all__ = ['BatchScheduler']
+
+
+_WORKER = {}
+
+
+def _init_worker(model_path, session_config, batch_size):
+    if is_shared_model(model_path):
+        model = load_shared_model(model_path, session_config=session_config)
+        input_shape = model.input_shape
+    elif is_exported_model(model_path):
+        model = load_exported_model(model_path, session_config=session_config)
+        input_shape = model.input_shape
+    else:
+        from ..models.loading import load_model
+        model = load_model(model_path, session_config=session_config)
+        input_shape = model.predict_model.input_shape
+    _WORKER['model'] = model
+    _WORKER['batch_size'] = batch_size
+    _WORKER['grayscale'] = input_shape[-1] == 1
+
+
+def _predict_chunk(task):
+    video_index, chunk_index, videopath, start, stop = task
+    model = _WORKER['model']
+    batch_size = _WORKER['batch_size']
+    generator = VideoGenerator(videopath, batch_size, start, stop,
+                               grayscale=_WORKER['grayscale'])
+    predictions = []
+    indices = []
+    for idx in range(len(generator)):
+        # a failed read returns a short batch, and the next batch
+        # seeks to its own start, so the frame index of each
+        # prediction is kept to write it to the right row
+        try:
+            frames = generator[idx]
+        except IndexError:
+            continue
+        batch_start = start + idx * batch_size
+        predictions.append(model.predict_on_batch(frames))
+        indices.append(np.arange(batch_start, batch_start + frames.shape[0]))
+    generator.close()
+    if len(predictions) > 0:
+        predictions = np.concatenate(predictions).astype(np.float32)
+        indices = np.concatenate(indices)
+    else:
+        predictions = None
+        indices = None
+    return video_index, chunk_index, start, stop, indices, predictions
+
+
+class BatchScheduler:
+    """
+    Runs inference on many videos across a pool of worker processes.
+
+    Videos are split into chunks of frames, which are distributed
+    across the workers. Chunks from the videos with the most remaining
+    frames are scheduled first, and workers take a new chunk as soon as
+    they finish, so the load stays balanced across workers. Each worker
+    loads the model once with a fixed thread budget.
+
+    Predictions are written to one .h5 file per video as chunks finish,
+    along with a record of completed chunks. If a run is interrupted,
+    running it again with the same settings only predicts the chunks
+    that are missing, including chunks with frames that could not be read.
+
+    Parameters
+    ----------
+    model_path : str
+        The path to a model saved with deepposekit.models.save_model,
+        or exported with deepposekit.models.export_model, which
+        loads faster in each worker, or saved with
+        deepposekit.models.save_shared_weights, which shares one
+        memory-mapped copy of the weights across all workers.
+    n_workers : int, default = None
+        The number of worker processes. Default is None,
+        which uses one worker per 4 cores.
+    n_threads : int, default = None
+        The number of TensorFlow threads per worker. Default is None,
+        which divides the available cores evenly between workers.
+    batch_size : int, default = 32
+        The number of frames per prediction batch.
+    chunk_size : int, default = 2048
+        The number of frames per chunk. Smaller chunks balance the load
+        more evenly and lose less progress on a crash, but are written
+        to disk more often.
+    session_config : SessionConfig, default = None
+        The session configuration for each worker. If given,
+        `n_threads` is ignored.
+    verbose : bool, default = True
+        Whether to print progress.
+
+    Attributes
+    ----------
+    n_predicted : int
+        The number of frames predicted by the last call to `run`,
+        excluding frames predicted by earlier, resumed runs.
+    """
+    def __init__(self, model_path, n_workers=None, n_threads=None,
+                 batch_size=32, chunk_size=2048, session_config=None,
+                 verbose=True):
+        if isinstance(model_path, str):
+            if model_path.endswith(('.h5', '.hdf5', '.mmap')):
+                self.model_path = model_path
+            else:
+                raise ValueError('model_path must be .h5 or .mmap file')
+        else:
+            raise TypeError('model_path must be type `str`')
+
+        n_cores = os.cpu_count() or 1
+        if n_workers is None:
+            n_workers = int(np.maximum(1, n_cores // 4))
+        if n_threads is None:
+            n_threads = int(np.maximum(1, n_cores // n_workers))
+        if session_config is None:
+            # each worker is a separate process, so it can set
+            # OMP_NUM_THREADS without affecting the caller
+            session_config = SessionConfig(intra_op_threads=n_threads,
+                                           inter_op_threads=n_threads,
+                                           set_omp_threads=True)
+        elif not isinstance(session_config, SessionConfig):
+            raise TypeError('session_config must be class SessionConfig')
+
+        self.n_workers = n_workers
+        self.n_threads = n_threads
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.session_config = session_config
+        self.verbose = verbose
+        self.n_predicted = 0
+
+        if is_shared_model(self.model_path):
+            self.n_keypoints = get_shared_config(self.model_path)['output_shape'][1]
+            return
+
+        with h5py.File(self.model_path, 'r') as h5file:
+            data_generator_config = h5file.attrs.get('data_generator_config')
+            export_config = h5file.attrs.get('export_config')
+            if data_generator_config is not None:
+                data_generator_config = json.loads(data_generator_config.decode('utf-8'))['config']
+                self.n_keypoints = data_generator_config['n_keypoints']
+            elif export_config is not None:
+                export_config = json.loads(export_config.decode('utf-8'))
+                self.n_keypoints = export_config['output_shape'][1]
+            else:
+                raise ValueError('No data generator found in config file')
+
+    def output_path(self, videopath, output_dir=None):
+        """Returns the predictions file for a video.
+        With `output_dir`, the name includes a hash of the video
+        directory, so videos with the same name do not collide."""
+        name = os.path.splitext(os.path.basename(videopath))[0]
+        if output_dir is None:
+            output_dir = os.path.dirname(videopath)
+        else:
+            directory = os.path.dirname(os.path.abspath(videopath))
+            digest = hashlib.md5(directory.encode('utf8')).hexdigest()[:8]
+            name = name + '_' + digest
+        return os.path.join(output_dir, name + '_predictions.h5')
+
+    def _init_output(self, videopath, output_path):
+        generator = VideoGenerator(videopath)
+        n_frames = generator.total_frames
+        generator.close()
+        n_chunks = int(np.ceil(n_frames / float(self.chunk_size)))
+
+        abspath = os.path.abspath(videopath)
+        if os.path.exists(output_path):
+            with h5py.File(output_path, 'r') as h5file:
+                stored_path = h5file.attrs['videopath'].decode('utf8')
+                if os.path.abspath(stored_path) != abspath:
+                    raise ValueError('{} was created for another video ({}). '
+                                     'Delete it or use another output_dir.'.format(output_path,
+                                                                                   stored_path))
+                if (h5file.attrs['chunk_size'] != self.chunk_size or
+                        h5file['predictions'].shape[0] != n_frames):
+                    raise ValueError('{} was created with different settings. '
+                                     'Delete it to start over.'.format(output_path))
+                completed = h5file['completed'][:]
+        else:
+            with h5py.File(output_path, 'w') as h5file:
+                h5file.create_dataset('predictions',
+                                      shape=(n_frames, self.n_keypoints, 3),
+                                      dtype=np.float32, fillvalue=np.nan)
+                h5file.create_dataset('completed', shape=(n_chunks,),
+                                      dtype=bool, fillvalue=False)
+                h5file.attrs['videopath'] = abspath.encode('utf8')
+                h5file.attrs['model_path'] = self.model_path.encode('utf8')
+                h5file.attrs['chunk_size'] = self.chunk_size
+            completed = np.zeros(n_chunks, dtype=bool)
+
+        chunks = []
+        for chunk_index in np.where(~completed)[0]:
+            start = int(chunk_index * self.chunk_size)
+            stop = int(np.minimum(start + self.chunk_size, n_frames))
+            chunks.append((int(chunk_index), start, stop))
+        return chunks
+
+    def run(self, videos, output_dir=None):
+        """
+        Predict keypoints for a list of videos.
+
+        Parameters
+        ----------
+        videos : list of str
+            The paths to the video files.
+        output_dir : str, default = None
+            The directory for the predictions files. Default is None,
+            which writes each file next to its video.
+
+        Returns
+        -------
+        output_paths : list of str
+            The predictions file for each video. Each file contains the
+            'predictions' dataset with shape (n_frames, n_keypoints, 3).
+        """
+        if isinstance(videos, str):
+            videos = [videos]
+        if output_dir is not None and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        output_paths = [self.output_path(videopath, output_dir)
+                        for videopath in videos]
+        if len(set(output_paths)) != len(output_paths):
+            raise ValueError('videos must have unique output paths')
+
+        tasks = []
+        remaining = []
+        for video_index, (videopath, output_path) in enumerate(zip(videos,
+                                                                   output_paths)):
+            chunks = self._init_output(videopath, output_path)
+            n_remaining = sum([stop - start for _, start, stop in chunks])
+            remaining.append(n_remaining)
+            for chunk_index, start, stop in chunks:
+                tasks.append((video_index, chunk_index, videopath, start, stop))
+
+        # longest remaining videos first
+        tasks.sort(key=lambda task: (-remaining[task[0]], task[0], task[1]))
+        n_frames = float(sum(remaining))
+        self.n_predicted = 0
+        if len(tasks) == 0:
+            return output_paths
+
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(self.n_workers, initializer=_init_worker,
+                            initargs=(self.model_path, self.session_config,
+                                      self.batch_size))
+        start_time = time.time()
+        n_done = 0
+        n_incomplete = 0
+        try:
+            for result in pool.imap_unordered(_predict_chunk, tasks):
+                video_index, chunk_index, start, stop, indices, predictions = result
+                n_predicted = 0 if predictions is None else predictions.shape[0]
+                with h5py.File(output_paths[video_index], 'r+') as h5file:
+                    if n_predicted > 0:
+                        # unread frames are left as NaN
+                        h5file['predictions'][indices] = predictions
+                        n_done += n_predicted
+                    # chunks with unread frames are retried on the next run
+                    if n_predicted == stop - start:
+                        h5file['completed'][chunk_index] = True
+                    else:
+                        n_incomplete += 1
+                if self.verbose:
+                    elapsed = time.time() - start_time
+                    print('{:.1f}% - {:.1f} frames/s'.format(100 * n_done / n_frames,
+                                                             n_done / elapsed))
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.n_predicted = n_done
+        if n_incomplete > 0:
+            warnings.warn('{} chunks had frames that could not be read. '
+                          'Run again to retry them.'.format(n_incomplete))
+        return output_paths
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from ..models.session import create_session, clone_keras_model
+
+__all__ = ['CoarseToFinePredictor']
+
+
+class CoarseToFinePredictor:
+    """
+    Predicts keypoints on downscaled frames and refines
+    them on full-resolution patches.
+
+    Frames are downscaled by `scale_factor` with area interpolation and
+    passed through the confidence map output of `model`. The coarse
+    keypoints are found with a copy of the peak layer of `predict_model`,
+    with its `coordinate_scale` multiplied by `scale_factor` so coordinates
+    are returned in full-resolution pixels. A patch is then cropped around
+    each coarse keypoint from the full-resolution frame and passed through
+    a refinement head (see `deepposekit.models.build_refinement_head`),
+    and the keypoint is refined to the quadratic peak of its patch map.
+    The whole pipeline runs in one graph.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The coarse model, which predicts on frames downscaled by
+        `scale_factor`, e.g. a model trained on downscaled images or
+        a model with `variable_shape=True`.
+    head : keras.Model
+        A trained refinement head from `build_refinement_head`.
+    scale_factor : int, default = 2
+        The factor to downscale frames by for the coarse model.
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given,
+        the thread arguments are ignored.
+    """
+    def __init__(self, model, head, scale_factor=2, intra_op_threads=None,
+                 inter_op_threads=None, session_config=None):
+        from keras import Model
+        from keras.backend import tf
+        from ..models.layers.convolutional import Maxima2D
+
+        self.scale_factor = scale_factor
+        self.patch_size = head.input_shape[0][1]
+        self.n_keypoints = model.predict_model.output_shape[1]
+
+        maps_model = Model(model.train_model.inputs[0],
+                           model.train_model.outputs[-1])
+        peak_layer = model.predict_model.layers[-1]
+        config = peak_layer.get_config()
+        config['coordinate_scale'] = config['coordinate_scale'] * scale_factor
+
+        self.session = create_session(intra_op_threads, inter_op_threads,
+                                      session_config=session_config)
+        self.maps_model = clone_keras_model(maps_model, self.session)
+        self.head = clone_keras_model(head, self.session)
+        with self.session.graph.as_default(), self.session.as_default():
+            input_tensor = self.maps_model.inputs[0]
+            n_channels = self.maps_model.input_shape[-1]
+            self._input = tf.placeholder(input_tensor.dtype,
+                                         (None, None, None, n_channels))
+            frames = tf.cast(self._input, tf.float32)
+            frames_shape = tf.shape(frames)
+            batch = frames_shape[0]
+            height = frames_shape[1]
+            width = frames_shape[2]
+
+            small = tf.image.resize_area(frames, [height // scale_factor,
+                                                  width // scale_factor])
+            small = tf.cast(tf.round(small), input_tensor.dtype)
+            coarse = peak_layer.__class__.from_config(config)(self.maps_model(small))
+
+            # patches are cropped at integer positions, as in training
+            origins = tf.round(coarse[..., :2]) - self.patch_size // 2
+            origins = tf.reshape(origins, [-1, 2])
+            height_scale = tf.cast(height - 1, tf.float32)
+            width_scale = tf.cast(width - 1, tf.float32)
+            boxes = tf.stack([origins[:, 1] / height_scale,
+                              origins[:, 0] / width_scale,
+                              (origins[:, 1] + self.patch_size - 1) / height_scale,
+                              (origins[:, 0] + self.patch_size - 1) / width_scale], -1)
+            box_index = tf.reshape(tf.tile(tf.expand_dims(tf.range(batch), 1),
+                                           [1, self.n_keypoints]), [-1])
+            patches = tf.image.crop_and_resize(frames, boxes, box_index,
+                                               [self.patch_size, self.patch_size])
+            patches = tf.cast(tf.round(patches), self.head.inputs[0].dtype)
+            keypoint_index = tf.tile(tf.range(self.n_keypoints), [batch])
+            keypoint_index = tf.reshape(keypoint_index, [-1, 1])
+
+            patch_maps = self.head([patches, keypoint_index])
+            local = Maxima2D(refine='quadratic')(patch_maps)[:, 0]
+            keypoints = tf.concat([origins + local[:, :2], local[:, 2:]], -1)
+            keypoints = tf.reshape(keypoints, [batch, self.n_keypoints, 3])
+
+        self._predict = self.session.make_callable(keypoints, [self._input])
+        self._predict_coarse = self.session.make_callable(coarse, [self._input])
+        self.session.graph.finalize()
+
+    def predict(self, frames, batch_size=32, refine=True):
+        """
+        Predicts keypoints for full-resolution frames.
+
+        Parameters
+        ----------
+        frames : array, shape = (n_frames, height, width, channels)
+            The frames to predict. The height and width must be divisible
+            by `scale_factor`, and the downscaled shape must match the
+            input shape of the coarse model.
+        batch_size : int, default = 32
+            The number of frames to predict at once.
+        refine : bool, default = True
+            Whether to refine the coarse keypoints. If False,
+            the coarse keypoints are returned.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_frames, n_keypoints, 3)
+            The keypoints as [x, y, confidence] in frame coordinates.
+            The confidence of refined keypoints is the peak value
+            of the refinement head.
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 3:
+            frames = frames[np.newaxis]
+        if frames.shape[1] % self.scale_factor or frames.shape[2] % self.scale_factor:
+            raise ValueError('frame height and width must be divisible '
+                             'by scale_factor')
+        predict = self._predict if refine else self._predict_coarse
+        keypoints = [predict(frames[idx:idx + batch_size])
+                     for idx in range(0, frames.shape[0], batch_size)]
+        return np.concatenate(keypoints)
+
+    __call__ = predict
+
+    def close(self):
+        """Closes the session"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
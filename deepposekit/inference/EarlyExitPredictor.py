@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from ..models.session import create_session, clone_keras_model
+
+__all__ = ['EarlyExitPredictor']
+
+
+def _ancestors(tensors):
+    """Returns the ops that `tensors` depend on"""
+    ops = set()
+    stack = [tensor.op for tensor in tensors]
+    while stack:
+        op = stack.pop()
+        if op in ops:
+            continue
+        ops.add(op)
+        stack.extend(tensor.op for tensor in op.inputs)
+        stack.extend(op.control_inputs)
+    return ops
+
+
+def _descendants(tensor):
+    """Returns the ops that depend on `tensor`"""
+    ops = set()
+    stack = [tensor.op]
+    while stack:
+        op = stack.pop()
+        if op in ops:
+            continue
+        ops.add(op)
+        for output in op.outputs:
+            stack.extend(output.consumers())
+    return ops
+
+
+def _stack_boundaries(input_tensor, outputs):
+    """Returns, for each output after the first, the activations
+    computed for earlier outputs that are needed to compute it"""
+    active = _descendants(input_tensor)
+    computed = _ancestors(outputs[:1])
+    boundaries = [[input_tensor]]
+    for output in outputs[1:]:
+        ops = _ancestors([output])
+        new = ops - computed
+        boundary = [tensor for op in computed & active for tensor in op.outputs
+                    if any(consumer in new for consumer in tensor.consumers())]
+        boundaries.append(sorted(boundary, key=lambda tensor: tensor.name))
+        computed |= ops
+    return boundaries
+
+
+class EarlyExitPredictor:
+    """
+    Predicts keypoints with stacked models, skipping the remaining
+    stacks once the keypoint confidence is high enough.
+
+    Stacked models (StackedDenseNet and StackedHourglass) produce a full
+    set of confidence maps after every stack, but `predict_model` always
+    runs every stack and reads only the last output. This predictor
+    splits the graph of `train_model` at the stack boundaries and finds
+    the keypoints after each stack with the peak layer of `predict_model`.
+    After each stack, frames where every keypoint has a confidence of at
+    least `confidence_threshold` exit early with the keypoints of that
+    stack, and only the remaining frames are passed to the next stack.
+
+    The activations passed between stacks are found from the graph, so
+    any model with one output per stage can be used. The number of stacks
+    executed for each frame is recorded in `n_stacks_executed`, and
+    `mean_stacks` gives the average over all predicted frames.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with initialized `train_model` and `predict_model`.
+    confidence_threshold : float, default = 0.5
+        The minimum confidence, in the range [0, 1],
+        of every keypoint for a frame to exit early.
+    per_frame : bool, default = True
+        Whether frames exit independently. If False,
+        a batch exits only when every frame in the batch
+        is above the threshold.
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given,
+        the thread arguments are ignored.
+    """
+    def __init__(self, model, confidence_threshold=0.5, per_frame=True,
+                 intra_op_threads=None, inter_op_threads=None,
+                 session_config=None):
+        self.confidence_threshold = confidence_threshold
+        self.per_frame = per_frame
+
+        peak_layer = model.predict_model.layers[-1]
+        config = peak_layer.get_config()
+        self.n_keypoints = model.predict_model.output_shape[1]
+
+        self.session = create_session(intra_op_threads, inter_op_threads,
+                                      session_config=session_config)
+        self.train_model = clone_keras_model(model.train_model, self.session)
+        with self.session.graph.as_default(), self.session.as_default():
+            input_tensor = self.train_model.inputs[0]
+            outputs = self.train_model.outputs
+            keypoints = [peak_layer.__class__.from_config(config)(output)
+                         for output in outputs]
+            boundaries = _stack_boundaries(input_tensor, outputs)
+        self.n_stacks = len(outputs)
+        self._stages = []
+        for idx in range(self.n_stacks):
+            fetches = [keypoints[idx]]
+            if idx + 1 < self.n_stacks:
+                fetches += boundaries[idx + 1]
+            self._stages.append(self.session.make_callable(fetches,
+                                                           boundaries[idx]))
+        self.session.graph.finalize()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Clears the recorded number of stacks executed"""
+        self.n_stacks_executed = []
+
+    @property
+    def mean_stacks(self):
+        """The mean number of stacks executed per frame"""
+        if len(self.n_stacks_executed) == 0:
+            return np.nan
+        return np.concatenate(self.n_stacks_executed).mean()
+
+    def _predict_batch(self, x):
+        keypoints = np.zeros((x.shape[0], self.n_keypoints, 3), dtype=np.float32)
+        n_stacks = np.zeros(x.shape[0], dtype=np.int32)
+        remaining = np.arange(x.shape[0])
+        state = [x]
+        for idx, stage in enumerate(self._stages):
+            outputs = stage(*state)
+            keypoints[remaining] = outputs[0]
+            n_stacks[remaining] = idx + 1
+            state = outputs[1:]
+            if idx + 1 == self.n_stacks:
+                break
+            confident = outputs[0][..., 2].min(axis=-1) >= self.confidence_threshold
+            if not self.per_frame:
+                if confident.all():
+                    break
+                continue
+            remaining = remaining[~confident]
+            if remaining.size == 0:
+                break
+            state = [value[~confident] for value in state]
+        self.n_stacks_executed.append(n_stacks)
+        return keypoints
+
+    def predict(self, x, batch_size=32):
+        """
+        Predicts keypoints, exiting early for confident frames.
+
+        Parameters
+        ----------
+        x : array, shape = (n_samples, height, width, channels)
+            The images to predict.
+        batch_size : int, default = 32
+            The number of images to run at once.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_samples, n_keypoints, 3)
+            The keypoints from the first stack where the frame
+            is above the threshold, or from the last stack.
+        """
+        x = np.asarray(x)
+        if x.ndim == 3:
+            x = x[np.newaxis]
+        keypoints = [self._predict_batch(x[idx:idx + batch_size])
+                     for idx in range(0, x.shape[0], batch_size)]
+        return np.concatenate(keypoints)
+
+    __call__ = predict
+
+    def close(self):
+        """Closes the session"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
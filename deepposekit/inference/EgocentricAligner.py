@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from ..models.session import create_session
+
+__all__ = ['EgocentricAligner']
+
+
+def _window_size(size, crop_size):
+    """Returns the smallest window size >= crop_size with the same parity
+    as size, so the window and frame share the same center pixel"""
+    if crop_size >= size:
+        return size
+    if (size - crop_size) % 2 == 1:
+        crop_size += 1
+    return crop_size
+
+
+def _rotation_offsets(theta, height, width):
+    """The offsets of the projective transform used by
+    tf.contrib.image.rotate to rotate about the image center"""
+    cos = np.cos(theta)
+    sin = np.sin(theta)
+    x_offset = ((width - 1) - (cos * (width - 1) - sin * (height - 1))) / 2.
+    y_offset = ((height - 1) - (sin * (width - 1) + cos * (height - 1))) / 2.
+    return x_offset, y_offset
+
+
+class EgocentricAligner:
+    """
+    Aligns frames to a reference template and crops an egocentric window.
+
+    Each frame is registered to the template with `RegisterTranslation2D`
+    and `RegisterRotation2D`, shifted with `Translate2D` so the animal is
+    centered as in the template, and rotated with `Rotate2D` so it faces
+    the same direction. Only a window slightly larger than the crop is
+    rotated, so the cost of rotation depends on the crop size rather
+    than the frame size. As the rotation is estimated from the FFT
+    magnitude, which cannot distinguish an angle from the opposite
+    angle, both candidate rotations are applied and the one that best
+    matches the template is kept.
+
+    Pose models can then be trained and run on the small egocentric
+    crops, and the predicted keypoints mapped back to frame coordinates
+    with `to_frame`.
+
+    Parameters
+    ----------
+    template : array, shape = (height, width) or (height, width, channels)
+        A reference image of the animal, with the same shape as the
+        frames, centered in the image and facing the reference direction.
+    crop_shape : tuple of int
+        The (height, width) of the egocentric crops.
+    n_channels : int, default = 1
+        The number of channels of the frames.
+    rotation_resolution : float, default = 1.
+        The angular resolution of the rotation registration in degrees.
+    upsample_factor : int, default = 10
+        The upsampling factor for subpixel registration.
+    chunk_size : int, default = 64
+        The number of angles resampled at once
+        by the rotation registration.
+    interpolation : str, default = 'bilinear'
+        The interpolation used for translating and rotating,
+        one of 'bilinear' or 'nearest'.
+    dtype : str, default = 'uint8'
+        The dtype of the frames and crops.
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given,
+        the thread arguments are ignored.
+    """
+    def __init__(self, template, crop_shape, n_channels=1,
+                 rotation_resolution=1., upsample_factor=10, chunk_size=64,
+                 interpolation='bilinear', dtype='uint8',
+                 intra_op_threads=None, inter_op_threads=None,
+                 session_config=None):
+
+        template = np.asarray(template, dtype=np.float32)
+        if template.ndim == 3:
+            template = template.mean(-1)
+        elif template.ndim != 2:
+            raise ValueError('template must be a 2D or 3D array')
+        self.template = template
+        self.height, self.width = template.shape
+        self.n_channels = n_channels
+        if len(crop_shape) != 2:
+            raise ValueError('crop_shape must be (height, width)')
+        self.crop_shape = tuple(crop_shape)
+        if self.crop_shape[0] > self.height or self.crop_shape[1] > self.width:
+            raise ValueError('crop_shape must fit inside the template')
+        self.rotation_resolution = rotation_resolution
+        self.upsample_factor = upsample_factor
+        self.chunk_size = chunk_size
+        self.interpolation = interpolation
+        self.dtype = np.dtype(dtype)
+
+        # the window must contain the crop at any angle
+        diagonal = int(np.ceil(np.hypot(*self.crop_shape)))
+        self.window_shape = (_window_size(self.height, diagonal),
+                             _window_size(self.width, diagonal))
+        self.window_offset = ((self.height - self.window_shape[0]) // 2,
+                              (self.width - self.window_shape[1]) // 2)
+        self.crop_offset = ((self.window_shape[0] - self.crop_shape[0]) // 2,
+                            (self.window_shape[1] - self.crop_shape[1]) // 2)
+
+        self.session = create_session(intra_op_threads, inter_op_threads,
+                                      session_config=session_config)
+        self.graph = self.session.graph
+        with self.graph.as_default(), self.session.as_default():
+            self._build()
+        self.graph.finalize()
+
+    def _build(self):
+        from keras.backend import tf
+        from ..models.layers.convolutional import (RegisterTranslation2D,
+                                                   RegisterRotation2D,
+                                                   Rotate2D, Translate2D)
+
+        self._input = tf.placeholder(tf.as_dtype(self.dtype),
+                                     (None, self.height, self.width,
+                                      self.n_channels))
+        frames = tf.cast(self._input, tf.float32)
+        gray = tf.reduce_mean(frames, -1, keepdims=True)
+        template = tf.constant(self.template[np.newaxis, ..., np.newaxis])
+
+        # shifts are [x, y], angles are radians
+        shifts = RegisterTranslation2D(self.upsample_factor)([gray, template])
+        angles = RegisterRotation2D(self.upsample_factor,
+                                    self.rotation_resolution,
+                                    chunk_size=self.chunk_size)([gray, template])
+
+        translated = Translate2D(self.interpolation)([frames, shifts])
+        row, col = self.window_offset
+        window = translated[:, row:row + self.window_shape[0],
+                            col:col + self.window_shape[1]]
+
+        row, col = self.crop_offset
+        template_crop = self.template[self.window_offset[0] + row:
+                                      self.window_offset[0] + row + self.crop_shape[0],
+                                      self.window_offset[1] + col:
+                                      self.window_offset[1] + col + self.crop_shape[1]]
+        template_crop = template_crop - template_crop.mean()
+        template_crop = tf.constant(template_crop[np.newaxis])
+
+        crops = []
+        scores = []
+        thetas = [-angles[:, 0], np.pi - angles[:, 0]]
+        for theta in thetas:
+            crop = Rotate2D(self.interpolation)([window, theta])
+            crop = crop[:, row:row + self.crop_shape[0],
+                        col:col + self.crop_shape[1]]
+            gray_crop = tf.reduce_mean(crop, -1)
+            gray_crop -= tf.reduce_mean(gray_crop, [1, 2], keepdims=True)
+            norm = tf.sqrt(tf.reduce_sum(gray_crop**2, [1, 2])) + 1e-7
+            scores.append(tf.reduce_sum(gray_crop * template_crop, [1, 2]) / norm)
+            crops.append(crop)
+
+        flip = scores[1] > scores[0]
+        crop = tf.where(flip, crops[1], crops[0])
+        theta = tf.where(flip, thetas[1], thetas[0])
+        if self.dtype.kind in 'ui':
+            info = np.iinfo(self.dtype)
+            crop = tf.clip_by_value(tf.round(crop), info.min, info.max)
+        crop = tf.cast(crop, tf.as_dtype(self.dtype))
+        transforms = tf.concat([shifts, tf.expand_dims(theta, 1)], -1)
+
+        self._align = self.session.make_callable([crop, transforms],
+                                                 [self._input])
+
+    def align(self, frames, batch_size=32):
+        """
+        Aligns frames to the template and crops the egocentric window.
+
+        Parameters
+        ----------
+        frames : array, shape = (n_frames, height, width, channels)
+            The frames to align.
+        batch_size : int, default = 32
+            The number of frames to align at once.
+
+        Returns
+        -------
+        crops : array, shape = (n_frames, crop_height, crop_width, channels)
+            The egocentric crops.
+        transforms : array, shape = (n_frames, 3)
+            The [x, y] translation and rotation in radians applied to each
+            frame, for mapping keypoints with `to_frame` and `to_crop`.
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 3:
+            frames = frames[..., np.newaxis]
+        crops = []
+        transforms = []
+        for idx in range(0, frames.shape[0], batch_size):
+            crop, transform = self._align(frames[idx:idx + batch_size])
+            crops.append(crop)
+            transforms.append(transform)
+        return np.concatenate(crops), np.concatenate(transforms)
+
+    def to_frame(self, keypoints, transforms):
+        """
+        Maps keypoints from crop coordinates to frame coordinates.
+
+        Parameters
+        ----------
+        keypoints : array, shape = (n_frames, n_keypoints, 2 or 3)
+            The keypoints as [x, y] or [x, y, confidence].
+        transforms : array, shape = (n_frames, 3)
+            The transforms returned by `align`.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_frames, n_keypoints, 2 or 3)
+            The keypoints in frame coordinates.
+        """
+        keypoints = np.array(keypoints, dtype=np.float64)
+        x = keypoints[..., 0] + self.crop_offset[1]
+        y = keypoints[..., 1] + self.crop_offset[0]
+
+        theta = transforms[:, 2:3]
+        cos = np.cos(theta)
+        sin = np.sin(theta)
+        x_offset, y_offset = _rotation_offsets(theta, *self.window_shape)
+        x, y = (cos * x - sin * y + x_offset,
+                sin * x + cos * y + y_offset)
+
+        keypoints[..., 0] = x + self.window_offset[1] - transforms[:, 0:1]
+        keypoints[..., 1] = y + self.window_offset[0] - transforms[:, 1:2]
+        return keypoints
+
+    def to_crop(self, keypoints, transforms):
+        """
+        Maps keypoints from frame coordinates to crop coordinates,
+        e.g. to create egocentric training data from annotations.
+
+        Parameters
+        ----------
+        keypoints : array, shape = (n_frames, n_keypoints, 2 or 3)
+            The keypoints as [x, y] or [x, y, confidence].
+        transforms : array, shape = (n_frames, 3)
+            The transforms returned by `align`.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_frames, n_keypoints, 2 or 3)
+            The keypoints in crop coordinates.
+        """
+        keypoints = np.array(keypoints, dtype=np.float64)
+        x = keypoints[..., 0] + transforms[:, 0:1] - self.window_offset[1]
+        y = keypoints[..., 1] + transforms[:, 1:2] - self.window_offset[0]
+
+        theta = transforms[:, 2:3]
+        cos = np.cos(theta)
+        sin = np.sin(theta)
+        x_offset, y_offset = _rotation_offsets(theta, *self.window_shape)
+        x = x - x_offset
+        y = y - y_offset
+        x, y = (cos * x + sin * y,
+                -sin * x + cos * y)
+
+        keypoints[..., 0] = x - self.crop_offset[1]
+        keypoints[..., 1] = y - self.crop_offset[0]
+        return keypoints
+
+    def predict(self, model, frames, batch_size=32):
+        """
+        Predicts keypoints on egocentric crops and
+        maps them back to frame coordinates.
+
+        Parameters
+        ----------
+        model : deepposekit BaseModel
+            A model trained on egocentric crops with `crop_shape`.
+        frames : array, shape = (n_frames, height, width, channels)
+            The frames to predict.
+        batch_size : int, default = 32
+            The number of frames to align and predict at once.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_frames, n_keypoints, 3)
+            The keypoints as [x, y, confidence] in frame coordinates.
+        """
+        crops, transforms = self.align(frames, batch_size)
+        keypoints = model.predict_model.predict(crops, batch_size=batch_size)
+        return self.to_frame(keypoints, transforms)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
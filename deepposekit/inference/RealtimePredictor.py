@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import time
+import warnings
+
+from ..models.session import create_session, clone_predict_model
+from ..utils.filters import KeypointFilter
+
+__all__ = ['RealtimePredictor']
+
+
+class RealtimePredictor:
+    """
+    Low-latency single-frame predictor for closed-loop experiments.
+
+    Wraps the `predict_model` of a pose model in its own session with
+    a fixed thread count, and runs it through a session callable with
+    a preallocated input buffer. This avoids the per-call
+    overhead of keras.Model.predict (input validation, batching, and
+    concatenating outputs), which dominates latency for single frames.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`,
+        e.g. from deepposekit.models.load_model
+    n_threads : int, default = 1
+        The number of threads used by TensorFlow for each op and
+        for running ops in parallel. For single frames, a small fixed
+        number avoids scheduling jitter from oversubscribed cores.
+    keypoint_filter : bool or KeypointFilter, default = False
+        Whether to filter the predicted keypoints online. If True,
+        a KeypointFilter with default settings is used. Filtering
+        also allows dropped frames (passing None) to be bridged.
+    latency_budget : float, default = None
+        The latency budget per frame in milliseconds. A warning is
+        issued when a frame exceeds the budget.
+    n_history : int, default = 10000
+        The number of recent per-frame latencies to keep
+        for computing latency statistics.
+    warmup : int, default = 10
+        The number of frames to run on initialization to
+        allocate memory and initialize TensorFlow kernels.
+    session_config : SessionConfig, default = None
+        A full session configuration, e.g. to pin the process
+        to specific cores. If given, `n_threads` is ignored.
+
+    Attributes
+    ----------
+    n_frames : int
+        The number of frames predicted so far.
+    n_over_budget : int
+        The number of frames that exceeded `latency_budget`.
+    """
+    def __init__(self, model, n_threads=1, keypoint_filter=False,
+                 latency_budget=None, n_history=10000, warmup=10,
+                 session_config=None):
+
+        self.n_threads = n_threads
+        self.latency_budget = latency_budget
+        self.n_history = n_history
+
+        self.session = create_session(n_threads, n_threads,
+                                      session_config=session_config)
+        self.predict_model = clone_predict_model(model, self.session)
+
+        input_tensor = self.predict_model.inputs[0]
+        output_tensor = self.predict_model.outputs[0]
+        input_shape = tuple(self.predict_model.input_shape[1:])
+        output_shape = tuple(self.predict_model.output_shape[1:])
+        self._input_dtype = input_tensor.dtype.as_numpy_dtype
+        if None in input_shape:
+            # allocated for the shape of the first frame
+            self._input = None
+        else:
+            self._input = np.zeros((1,) + input_shape, dtype=self._input_dtype)
+        self._n_channels = input_shape[-1]
+        self._predict = self.session.make_callable(output_tensor,
+                                                   [input_tensor])
+
+        if keypoint_filter is True:
+            keypoint_filter = KeypointFilter(output_shape[0])
+        elif keypoint_filter is False:
+            keypoint_filter = None
+        elif not isinstance(keypoint_filter, (KeypointFilter, type(None))):
+            raise TypeError('keypoint_filter must be bool or KeypointFilter')
+        self.keypoint_filter = keypoint_filter
+
+        self._latency = np.zeros(n_history)
+        self.n_frames = 0
+        self.n_over_budget = 0
+
+        if self._input is not None:
+            for idx in range(warmup):
+                self._predict(self._input)
+        if self.keypoint_filter is not None:
+            self.keypoint_filter.reset()
+
+    def __call__(self, frame):
+        """
+        Predict keypoints for a single frame.
+
+        Parameters
+        ----------
+        frame : array, shape = (height, width, channels) or None
+            The frame to predict. If None, the frame is treated as
+            dropped and the keypoints are bridged by the keypoint filter.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_keypoints, 3)
+            The keypoints as [x, y, confidence].
+        """
+        start = time.perf_counter()
+        if frame is None:
+            if self.keypoint_filter is None:
+                raise ValueError('frame cannot be None without '
+                                 'a keypoint_filter to bridge dropped frames')
+            keypoints = self.keypoint_filter(None)
+        else:
+            if self._input is None or frame.size != self._input[0].size:
+                # reallocate for a new resolution of a variable shape model
+                shape = frame.shape[:2] + (self._n_channels,)
+                self._input = np.zeros((1,) + shape, dtype=self._input_dtype)
+            self._input[0] = frame.reshape(self._input.shape[1:])
+            keypoints = self._predict(self._input)[0]
+            if self.keypoint_filter is not None:
+                keypoints = self.keypoint_filter(keypoints)
+        latency = (time.perf_counter() - start) * 1000.
+
+        self._latency[self.n_frames % self.n_history] = latency
+        self.n_frames += 1
+        if self.latency_budget and latency > self.latency_budget:
+            self.n_over_budget += 1
+            warnings.warn('frame latency exceeded the latency budget '
+                          'of {} ms'.format(self.latency_budget),
+                          RuntimeWarning)
+
+        return keypoints
+
+    predict = __call__
+
+    @property
+    def latency(self):
+        """The recent per-frame latencies in milliseconds"""
+        n_frames = np.minimum(self.n_frames, self.n_history)
+        return self._latency[:n_frames]
+
+    def latency_histogram(self, bins=50):
+        """Returns a histogram of the recent per-frame latencies
+
+        Parameters
+        ----------
+        bins : int or array, default = 50
+            The bins passed to np.histogram.
+
+        Returns
+        -------
+        counts : array
+            The number of frames in each bin.
+        edges : array
+            The bin edges in milliseconds.
+        """
+        return np.histogram(self.latency, bins)
+
+    def latency_summary(self):
+        """Returns summary statistics of the recent per-frame latencies"""
+        latency = self.latency
+        if latency.shape[0] == 0:
+            raise ValueError('no frames have been predicted')
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        return {'n_frames': self.n_frames,
+                'n_over_budget': self.n_over_budget,
+                'mean': latency.mean(),
+                'median': p50,
+                'p95': p95,
+                'p99': p99,
+                'max': latency.max()}
+
+    def close(self):
+        self.session.close()
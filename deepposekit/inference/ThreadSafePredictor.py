@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import threading
+import queue
+import time
+
+from ..models.session import create_session, clone_predict_model
+
+__all__ = ['ThreadSafePredictor']
+
+
+class _Request:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ThreadSafePredictor:
+    """
+    Thread-safe inference wrapper for pose models.
+
+    keras.Model.predict relies on the default graph and session of the
+    calling thread and builds its predict function lazily, so it cannot
+    be called from multiple threads without manually managing graph
+    contexts. This wrapper rebuilds `predict_model` in a graph and session
+    it owns, creates the predict function once, and finalizes the graph.
+    `predict` can then be called concurrently from any thread.
+
+    By default, concurrent calls run directly on the shared session, which
+    is thread-safe and shares a single copy of the weights. With
+    `batching=True`, calls are instead placed on an internal request queue
+    and a worker thread merges pending requests into larger batches,
+    which improves throughput when many threads submit single frames.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`,
+        e.g. from deepposekit.models.load_model
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops.
+        Default is None, which uses all available cores.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops
+        (or concurrent calls) in parallel. Default is None,
+        which uses all available cores.
+    batching : bool, default = False
+        Whether to merge concurrent requests into batches
+        using an internal request queue.
+    max_batch_size : int, default = 32
+        The maximum number of frames to merge into one batch
+        when `batching` is True.
+    batch_timeout : float, default = 0.002
+        The maximum time in seconds to wait for more requests
+        before running a partially filled batch.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given,
+        the thread arguments are ignored.
+    """
+    def __init__(self, model, intra_op_threads=None, inter_op_threads=None,
+                 batching=False, max_batch_size=32, batch_timeout=0.002,
+                 session_config=None):
+
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.batching = batching
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+
+        self.session = create_session(intra_op_threads, inter_op_threads,
+                                      session_config=session_config)
+        self.graph = self.session.graph
+        self.predict_model = clone_predict_model(model, self.session)
+        self._predict = self.session.make_callable(self.predict_model.outputs[0],
+                                                   [self.predict_model.inputs[0]])
+        self.graph.finalize()
+
+        self._input_ndim = len(self.predict_model.input_shape)
+        self._closed = False
+        # guards `_closed`, so no request is queued after close
+        self._lock = threading.Lock()
+        if self.batching:
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run_worker)
+            self._worker.daemon = True
+            self._worker.start()
+
+    def predict(self, x, batch_size=None):
+        """
+        Predict keypoints for a batch of images.
+        Safe to call concurrently from multiple threads.
+
+        Parameters
+        ----------
+        x : array, shape = (n_samples, height, width, channels)
+            The images to predict. A single image without
+            the batch dimension is also accepted.
+        batch_size : int, default = None
+            The maximum number of images to run at once.
+            Default is None, which runs all images at once.
+            Ignored when `batching` is True.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_samples, n_keypoints, 3)
+        """
+        if self._closed:
+            raise RuntimeError('predictor is closed')
+        x = np.asarray(x)
+        if x.ndim == self._input_ndim - 1:
+            x = x[np.newaxis]
+        if self.batching:
+            request = _Request(x)
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError('predictor is closed')
+                self._queue.put(request)
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+            return request.outputs
+        if batch_size is None or batch_size >= x.shape[0]:
+            return self._predict(x)
+        outputs = [self._predict(x[idx:idx + batch_size])
+                   for idx in range(0, x.shape[0], batch_size)]
+        return np.concatenate(outputs)
+
+    __call__ = predict
+
+    def _get_requests(self):
+        request = self._queue.get()
+        if request is None:
+            return None
+        requests = [request]
+        n_samples = request.inputs.shape[0]
+        deadline = time.perf_counter() + self.batch_timeout
+        while n_samples < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # process what we have, then stop
+                self._queue.put(None)
+                break
+            requests.append(request)
+            n_samples += request.inputs.shape[0]
+        return requests
+
+    def _run_worker(self):
+        while True:
+            requests = self._get_requests()
+            if requests is None:
+                self._cancel_pending()
+                break
+            try:
+                inputs = np.concatenate([request.inputs for request in requests])
+                outputs = self._predict(inputs)
+                idx = 0
+                for request in requests:
+                    n_samples = request.inputs.shape[0]
+                    request.outputs = outputs[idx:idx + n_samples]
+                    idx += n_samples
+            except Exception as error:
+                for request in requests:
+                    request.error = error
+            for request in requests:
+                request.done.set()
+
+    def _cancel_pending(self):
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.error = RuntimeError('predictor is closed')
+                request.done.set()
+
+    def close(self):
+        """Stops the worker thread and closes the session"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self.batching:
+                # requests queued before this are processed or cancelled
+                self._queue.put(None)
+        if self.batching:
+            self._worker.join()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+from ..models.session import create_session, clone_keras_model
+
+__all__ = ['TiledPredictor']
+
+
+def _tile_starts(size, tile_size, stride):
+    """Returns the start of each tile along an axis,
+    with the last tile aligned to the end of the axis"""
+    starts = list(range(0, size - tile_size + 1, stride))
+    if starts[-1] != size - tile_size:
+        starts.append(size - tile_size)
+    return starts
+
+
+def _blend_weights(size, overlap):
+    """Returns linear ramps over the overlap at both ends of a tile"""
+    if overlap <= 0:
+        return np.ones(size, dtype=np.float32)
+    idx = np.arange(size, dtype=np.float32)
+    weights = np.minimum((idx + 1) / (overlap + 1), (size - idx) / (overlap + 1))
+    return np.minimum(weights, 1.)
+
+
+class TiledPredictor:
+    """
+    Predicts keypoints on frames larger than the model input shape.
+
+    Frames are split into overlapping tiles with the input shape of the
+    model, and tiles from several frames are batched together through
+    the confidence map output of the model. The confidence maps of the
+    tiles are stitched into full-frame maps, using linear blending
+    weights in the overlap regions so there are no seams at tile borders,
+    and the keypoints are found on the stitched maps with the same
+    peak finding layer as `predict_model`.
+
+    Only the keypoint channels of the confidence maps are stitched, and
+    frames are processed `frames_per_chunk` at a time, so memory is
+    bounded by the chunk size rather than the number of frames.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with initialized `train_model` and `predict_model`.
+    tile_shape : tuple of int, default = None
+        The (height, width) of the tiles. Default is None, which uses
+        the input shape of the model. This must be given for models with
+        a variable input shape, and be divisible by `model.input_divisor`.
+    overlap : int, default = None
+        The overlap between neighbouring tiles in input pixels, rounded to
+        a multiple of the confidence map downsampling. Default is None,
+        which uses a quarter of the tile size.
+    batch_size : int, default = 32
+        The number of tiles to run through the model at once.
+    frames_per_chunk : int, default = 4
+        The number of frames stitched at once.
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given,
+        the thread arguments are ignored.
+    """
+    def __init__(self, model, tile_shape=None, overlap=None, batch_size=32,
+                 frames_per_chunk=4,
+                 intra_op_threads=None, inter_op_threads=None,
+                 session_config=None):
+        from keras import Model
+        from keras.backend import tf
+
+        self.batch_size = batch_size
+        self.frames_per_chunk = frames_per_chunk
+
+        maps_model = Model(model.train_model.inputs[0],
+                           model.train_model.outputs[-1])
+        peak_layer = model.predict_model.layers[-1]
+        self.n_keypoints = model.predict_model.output_shape[1]
+
+        self.session = create_session(intra_op_threads, inter_op_threads,
+                                      session_config=session_config)
+        self.maps_model = clone_keras_model(maps_model, self.session)
+        with self.session.graph.as_default(), self.session.as_default():
+            maps = self.maps_model.outputs[0][..., :self.n_keypoints]
+            maps = tf.cast(maps, tf.float32)
+            self._stitched = tf.placeholder(tf.float32,
+                                            (None, None, None, self.n_keypoints))
+            config = peak_layer.get_config()
+            keypoints = peak_layer.__class__.from_config(config)(self._stitched)
+        self._maps = self.session.make_callable(maps, [self.maps_model.inputs[0]])
+        self._peaks = self.session.make_callable(keypoints, [self._stitched])
+        self.session.graph.finalize()
+
+        if tile_shape is None:
+            tile_shape = self.maps_model.input_shape[1:3]
+            if None in tile_shape:
+                raise ValueError('tile_shape must be given for models '
+                                 'with a variable input shape')
+        else:
+            model.check_input_shape(tile_shape)
+        self.tile_shape = tuple(tile_shape)
+        self.scale = int(config['coordinate_scale'])
+        map_shape = (self.tile_shape[0] // self.scale,
+                     self.tile_shape[1] // self.scale)
+        if overlap is None:
+            overlap = min(self.tile_shape) // 4
+        self.overlap = (overlap // self.scale) * self.scale
+        if self.overlap >= min(self.tile_shape):
+            raise ValueError('overlap must be smaller than the tile shape')
+
+        map_overlap = self.overlap // self.scale
+        self.weights = np.outer(_blend_weights(map_shape[0], map_overlap),
+                                _blend_weights(map_shape[1], map_overlap))
+
+    def _tiles(self, shape):
+        """Returns the padded frame shape and tile origins for a frame shape"""
+        padded = []
+        for size, tile_size in zip(shape, self.tile_shape):
+            size = int(np.ceil(size / float(self.scale))) * self.scale
+            padded.append(max(size, tile_size))
+        row_starts = _tile_starts(padded[0], self.tile_shape[0],
+                                  self.tile_shape[0] - self.overlap)
+        col_starts = _tile_starts(padded[1], self.tile_shape[1],
+                                  self.tile_shape[1] - self.overlap)
+        origins = [(row, col) for row in row_starts for col in col_starts]
+        return tuple(padded), origins
+
+    def predict_maps(self, frames):
+        """
+        Predicts stitched confidence maps for a chunk of frames.
+
+        Parameters
+        ----------
+        frames : array, shape = (n_frames, height, width, channels)
+            The frames to predict.
+
+        Returns
+        -------
+        maps : array, shape = (n_frames, map_height, map_width, n_keypoints)
+            The stitched confidence maps of the keypoints, where the map
+            shape is the frame shape divided by the map downsampling.
+        """
+        n_frames, height, width = frames.shape[:3]
+        padded, origins = self._tiles((height, width))
+        if padded != (height, width):
+            padding = [(0, 0), (0, padded[0] - height), (0, padded[1] - width), (0, 0)]
+            frames = np.pad(frames, padding, mode='constant')
+
+        map_height = padded[0] // self.scale
+        map_width = padded[1] // self.scale
+        tile_height = self.tile_shape[0] // self.scale
+        tile_width = self.tile_shape[1] // self.scale
+        maps = np.zeros((n_frames, map_height, map_width, self.n_keypoints),
+                        dtype=np.float32)
+        norm = np.zeros((map_height, map_width), dtype=np.float32)
+        for row, col in origins:
+            row //= self.scale
+            col //= self.scale
+            norm[row:row + tile_height, col:col + tile_width] += self.weights
+
+        tiles = [(frame_idx, row, col) for frame_idx in range(n_frames)
+                 for row, col in origins]
+        for idx in range(0, len(tiles), self.batch_size):
+            batch = tiles[idx:idx + self.batch_size]
+            inputs = np.stack([frames[frame_idx,
+                                      row:row + self.tile_shape[0],
+                                      col:col + self.tile_shape[1]]
+                               for frame_idx, row, col in batch])
+            outputs = self._maps(inputs) * self.weights[..., np.newaxis]
+            for (frame_idx, row, col), output in zip(batch, outputs):
+                row //= self.scale
+                col //= self.scale
+                maps[frame_idx, row:row + tile_height,
+                     col:col + tile_width] += output
+
+        maps /= norm[..., np.newaxis]
+        map_height = int(np.ceil(height / float(self.scale)))
+        map_width = int(np.ceil(width / float(self.scale)))
+        return maps[:, :map_height, :map_width]
+
+    def predict(self, frames):
+        """
+        Predicts keypoints for frames of any size.
+
+        Parameters
+        ----------
+        frames : array, shape = (n_frames, height, width, channels)
+            The frames to predict.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_frames, n_keypoints, 3)
+            The keypoints as [x, y, confidence] in frame coordinates.
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 3:
+            frames = frames[np.newaxis]
+        keypoints = []
+        for idx in range(0, frames.shape[0], self.frames_per_chunk):
+            maps = self.predict_maps(frames[idx:idx + self.frames_per_chunk])
+            # SubpixelMaxima2D needs even map dimensions, and zero padding
+            # cannot move a peak outside of the frame
+            padding = [(0, 0), (0, maps.shape[1] % 2), (0, maps.shape[2] % 2), (0, 0)]
+            maps = np.pad(maps, padding, mode='constant')
+            keypoints.append(self._peaks(maps))
+        return np.concatenate(keypoints)
+
+    __call__ = predict
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import cv2
+
+from ..models.session import create_session, clone_predict_model
+
+__all__ = ['TrackingPredictor']
+
+
+class TrackingPredictor:
+    """
+    Video predictor that tracks the animal and predicts on crops.
+
+    When the animal covers a small part of the frame, most of the cost
+    of full-frame inference is spent on background. This predictor runs
+    `detector` on the first frame to locate the animal, then predicts
+    each following frame with `model` on a crop at the model's input
+    shape, centered on the keypoints from the previous frame. Keypoints
+    are translated back to frame coordinates.
+
+    When the mean confidence of the predicted keypoints (the third
+    column of the `Maxima2D` output) drops below `confidence_threshold`,
+    e.g. because the animal moved out of the crop, the frame is passed
+    to `detector` again and re-predicted on a crop at the detected
+    location.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The pose model, which predicts on crops with
+        the shape of its `predict_model` input.
+    detector : deepposekit BaseModel
+        A model that predicts on full frames, used to locate the animal.
+        This can be the full pose model or a cheaper model with fewer
+        keypoints. If its input shape differs from the frames, frames are
+        resized to its input shape, so a model trained on downsampled
+        frames can be used as a cheap detector.
+    crop_shape : tuple of int, default = None
+        The (height, width) of the crops. Default is None, which uses the
+        input shape of `model`. This must be given if `model` has a
+        variable input shape. If `detector` has a variable input shape,
+        it predicts on the frames at their original resolution.
+    confidence_threshold : float, default = 0.3
+        The minimum mean keypoint confidence for the crop predictions
+        to be accepted without re-detecting the animal.
+    n_threads : int, default = 1
+        The number of threads used by TensorFlow for each op
+        and for running ops in parallel.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given,
+        `n_threads` is ignored.
+
+    Attributes
+    ----------
+    n_frames : int
+        The number of frames predicted so far.
+    n_detections : int
+        The number of frames that were passed to `detector`.
+    """
+    def __init__(self, model, detector, crop_shape=None,
+                 confidence_threshold=0.3, n_threads=1, session_config=None):
+        self.confidence_threshold = confidence_threshold
+        self.session = create_session(n_threads, n_threads,
+                                      session_config=session_config)
+        self.predict_model = clone_predict_model(model, self.session)
+        self.detector_model = clone_predict_model(detector, self.session)
+        self._predict = self.session.make_callable(self.predict_model.outputs[0],
+                                                   [self.predict_model.inputs[0]])
+        self._detect = self.session.make_callable(self.detector_model.outputs[0],
+                                                  [self.detector_model.inputs[0]])
+        self.session.graph.finalize()
+
+        if crop_shape is None:
+            crop_shape = self.predict_model.input_shape[1:3]
+            if None in crop_shape:
+                raise ValueError('crop_shape must be given for models '
+                                 'with a variable input shape')
+        else:
+            model.check_input_shape(crop_shape)
+        self.crop_shape = tuple(crop_shape)
+        self.detector_shape = tuple(self.detector_model.input_shape[1:3])
+        self.reset()
+
+    def reset(self):
+        """Resets the tracking state, e.g. before a new video"""
+        self.center = None
+        self.n_frames = 0
+        self.n_detections = 0
+
+    def _get_center(self, keypoints):
+        confident = keypoints[:, 2] >= self.confidence_threshold
+        if not np.any(confident):
+            confident = np.ones(keypoints.shape[0], dtype=bool)
+        coords = keypoints[confident, :2]
+        # the bounding box center is robust to uneven keypoint density
+        return (coords.min(0) + coords.max(0)) / 2.
+
+    def _detect_center(self, frame):
+        height, width = frame.shape[:2]
+        if None in self.detector_shape or (height, width) == self.detector_shape:
+            resized = frame
+        else:
+            resized = cv2.resize(frame, self.detector_shape[::-1],
+                                 interpolation=cv2.INTER_AREA)
+            resized = resized.reshape(self.detector_shape + frame.shape[2:])
+        keypoints = self._detect(resized[np.newaxis])[0]
+        keypoints[:, 0] *= width / float(resized.shape[1])
+        keypoints[:, 1] *= height / float(resized.shape[0])
+        self.n_detections += 1
+        return self._get_center(keypoints)
+
+    def _predict_crop(self, frame, center):
+        height, width = frame.shape[:2]
+        crop_height, crop_width = self.crop_shape
+        # keep the crop inside the frame
+        row = int(np.clip(np.round(center[1] - crop_height / 2.),
+                          0, height - crop_height))
+        col = int(np.clip(np.round(center[0] - crop_width / 2.),
+                          0, width - crop_width))
+        crop = frame[row:row + crop_height, col:col + crop_width]
+        keypoints = self._predict(crop[np.newaxis])[0]
+        keypoints[:, 0] += col
+        keypoints[:, 1] += row
+        return keypoints
+
+    def __call__(self, frame):
+        """
+        Predict keypoints for the next frame of a video.
+
+        Parameters
+        ----------
+        frame : array, shape = (height, width, channels)
+            The frame to predict.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_keypoints, 3)
+            The keypoints as [x, y, confidence] in frame coordinates.
+        """
+        frame = np.asarray(frame)
+        if frame.ndim == 2:
+            frame = frame[..., np.newaxis]
+        if (frame.shape[0] < self.crop_shape[0] or
+                frame.shape[1] < self.crop_shape[1]):
+            raise ValueError('frames must be at least as large as '
+                             'the model input shape {}'.format(self.crop_shape))
+
+        detected = self.center is None
+        if detected:
+            self.center = self._detect_center(frame)
+        keypoints = self._predict_crop(frame, self.center)
+        if (keypoints[:, 2].mean() < self.confidence_threshold and
+                not detected):
+            self.center = self._detect_center(frame)
+            keypoints = self._predict_crop(frame, self.center)
+
+        self.center = self._get_center(keypoints)
+        self.n_frames += 1
+        return keypoints
+
+    predict_frame = __call__
+
+    def predict(self, frames):
+        """
+        Predict keypoints for a sequence of video frames.
+
+        Parameters
+        ----------
+        frames : array or iterable
+            The frames to predict in order, as an array with shape
+            (n_frames, height, width, channels) or an iterable of
+            frames or batches of frames, such as a VideoGenerator.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_frames, n_keypoints, 3)
+            The keypoints as [x, y, confidence] in frame coordinates.
+        """
+        keypoints = []
+        for batch in frames:
+            batch = np.asarray(batch)
+            if batch.ndim == 4:
+                keypoints.extend([self(frame) for frame in batch])
+            else:
+                keypoints.append(self(batch))
+        return np.stack(keypoints)
+
+    @property
+    def detection_rate(self):
+        """The fraction of frames that were passed to the detector"""
+        return self.n_detections / float(max(self.n_frames, 1))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,10 @@
+from __future__ import absolute_import
+
+from .RealtimePredictor import RealtimePredictor
+from .ThreadSafePredictor import ThreadSafePredictor
+from .BatchScheduler import BatchScheduler
+from .EgocentricAligner import EgocentricAligner
+from .TrackingPredictor import TrackingPredictor
+from .TiledPredictor import TiledPredictor
+from .CoarseToFinePredictor import CoarseToFinePredictor
+from .EarlyExitPredictor import EarlyExitPredictor
@@ -248,18 +248,23 @@ class TrainingGenerator(Sequence):
             batch_index = self.train_index[indexes]
         return self.generator[batch_index]
 
+    def draw_confidence_maps(self, X, y):
+        """Draws the confidence maps for a batch of keypoints"""
+        y = draw_confidence_maps(X, y, self.graph,
+                                 self.output_shape, self.use_edges,
+                                 sigma=self.output_sigma)
+        y *= 255
+        if self.use_edges and self.edge_scale < 1.0:
+            y[..., self.n_keypoints:] *= self.edge_scale
+        return y
+
     def generate_batch(self, indexes):
         """Generates data containing batch_size samples"""
         X, y = self.load_batch(indexes)
         if self.augmenter and not self.validation:
             X, y = self.augmenter(X, y)
         if self.confidence:
-            y = draw_confidence_maps(X, y, self.graph,
-                                     self.output_shape, self.use_edges,
-                                     sigma=self.output_sigma)
-            y *= 255
-            if self.use_edges and self.edge_scale < 1.0:
-                y[..., self.n_keypoints:] *= self.edge_scale
+            y = self.draw_confidence_maps(X, y)
         if self.n_outputs > 1:
             y = [y for idx in range(self.n_outputs)]
 
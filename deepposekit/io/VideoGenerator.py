@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from keras.utils import Sequence
+import numpy as np
+import cv2
+import os
+
+__all__ = ['VideoGenerator']
+
+
+class VideoGenerator(Sequence):
+    """
+    Reads batches of frames from a video file.
+
+    Frames are read sequentially, so reading batches in order
+    avoids seeking. Random access is supported but slower.
+
+    Parameters
+    ----------
+    videopath : str
+        The path to the video file.
+    batch_size : int, default = 1
+        The number of frames in each batch.
+    start : int, default = 0
+        The index of the first frame to read.
+    stop : int, default = None
+        The index after the last frame to read.
+        Default is None, which reads to the end of the video.
+    grayscale : bool, default = False
+        Whether to convert frames to grayscale with
+        shape (height, width, 1).
+    """
+    def __init__(self, videopath, batch_size=1, start=0, stop=None,
+                 grayscale=False):
+        if isinstance(videopath, str):
+            if os.path.exists(videopath):
+                self.videopath = videopath
+            else:
+                raise ValueError('videopath file does not exist')
+        else:
+            raise TypeError('videopath must be type `str`')
+
+        self.batch_size = batch_size
+        self.grayscale = grayscale
+        self.stream = cv2.VideoCapture(self.videopath)
+        if not self.stream.isOpened():
+            raise IOError('cannot open video file: ' + self.videopath)
+        self.total_frames = int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.stream.get(cv2.CAP_PROP_FPS)
+        self.height = int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.n_channels = 1 if grayscale else 3
+
+        if stop is None or stop > self.total_frames:
+            stop = self.total_frames
+        if not 0 <= start <= stop:
+            raise ValueError('start must be in range 0 <= start <= stop')
+        self.start = start
+        self.stop = stop
+        self.n_frames = stop - start
+        self._position = 0
+        self._seek(start)
+
+    def _seek(self, index):
+        if index != self._position:
+            self.stream.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self._position = index
+
+    def read(self):
+        """Reads the next frame, or returns None at the end of the video"""
+        ret, frame = self.stream.read()
+        if not ret:
+            return None
+        self._position += 1
+        if self.grayscale:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)[..., np.newaxis]
+        return frame
+
+    def __len__(self):
+        """The number of batches"""
+        return int(np.ceil(self.n_frames / float(self.batch_size)))
+
+    def __getitem__(self, index):
+        """Reads one batch of frames"""
+        if index >= len(self) or index < 0:
+            raise IndexError
+        idx0 = self.start + index * self.batch_size
+        idx1 = np.minimum(idx0 + self.batch_size, self.stop)
+        self._seek(idx0)
+        frames = []
+        for idx in range(idx0, idx1):
+            frame = self.read()
+            if frame is None:
+                break
+            frames.append(frame)
+        if len(frames) == 0:
+            raise IndexError('no frames could be read')
+        return np.stack(frames)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            try:
+                yield self[idx]
+            except IndexError:
+                return
+
+    def close(self):
+        self.stream.release()
+
+    def __del__(self):
+        if hasattr(self, 'stream'):
+            self.stream.release()
+
+    def get_config(self):
+        config = {'videopath': self.videopath,
+                  'batch_size': self.batch_size,
+                  'start': self.start,
+                  'stop': self.stop,
+                  'grayscale': self.grayscale,
+                  'total_frames': self.total_frames,
+                  'height': self.height,
+                  'width': self.width}
+        return config
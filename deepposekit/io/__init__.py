@@ -1,4 +1,5 @@
 from __future__ import absolute_import
 
 from .DataGenerator import DataGenerator
-from .TrainingGenerator import TrainingGenerator
\ No newline at end of file
+from .TrainingGenerator import TrainingGenerator
+from .VideoGenerator import VideoGenerator
\ No newline at end of file
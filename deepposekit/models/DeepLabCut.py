@@ -24,7 +24,8 @@ from .engine import BaseModel
 
 class DeepLabCut(BaseModel):
 
-    def __init__(self, data_generator, subpixel=True, **kwargs):
+    def __init__(self, data_generator, subpixel=True, variable_shape=False,
+                 pretrained=True, **kwargs):
         """
         Define a DeepLabCut model from Mathis et al., 2018 [1]
         See `References` for details on the model architecture.
@@ -34,9 +35,26 @@ class DeepLabCut(BaseModel):
         data_generator : class pose.DataGenerator
             A pose.DataGenerator class for generating
             images and confidence maps.
-        subpixel: bool, default = True
+        subpixel: bool or str, default = True
             Whether to use subpixel maxima for calculating
             keypoint coordinates in the prediction model.
+            If 'roi', subpixel maxima are only calculated in a
+            small window around the peak of each confidence map,
+            which is much faster for large confidence maps.
+            If 'quadratic' or 'centroid', the integer maxima are
+            refined with a local quadratic fit or weighted centroid,
+            which is close to the cost of integer maxima.
+        variable_shape: bool, default = False
+            Whether to build the model with variable input height and
+            width, so one model can predict on frames with different
+            resolutions. The height and width of the inputs must be
+            divisible by `input_divisor`.
+        pretrained: bool, default = True
+            Whether to initialize the ResNet50 backbone with weights
+            pretrained on ImageNet, which are downloaded on first use.
+            If False, the backbone is randomly initialized, which is
+            useful for building models that are not trained, e.g. for
+            estimating their cost.
 
         Attributes
         -------
@@ -59,14 +77,14 @@ class DeepLabCut(BaseModel):
 
         """
         self.subpixel = subpixel
-        super(DeepLabCut, self).__init__(data_generator, subpixel, **kwargs)
+        self.pretrained = pretrained
+        super(DeepLabCut, self).__init__(data_generator, subpixel,
+                                         variable_shape=variable_shape,
+                                         **kwargs)
 
     def __init_model__(self):
 
-        batch_shape = (None,
-                       self.data_generator.height,
-                       self.data_generator.width,
-                       self.data_generator.n_channels)
+        batch_shape = self.__input_batch_shape__()
 
         input_layer = Input(batch_shape=batch_shape,
                             dtype='uint8')
@@ -74,10 +92,10 @@ class DeepLabCut(BaseModel):
         if batch_shape[-1] is 1:
             to_float = Concatenate()([to_float, ] * 3)
         normalized = ResNetPreprocess()(to_float)
+        weights = 'imagenet' if self.pretrained else None
         pretrained_model = ResNet50(include_top=False,
-                                    input_shape=(self.data_generator.height,
-                                                 self.data_generator.width,
-                                                 3)
+                                    weights=weights,
+                                    input_shape=batch_shape[1:3] + (3,)
                                     )
         pretrained_features = pretrained_model(normalized)
         if self.data_generator.downsample_factor is 4:
@@ -110,10 +128,18 @@ class DeepLabCut(BaseModel):
         self.train_model = Model(input_layer, x_out,
                                  name=self.__class__.__name__)
 
+    @property
+    def input_divisor(self):
+        """The height and width of inputs must be divisible by this"""
+        # the ResNet50 backbone downsamples by 32
+        return 32
+
     def get_config(self):
         config = {
             'name': self.__class__.__name__,
-            'subpixel': self.subpixel
+            'subpixel': self.subpixel,
+            'variable_shape': self.variable_shape,
+            'pretrained': self.pretrained
         }
         base_config = super(DeepLabCut, self).get_config()
         return dict(list(config.items()) + list(base_config.items()))
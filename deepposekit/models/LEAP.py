@@ -28,7 +28,7 @@ class LEAP(BaseModel):
     def __init__(self, data_generator, filters=64, upsampling=False,
                  activation='relu', batchnorm=False, use_bias=True, pooling='max',
                  interpolation='bilinear', subpixel=False,
-                 initializer='glorot_uniform', **kwargs):
+                 initializer='glorot_uniform', variable_shape=False, **kwargs):
         """
         Define a LEAP model from Perrera et al., 2018 [1]
         See `References` for details on the model architecture.
@@ -59,9 +59,20 @@ class LEAP(BaseModel):
             The type of interpolation to use when upsampling.
             Must be 'nearest', 'bilinear', or 'bicubic'.
             The default is 'nearest', which is the most efficient.
-        subpixel: bool, default = True
+        subpixel: bool or str, default = True
             Whether to use subpixel maxima for calculating
             keypoint coordinates in the prediction model.
+            If 'roi', subpixel maxima are only calculated in a
+            small window around the peak of each confidence map,
+            which is much faster for large confidence maps.
+            If 'quadratic' or 'centroid', the integer maxima are
+            refined with a local quadratic fit or weighted centroid,
+            which is close to the cost of integer maxima.
+        variable_shape: bool, default = False
+            Whether to build the model with variable input height and
+            width, so one model can predict on frames with different
+            resolutions. The height and width of the inputs must be
+            divisible by `input_divisor`.
         initializer: str or callable, default='glorot_uniform'
             The initializer for the convolutional kernels.
             Default is 'glorot_uniform' which is the keras default.
@@ -103,15 +114,13 @@ class LEAP(BaseModel):
         self.interpolation = interpolation
         self.subpixel = subpixel
         self.initializer = initializer
-        super(LEAP, self).__init__(data_generator, subpixel, **kwargs)
+        super(LEAP, self).__init__(data_generator, subpixel,
+                                   variable_shape=variable_shape, **kwargs)
 
     def __init_model__(self):
         if self.data_generator.downsample_factor is not 0:
             raise ValueError('LEAP is only compatible with a downsample_factor of 0')
-        batch_shape = (None,
-                       self.data_generator.height,
-                       self.data_generator.width,
-                       self.data_generator.n_channels)
+        batch_shape = self.__input_batch_shape__()
 
         input_layer = Input(batch_shape=batch_shape,
                             dtype='uint8')
@@ -169,6 +178,12 @@ class LEAP(BaseModel):
         self.train_model = Model(input_layer, x_out,
                                  name=self.__class__.__name__)
 
+    @property
+    def input_divisor(self):
+        """The height and width of inputs must be divisible by this"""
+        # two pooling layers
+        return 4
+
     def get_config(self):
         config = {
             'name': self.__class__.__name__,
@@ -180,6 +195,7 @@ class LEAP(BaseModel):
             'pooling': self.pooling,
             'interpolation': self.interpolation,
             'subpixel': self.subpixel,
+            'variable_shape': self.variable_shape,
             'initializer': self.initializer,
         }
         base_config = super(LEAP, self).get_config()
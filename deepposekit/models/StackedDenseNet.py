@@ -31,7 +31,7 @@ class StackedDenseNet(BaseModel):
                  batchnorm=False, use_bias=True, activation='selu', pooling='max',
                  interpolation='subpixel', subpixel=True,
                  initializer='glorot_uniform', separable=False, squeeze_excite=False,
-                 **kwargs):
+                 variable_shape=False, **kwargs):
         """
         Define a Stacked Fully-Convolutional DenseNet model
         for pose estimation.
@@ -85,9 +85,20 @@ class StackedDenseNet(BaseModel):
             The type of interpolation to use when upsampling.
             Must be 'nearest', 'bilinear', or 'bicubic'.
             The default is 'nearest', which is the most efficient.
-        subpixel: bool, default = True
+        subpixel: bool or str, default = True
             Whether to use subpixel maxima for calculating
             keypoint coordinates in the prediction model.
+            If 'roi', subpixel maxima are only calculated in a
+            small window around the peak of each confidence map,
+            which is much faster for large confidence maps.
+            If 'quadratic' or 'centroid', the integer maxima are
+            refined with a local quadratic fit or weighted centroid,
+            which is close to the cost of integer maxima.
+        variable_shape: bool, default = False
+            Whether to build the model with variable input height and
+            width, so one model can predict on frames with different
+            resolutions. The height and width of the inputs must be
+            divisible by `input_divisor`.
         initializer: str or callable, default='glorot_uniform'
             The initializer for the convolutional kernels.
             Default is 'glorot_uniform' which is the keras default.
@@ -140,7 +151,9 @@ class StackedDenseNet(BaseModel):
         self.separable = separable
         self.squeeze_excite = squeeze_excite
         self.n_transitions = n_transitions
-        super(StackedDenseNet, self).__init__(data_generator, subpixel, **kwargs)
+        super(StackedDenseNet, self).__init__(data_generator, subpixel,
+                                              variable_shape=variable_shape,
+                                              **kwargs)
 
     def __init_model__(self):
         max_transitions = np.min([n_downsample(self.data_generator.height),
@@ -168,10 +181,7 @@ class StackedDenseNet(BaseModel):
                                          max_transitions))
 
 
-        batch_shape = (None,
-                       self.data_generator.height,
-                       self.data_generator.width,
-                       self.data_generator.n_channels)
+        batch_shape = self.__input_batch_shape__()
 
         input_layer = Input(batch_shape=batch_shape,
                             dtype='uint8')
@@ -203,6 +213,11 @@ class StackedDenseNet(BaseModel):
         self.train_model = Model(input_layer, outputs,
                                  name=self.__class__.__name__)
 
+    @property
+    def input_divisor(self):
+        """The height and width of inputs must be divisible by this"""
+        return 2**self.n_transitions
+
     def get_config(self):
         config = {
             'name': self.__class__.__name__,
@@ -218,6 +233,7 @@ class StackedDenseNet(BaseModel):
             'pooling': self.pooling,
             'interpolation': self.interpolation,
             'subpixel': self.subpixel,
+            'variable_shape': self.variable_shape,
             'initializer': self.initializer,
             'separable': self.separable,
             'squeeze_excite': self.squeeze_excite
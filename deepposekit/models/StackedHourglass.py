@@ -270,7 +270,7 @@ class StackedHourglass(BaseModel):
     def __init__(self, data_generator, n_stacks=1,
                  n_transitions=-1, filters=256,
                  bottleneck_factor=2,
-                 subpixel=True, **kwargs):
+                 subpixel=True, variable_shape=False, **kwargs):
         """
         Define a Stacked Hourglass model for pose estimation.
         See `References` for details on the model architecture.
@@ -298,9 +298,20 @@ class StackedHourglass(BaseModel):
             Inputs are first passed through a 1x1 convolutional layer to
             reduce the number of channels to:
             filters // bottleneck_factor
-        subpixel: bool, default = True
+        subpixel: bool or str, default = True
             Whether to use subpixel maxima for calculating
             keypoint coordinates in the prediction model.
+            If 'roi', subpixel maxima are only calculated in a
+            small window around the peak of each confidence map,
+            which is much faster for large confidence maps.
+            If 'quadratic' or 'centroid', the integer maxima are
+            refined with a local quadratic fit or weighted centroid,
+            which is close to the cost of integer maxima.
+        variable_shape: bool, default = False
+            Whether to build the model with variable input height and
+            width, so one model can predict on frames with different
+            resolutions. The height and width of the inputs must be
+            divisible by `input_divisor`.
 
         Attributes
         -------
@@ -326,7 +337,8 @@ class StackedHourglass(BaseModel):
         self.filters = filters
         self.bottleneck_factor = bottleneck_factor
         self.n_transitions = n_transitions
-        super().__init__(data_generator, subpixel, **kwargs)
+        super().__init__(data_generator, subpixel,
+                         variable_shape=variable_shape, **kwargs)
 
     def __init_model__(self):
         
@@ -354,10 +366,7 @@ class StackedHourglass(BaseModel):
                             '{1}'.format(-max_transitions + 1,
                                          max_transitions))
 
-        batch_shape = (None,
-                       self.data_generator.height,
-                       self.data_generator.width,
-                       self.data_generator.n_channels)
+        batch_shape = self.__input_batch_shape__()
 
         input_layer = Input(batch_shape=batch_shape,
                             dtype='uint8')
@@ -379,6 +388,11 @@ class StackedHourglass(BaseModel):
         self.train_model = Model(input_layer, outputs,
                                  name=self.__class__.__name__)
 
+    @property
+    def input_divisor(self):
+        """The height and width of inputs must be divisible by this"""
+        return 2**self.n_transitions
+
     def get_config(self):
         config = {
             'name': self.__class__.__name__,
@@ -387,6 +401,7 @@ class StackedHourglass(BaseModel):
             'bottleneck_factor': self.bottleneck_factor,
             'filters': self.filters,
             'subpixel': self.subpixel,
+            'variable_shape': self.variable_shape,
         }
         base_config = super(StackedHourglass, self).get_config()
         return dict(list(config.items()) + list(base_config.items()))
@@ -13,3 +13,30 @@ from . import saving
 
 from .loading import load_model
 from . import loading
+
+from .session import SessionConfig
+from . import session
+
+from .export import export_model, load_exported_model
+from . import export
+
+from .optimize import optimize_predict_model
+from . import optimize
+
+from .quantize import quantize_model, load_quantized_model
+from . import quantize
+
+from .shared import save_shared_weights, load_shared_model
+from . import shared
+
+from .pruning import prune_model
+from . import pruning
+
+from .distillation import distill_model
+from . import distillation
+
+from .estimate import estimate_model, estimate_config
+from . import estimate
+
+from .refinement import build_refinement_head, train_refinement_head
+from . import refinement
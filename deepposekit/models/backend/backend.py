@@ -19,7 +19,8 @@ import keras.backend as K
 from keras.backend import int_shape, permute_dimensions, dtype, floatx
 from keras.backend import tf
 from .utils import gaussian_kernel_2d
-from .registration import _upsampled_registration, _register_rotation
+from .registration import (_upsampled_registration, _register_rotation,
+                           dft_matrices)
 import numpy as np
 
 __all__ = ['resize_images', 'find_maxima', 'find_subpixel_maxima',
@@ -91,16 +92,120 @@ def _find_maxima(x, coordinate_scale=1, confidence_scale=255.):
     return maxima
 
 
-def find_maxima(x, coordinate_scale=1, confidence_scale=255., data_format=None):
+def _crop_peaks(x, roi_size):
+    """Crops a square window around the integer peak of each map.
+    Returns the windows and the (row, col) origin of each window.
+    Maps are zero-padded so windows at the borders are valid."""
+    x_shape = tf.shape(x)
+    n_maps = x_shape[0]
+    cols = x_shape[2]
+
+    peaks = tf.argmax(tf.reshape(x, [n_maps, -1]), axis=1, output_type=tf.int32)
+    peak_rows = peaks // cols
+    peak_cols = peaks % cols
+
+    half = roi_size // 2
+    x = tf.pad(x, [[0, 0], [half, roi_size - half], [half, roi_size - half]])
+
+    # window origins in padded coordinates are the peak coordinates
+    offsets = tf.range(roi_size)
+    rows = tf.expand_dims(peak_rows, 1) + offsets
+    cols = tf.expand_dims(peak_cols, 1) + offsets
+    batch = tf.tile(tf.reshape(tf.range(n_maps), [-1, 1, 1]), [1, roi_size, roi_size])
+    rows = tf.tile(tf.expand_dims(rows, 2), [1, 1, roi_size])
+    cols = tf.tile(tf.expand_dims(cols, 1), [1, roi_size, 1])
+    windows = tf.gather_nd(x, tf.stack([batch, rows, cols], -1))
+
+    origins = tf.stack([peak_rows - half, peak_cols - half], -1)
+    origins = tf.cast(origins, tf.float32)
+    return windows, origins
+
+
+def _quadratic_offsets(windows):
+    """Fits a parabola along the center row and column of each
+    window by least squares and returns the (row, col) offsets
+    of its vertex from the center"""
+    window_size = int_shape(windows)[-1]
+    center = window_size // 2
+    positions = np.arange(window_size, dtype=np.float32) - center
+    sum_x2 = np.sum(positions**2)
+    sum_x4 = np.sum(positions**4)
+    positions = tf.constant(positions)
+
+    offsets = []
+    for profile in [windows[:, :, center], windows[:, center, :]]:
+        slope = tf.reduce_sum(profile * positions, -1) / sum_x2
+        curvature = (tf.reduce_sum(profile * positions**2, -1) -
+                     sum_x2 * tf.reduce_mean(profile, -1))
+        curvature /= (sum_x4 - sum_x2**2 / window_size)
+        # only refine peaks where the fit has a maximum
+        offset = tf.where(curvature < 0,
+                          -slope / (2 * tf.minimum(curvature, -K.epsilon())),
+                          tf.zeros_like(slope))
+        offsets.append(tf.clip_by_value(offset, -0.5, 0.5))
+    return tf.stack(offsets, -1)
+
+
+def _centroid_offsets(windows):
+    """Returns the (row, col) offsets of the weighted
+    centroid of each window from the center"""
+    window_size = int_shape(windows)[-1]
+    positions = tf.range(window_size, dtype=tf.float32) - (window_size // 2)
+    weights = tf.nn.relu(windows)
+    total = tf.maximum(tf.reduce_sum(weights, [1, 2]), K.epsilon())
+    rows = tf.reduce_sum(tf.reduce_sum(weights, 2) * positions, -1) / total
+    cols = tf.reduce_sum(tf.reduce_sum(weights, 1) * positions, -1) / total
+    return tf.stack([rows, cols], -1)
+
+
+def _find_refined_maxima(x, refine, window_size,
+                         coordinate_scale=1, confidence_scale=255.):
+    x = tf.cast(x, tf.float32)
+    windows, origins = _crop_peaks(x, window_size)
+    windows.set_shape((None, window_size, window_size))
+    center = window_size // 2
+    max_vals = windows[:, center, center] / confidence_scale
+    if refine == 'quadratic':
+        offsets = _quadratic_offsets(windows)
+    elif refine == 'centroid':
+        offsets = _centroid_offsets(windows)
+    else:
+        raise ValueError('Invalid refine method:', refine)
+    coordinates = (origins + center + offsets) * coordinate_scale
+    maxima = tf.concat([coordinates[:, ::-1], tf.expand_dims(max_vals, -1)], -1)
+    return maxima
+
+
+def find_maxima(x, coordinate_scale=1, confidence_scale=255., data_format=None,
+                refine=None, window_size=3):
     """Finds the 2D maxima contained in a 4D tensor.
     # Arguments
         x: Tensor or variable.
         data_format: string, `"channels_last"` or `"channels_first"`.
+        refine: string or None.
+            `"quadratic"` refines each integer maximum with a least squares
+            parabola along its row and column, and `"centroid"` with the
+            weighted centroid of the window around it. Default is None,
+            which returns the integer maxima.
+        window_size: Integer, the odd size of the window used by `refine`.
     # Returns
         A tensor.
     # Raises
         ValueError: if `data_format` is neither `"channels_last"` or `"channels_first"`.
     """
+    if refine is not None:
+        if data_format == 'channels_last':
+            x = permute_dimensions(x, [0, 3, 1, 2])
+        elif data_format != 'channels_first':
+            raise ValueError('Invalid data_format:', data_format)
+        x_shape = K.shape(x)
+        batch = x_shape[0]
+        channels = x_shape[1]
+        x = K.reshape(x, [batch * channels, x_shape[2], x_shape[3]])
+        x = _find_refined_maxima(x, refine, window_size,
+                                 coordinate_scale, confidence_scale)
+        x = K.reshape(x, [batch, channels, 3])
+        return x
     if data_format == 'channels_first':
         x = permute_dimensions(x, [0, 2, 3, 1])
         x = _find_maxima(x, coordinate_scale, confidence_scale)
@@ -114,11 +219,54 @@ def find_maxima(x, coordinate_scale=1, confidence_scale=255., data_format=None):
         raise ValueError('Invalid data_format:', data_format)
 
 
-def _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
-                          coordinate_scale=1, confidence_scale=255.):
+def _roi_kernel_size(kernel_size, roi_size):
+    # the kernel must be odd and fit inside the window with padding
+    kernel_size = min(kernel_size, roi_size - 1)
+    if kernel_size % 2 == 0:
+        kernel_size -= 1
+    return kernel_size
 
-    kernel = gaussian_kernel_2d(kernel_size, sigma)
-    kernel = tf.expand_dims(kernel, 0)
+
+def subpixel_constants(shape, kernel_size, sigma, upsample_factor,
+                       roi_size=None):
+    """Precomputes the constant tensors of `find_subpixel_maxima`.
+    # Arguments
+        shape: tuple of integers, the (rows, cols) shape of the inputs.
+        kernel_size: Integer, the size of the Gaussian kernel.
+        sigma: float, the standard deviation of the Gaussian kernel.
+        upsample_factor: Integer, the upsampling factor.
+        roi_size: Integer or None, see `find_subpixel_maxima`.
+    # Returns
+        A dict of numpy arrays with the FFT of the padded Gaussian kernel,
+        its center, and the upsampled DFT matrices.
+    """
+    if roi_size is not None:
+        shape = (roi_size, roi_size)
+        kernel_size = _roi_kernel_size(kernel_size, roi_size)
+    rows, cols = shape
+
+    x = np.arange(-(kernel_size // 2), (kernel_size // 2) + 1, dtype=np.float64)
+    kernel = np.exp(-0.5 * (x / sigma)**2) / (sigma * np.sqrt(2 * np.pi))
+    kernel = np.outer(kernel, kernel)
+
+    row_pad = rows // 2 - kernel_size // 2
+    col_pad = cols // 2 - kernel_size // 2
+    kernel = np.pad(kernel, [[row_pad, row_pad - 1], [col_pad, col_pad - 1]],
+                    mode='constant')
+    kernel_freq = np.fft.fft2(kernel.astype(np.float32))[np.newaxis]
+
+    center = np.array([[row_pad + (kernel_size // 2),
+                        col_pad + (kernel_size // 2)]], dtype=np.float32)
+
+    constants = {'kernel_freq': kernel_freq.astype(np.complex64),
+                 'center': center,
+                 'matrices': dft_matrices(shape, upsample_factor)}
+    return constants
+
+
+def _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
+                          coordinate_scale=1, confidence_scale=255.,
+                          constants=None):
 
     x_shape = tf.shape(x)
     rows = x_shape[1]
@@ -127,6 +275,18 @@ def _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
     max_vals = tf.reduce_max(tf.reshape(x, [-1, rows * cols]), axis=1)
     max_vals = tf.reshape(max_vals, [-1, 1]) / confidence_scale
 
+    if constants is not None:
+        shifts = _upsampled_registration(x, None, upsample_factor,
+                                         tf.constant(constants['kernel_freq']),
+                                         constants['matrices'])
+        shifts = tf.constant(constants['center']) - shifts
+        shifts *= coordinate_scale
+        maxima = tf.concat([shifts[:, ::-1], max_vals], -1)
+        return maxima
+
+    kernel = gaussian_kernel_2d(kernel_size, sigma)
+    kernel = tf.expand_dims(kernel, 0)
+
     row_pad = rows // 2 - kernel_size // 2
     col_pad = cols // 2 - kernel_size // 2
     padding = [[0, 0], [row_pad, row_pad - 1], [col_pad, col_pad - 1]]
@@ -146,13 +306,36 @@ def _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
     return maxima
 
 
+def _find_roi_subpixel_maxima(x, kernel_size, sigma, upsample_factor, roi_size,
+                              coordinate_scale=1, confidence_scale=255.,
+                              constants=None):
+
+    kernel_size = _roi_kernel_size(kernel_size, roi_size)
+
+    windows, origins = _crop_peaks(x, roi_size)
+    maxima = _find_subpixel_maxima(windows, kernel_size, sigma, upsample_factor,
+                                   1, confidence_scale, constants)
+    coordinates = (maxima[:, :2] + origins[:, ::-1]) * coordinate_scale
+    maxima = tf.concat([coordinates, maxima[:, 2:]], -1)
+
+    return maxima
+
+
 def find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
                          coordinate_scale=1, confidence_scale=255.,
-                         data_format=None):
+                         data_format=None, roi_size=None, constants=None):
     """Finds the 2D maxima contained in a 4D tensor.
     # Arguments
         x: Tensor or variable.
         data_format: string, `"channels_last"` or `"channels_first"`.
+        roi_size: Integer or None.
+            If given, the integer peak of each map is found first and
+            the subpixel peak is only registered within a window of
+            `roi_size` around it, instead of the full map.
+        constants: dict or None.
+            The precomputed constants from `subpixel_constants`
+            for the shape of `x`. Default is None, which computes
+            the Gaussian kernel and DFT matrices in the graph.
     # Returns
         A tensor.
     # Raises
@@ -167,8 +350,14 @@ def find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
         channels = x_shape[3]
         x = permute_dimensions(x, [0, 3, 1, 2])
         x = K.reshape(x, [batch * channels, row, col])
-        x = _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
-                                  coordinate_scale, confidence_scale)
+        if roi_size is None:
+            x = _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
+                                      coordinate_scale, confidence_scale,
+                                      constants)
+        else:
+            x = _find_roi_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
+                                          roi_size, coordinate_scale,
+                                          confidence_scale, constants)
         x = K.reshape(x, [batch, channels, 3])
         return x
     elif data_format == 'channels_last':
@@ -179,8 +368,14 @@ def find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
         channels = x_shape[3]
         x = permute_dimensions(x, [0, 3, 1, 2])
         x = K.reshape(x, [batch * channels, row, col])
-        x = _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
-                                  coordinate_scale, confidence_scale)
+        if roi_size is None:
+            x = _find_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
+                                      coordinate_scale, confidence_scale,
+                                      constants)
+        else:
+            x = _find_roi_subpixel_maxima(x, kernel_size, sigma, upsample_factor,
+                                          roi_size, coordinate_scale,
+                                          confidence_scale, constants)
         x = K.reshape(x, [batch, channels, 3])
 
         return x
@@ -218,16 +413,25 @@ def register_translation(target_image, src_image,
 
 
 def register_rotation(target_image, src_image, rotation_resolution,
-                      rotation_guess, upsample_factor, data_format):
+                      rotation_guess, upsample_factor, data_format,
+                      chunk_size=64):
     """Finds the the rotational shift between target_image and src_image
-       via radon transform and cross-correlation.
+       via cross-correlation of the polar FFT magnitudes.
     # Arguments
         target_image: Tensor or variable.
             4D tensor containing images to align
         src_image: Tensor or variable.
             4D tensor containing the basis images to align target_image to.
             Shape may be (batch, rows, cols, 1) or (1, rows, cols, 1)
+        rotation_resolution: float, the angular resolution in degrees.
+        rotation_guess: float, the expected angle in degrees, used to
+            resolve the 180 degree ambiguity of the FFT magnitude.
+        upsample_factor: Integer, the upsampling factor of the
+            cross-correlation along the angle axis.
         data_format: string, `"channels_last"` or `"channels_first"`.
+        chunk_size: Integer, the number of angles resampled at once.
+            Memory use grows with `chunk_size` instead of the
+            total number of angles.
     # Returns
         A tensor.
     # Raises
@@ -238,12 +442,12 @@ def register_rotation(target_image, src_image, rotation_resolution,
         src_image = permute_dimensions(src_image, [0, 2, 3, 1])
         angles = _register_rotation(target_image, src_image,
                                     rotation_resolution, rotation_guess,
-                                    upsample_factor)
+                                    upsample_factor, chunk_size)
         return angles
     elif data_format == 'channels_last':
         angles = _register_rotation(target_image, src_image,
                                     rotation_resolution, rotation_guess,
-                                    upsample_factor)
+                                    upsample_factor, chunk_size)
         return angles
     else:
         raise ValueError('Invalid data_format:', data_format)
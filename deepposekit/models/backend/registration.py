@@ -19,7 +19,7 @@ from keras.backend import tf
 import numpy as np
 from .utils import fftshift1d, fft2d, find_maxima, fix, radians, check_angles
 
-__all__ = ['_upsampled_registration']
+__all__ = ['_upsampled_registration', 'dft_matrices', 'polar_fft_magnitude']
 
 
 def _col_kernel(upsampled_region_size, upsample_factor,
@@ -84,6 +84,68 @@ def _row_kernel(upsampled_region_size, upsample_factor,
     return row_kernel
 
 
+def dft_matrices(shape, upsample_factor):
+    """
+    Precomputes the constant parts of the upsampled DFT
+    for inputs with a fixed shape and upsample factor.
+
+    The row and column kernels of the upsampled DFT are
+    exp(c * (region - offset) * frequencies), which factor into a
+    constant matrix exp(c * region * frequencies) and a per-sample
+    phase exp(-c * offset * frequencies) that is applied to the data.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The (rows, cols) shape of the data.
+    upsample_factor : int
+        The upsampling factor.
+
+    Returns
+    -------
+    matrices : dict
+        The row and column frequencies, the (region, rows) row DFT
+        matrix, the (cols, region) column DFT matrix, and the size
+        of the upsampled region.
+    """
+    rows, cols = shape
+    region_size = int(np.ceil(upsample_factor * 1.5))
+    region = np.arange(region_size, dtype=np.float64)
+
+    row_freqs = np.fft.fftshift(np.arange(rows)) - np.floor(rows / 2.)
+    col_freqs = np.fft.fftshift(np.arange(cols)) - np.floor(cols / 2.)
+    row_constant = -2j * np.pi / (rows * upsample_factor)
+    col_constant = -2j * np.pi / (cols * upsample_factor)
+
+    row_dft = np.exp(row_constant * region[:, None] * row_freqs[None, :])
+    col_dft = np.exp(col_constant * col_freqs[:, None] * region[None, :])
+
+    matrices = {'row_freqs': row_freqs.astype(np.float32),
+                'col_freqs': col_freqs.astype(np.float32),
+                'row_constant': row_constant,
+                'col_constant': col_constant,
+                'row_dft': row_dft.astype(np.complex64),
+                'col_dft': col_dft.astype(np.complex64),
+                'region_size': region_size}
+    return matrices
+
+
+def _precomputed_upsampled_dft(data, axis_offsets, matrices):
+    """Upsampled DFT using the matrices from `dft_matrices`.
+    Only the per-sample phase shifts are computed in the graph."""
+    row_phase = tf.expand_dims(axis_offsets[:, 0], 1) * matrices['row_freqs']
+    row_phase = tf.exp(-matrices['row_constant'] * tf.cast(row_phase, tf.complex64))
+    col_phase = tf.expand_dims(axis_offsets[:, 1], 1) * matrices['col_freqs']
+    col_phase = tf.exp(-matrices['col_constant'] * tf.cast(col_phase, tf.complex64))
+
+    data = data * tf.expand_dims(row_phase, 2) * tf.expand_dims(col_phase, 1)
+    upsampled_dft = tf.einsum('ij,njk->nik', tf.constant(matrices['row_dft']), data)
+    upsampled_dft = tf.einsum('nij,jk->nik', upsampled_dft,
+                              tf.constant(matrices['col_dft']))
+
+    return upsampled_dft
+
+
 def _upsampled_dft(data, upsampled_region_size,
                    upsample_factor, axis_offsets):
     """
@@ -129,16 +191,20 @@ def _upsampled_dft(data, upsampled_region_size,
     return upsampled_dft
 
 
-def _upsampled_registration(target_image, src_image, upsample_factor):
+def _upsampled_registration(target_image, src_image, upsample_factor,
+                            src_freq=None, matrices=None):
+    """Registers target_image to src_image with subpixel precision.
+    If given, `src_freq` is the precomputed FFT of `src_image` and
+    `matrices` are the precomputed DFT matrices from `dft_matrices`."""
 
     upsample_factor = tf.constant(upsample_factor, tf.float32)
 
     target_shape = tf.shape(target_image)
     target_image = tf.reshape(target_image, target_shape[:3])
-    src_shape = tf.shape(src_image)
-    src_image = tf.reshape(src_image, src_shape[:3])
-
-    src_freq = fft2d(src_image)
+    if src_freq is None:
+        src_shape = tf.shape(src_image)
+        src_image = tf.reshape(src_image, src_shape[:3])
+        src_freq = fft2d(src_image)
     target_freq = fft2d(target_image)
 
     shape = tf.reshape(tf.shape(src_freq)[1:3], (1, 2))
@@ -161,8 +227,12 @@ def _upsampled_registration(target_image, src_image, upsample_factor):
     sample_region_offset = dftshift - shifts * upsample_factor
 
     data = tf.conj(image_product)
-    upsampled_dft = _upsampled_dft(data, upsampled_region_size,
-                                   upsample_factor, sample_region_offset)
+    if matrices is None:
+        upsampled_dft = _upsampled_dft(data, upsampled_region_size,
+                                       upsample_factor, sample_region_offset)
+    else:
+        upsampled_dft = _precomputed_upsampled_dft(data, sample_region_offset,
+                                                   matrices)
 
     cross_correlation = tf.conj(upsampled_dft)
     cross_correlation /= tf.cast(normalization, tf.complex64)
@@ -175,77 +245,118 @@ def _upsampled_registration(target_image, src_image, upsample_factor):
     return shifts
 
 
-def radon_transform(x, theta):
-
-    x = tf.cast(x, dtype=tf.float32)
-
-    x_shape = tf.shape(x)
-    n_cols = x_shape[2]
-    n_rows = x_shape[1]
-    n_frames = x_shape[0]
-    n_angles = tf.shape(theta)[0]
-
-    x = tf.reshape(x, (-1, 1, n_rows, n_cols, 1))
-    x = tf.tile(x, (1, n_angles, 1, 1, 1))
-    x = tf.reshape(x, (-1, n_rows, n_cols, 1))
-
-    repeated_theta = repeat_theta(theta, n_angles, n_frames)
-
-    x = tf.cast(x, dtype=tf.uint8)
-    #x = tf.contrib.image.rotate(x, repeated_theta, interpolation='BILINEAR')
-    x = tf.cast(x, dtype=tf.float32)
-
-    x = tf.reshape(x, (-1, n_angles, n_rows, n_cols, 1))
-    x = tf.cast(x, dtype=tf.float32)
-    x = tf.reduce_sum(x, 2)
-
-    return x
+def polar_fft_magnitude(x, rotation_resolution, chunk_size=64):
+    """
+    Resamples the log FFT magnitude of images onto a polar grid.
 
+    The FFT magnitude is invariant to translation, and a rotation of the
+    image rotates its FFT magnitude by the same angle, which becomes a
+    shift along the angle axis of the polar grid. As the magnitude of a
+    real image is symmetric, only angles in [0, 180) are sampled.
 
-def repeat_theta(theta, n_angles, n_frames):
+    The images are centered and multiplied by a Hann window before the
+    FFT, so the discontinuity at the image borders does not add a cross
+    to the magnitude that dominates the angle estimate. The polar grid
+    is scaled separately along rows and columns, so it samples the same
+    frequencies in every direction for non-square images.
 
-    repeated = tf.reshape(theta, (1, n_angles))
-    repeated = tf.tile(repeated, (n_frames, 1))
-    repeated = tf.reshape(repeated, (n_frames * n_angles,))
+    The grid is sampled with bilinear interpolation by gathering from the
+    flattened magnitude in chunks of `chunk_size` angles, so memory is
+    bounded by the chunk size instead of growing with one rotated copy
+    of each image per angle.
 
-    return repeated
+    Parameters
+    ----------
+    x : tensor, shape = (batch, rows, cols)
+        The images.
+    rotation_resolution : float
+        The angle between grid rows in degrees.
+    chunk_size : int, default = 64
+        The number of angles sampled at once.
 
+    Returns
+    -------
+    polar : tensor, shape = (batch, n_angles, n_radii)
+        The polar magnitude, where n_angles = 180 / rotation_resolution
+        and n_radii = min(rows, cols) // 2 - 1.
+    """
+    n_angles = int(np.round(180. / rotation_resolution))
+    n_chunks = int(np.ceil(n_angles / float(chunk_size)))
+    theta = np.arange(n_chunks * chunk_size) * rotation_resolution
+    theta = np.radians(theta).reshape(n_chunks, chunk_size).astype(np.float32)
 
-def radon_fft(x):
     x_shape = tf.shape(x)
-    n_angles = x_shape[1]
-    n_cols = x_shape[2]
-    x = tf.reshape(x, (-1, n_cols))
-    x = tf.cast(x, tf.complex64)
-    x = tf.spectral.fft(x)
-    x = tf.abs(x)
-    x = tf.reshape(x, (-1, n_angles, n_cols, 1))
-    return x
-
-
-def radon_transform_fft(images, theta):
-    radon = radon_transform(images, theta)
-    return radon_fft(radon)
+    batch = x_shape[0]
+    rows = x_shape[1]
+    cols = x_shape[2]
+
+    def hann(size):
+        index = tf.range(size, dtype=tf.float32)
+        return 0.5 - 0.5 * tf.cos(2 * np.pi * index / tf.cast(size, tf.float32))
+
+    window = tf.expand_dims(hann(rows), 1) * tf.expand_dims(hann(cols), 0)
+    x = tf.cast(x, tf.float32)
+    x = (x - tf.reduce_mean(x, axis=[1, 2], keepdims=True)) * window
+    magnitude = tf.log1p(tf.abs(fft2d(x)))
+    flat = tf.reshape(magnitude, [batch, rows * cols])
+
+    # skip the zero frequency, which does not depend on the angle
+    min_size = tf.minimum(rows, cols)
+    radii = tf.range(1, min_size // 2, dtype=tf.float32)
+    radii = tf.expand_dims(radii, 0)
+    # FFT index k along an axis of size n is the frequency k / n,
+    # so radii are scaled per axis to sample isotropic frequencies
+    row_scale = tf.cast(rows, tf.float32) / tf.cast(min_size, tf.float32)
+    col_scale = tf.cast(cols, tf.float32) / tf.cast(min_size, tf.float32)
+
+    def sample_chunk(chunk_theta):
+        chunk_theta = tf.expand_dims(chunk_theta, 1)
+        # frequencies wrap around, so no fftshift is needed
+        row_coords = radii * row_scale * tf.sin(chunk_theta)
+        col_coords = radii * col_scale * tf.cos(chunk_theta)
+        row_floor = tf.floor(row_coords)
+        col_floor = tf.floor(col_coords)
+        row_weight = tf.reshape(row_coords - row_floor, [1, -1])
+        col_weight = tf.reshape(col_coords - col_floor, [1, -1])
+        row_floor = tf.cast(row_floor, tf.int32)
+        col_floor = tf.cast(col_floor, tf.int32)
+
+        def gather(row_idx, col_idx):
+            idx = tf.floormod(row_idx, rows) * cols + tf.floormod(col_idx, cols)
+            return tf.gather(flat, tf.reshape(idx, [-1]), axis=1)
+
+        values = (gather(row_floor, col_floor) * (1 - row_weight) * (1 - col_weight) +
+                  gather(row_floor + 1, col_floor) * row_weight * (1 - col_weight) +
+                  gather(row_floor, col_floor + 1) * (1 - row_weight) * col_weight +
+                  gather(row_floor + 1, col_floor + 1) * row_weight * col_weight)
+        return tf.reshape(values, [batch, chunk_size, -1])
+
+    polar = tf.map_fn(sample_chunk, tf.constant(theta), dtype=tf.float32,
+                      parallel_iterations=1, back_prop=False)
+    polar = tf.transpose(polar, [1, 0, 2, 3])
+    polar = tf.reshape(polar, [batch, n_chunks * chunk_size, -1])
+    polar = polar[:, :n_angles]
+
+    return polar
 
 
 def _register_rotation(target_image, src_image, rotation_resolution,
-                       rotation_guess, upsample_factor):
-
-    n_angles = tf.cast(tf.round(180. / rotation_resolution), tf.int32)
-    theta = tf.linspace(0., 180. - rotation_resolution, n_angles)
-    theta = -radians(theta)
+                       rotation_guess, upsample_factor, chunk_size=64):
 
     target_shape = tf.shape(target_image)
     target_image = tf.reshape(target_image, target_shape[:3])
     src_shape = tf.shape(src_image)
     src_image = tf.reshape(src_image, src_shape[:3])
 
+    src_polar = polar_fft_magnitude(src_image, rotation_resolution, chunk_size)
+    target_polar = polar_fft_magnitude(target_image, rotation_resolution,
+                                       chunk_size)
+
     rotation_guess = tf.constant(rotation_guess, tf.float32)
     rotation_resolution = tf.constant(rotation_resolution, tf.float32)
 
-    src_image = radon_transform_fft(src_image, theta)
-    target_image = radon_transform_fft(target_image, theta)
-    shifts = _upsampled_registration(target_image, src_image, upsample_factor)
+    # rotation is a circular shift along the angle axis
+    shifts = _upsampled_registration(target_polar, src_polar, upsample_factor)
 
     angles = shifts[:, 0] * rotation_resolution
     angles = tf.reshape(angles, [-1, 1])
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import cv2
+import warnings
+
+from keras.utils import Sequence
+from keras import backend as K
+from keras.backend import tf
+
+__all__ = ['DistillationGenerator', 'distill_model']
+
+
+def _resize_maps(maps, output_shape):
+    """Resizes a batch of confidence maps to (rows, cols)"""
+    height, width = output_shape
+    if maps.shape[1:3] == (height, width):
+        return maps
+    resized = np.zeros((maps.shape[0], height, width, maps.shape[-1]),
+                       dtype=maps.dtype)
+    # cv2 supports at most 512 channels
+    for idx in range(maps.shape[0]):
+        for channel in range(0, maps.shape[-1], 512):
+            channels = slice(channel, channel + 512)
+            resized_channels = cv2.resize(maps[idx, ..., channels], (width, height),
+                                          interpolation=cv2.INTER_LINEAR)
+            resized[idx, ..., channels] = resized_channels.reshape(height, width, -1)
+    return resized
+
+
+class DistillationGenerator(Sequence):
+    """
+    Generates training batches with confidence maps that mix
+    the ground truth with the outputs of a teacher model.
+
+    The teacher's `train_model` is run on the same (augmented) images as
+    the student, and its final output is resized to the output shape of
+    the student if needed. Teacher outputs for unaugmented images, such
+    as the whole training set when the data generator has no augmenter,
+    are cached per sample as float16, so the teacher only runs once
+    for each of these images.
+
+    Parameters
+    ----------
+    teacher : deepposekit BaseModel
+        The trained teacher model.
+    data_generator : TrainingGenerator
+        The data generator of the student model.
+    n_outputs : int
+        The number of outputs of the student model.
+    batch_size : int
+        Number of samples in each batch
+    alpha : float, default = 0.5
+        The weight of the ground truth confidence maps.
+        The teacher confidence maps are weighted by 1 - alpha.
+    cache : bool, default = True
+        Whether to cache teacher outputs for unaugmented images.
+    """
+    def __init__(self, teacher, data_generator, n_outputs, batch_size,
+                 alpha=0.5, cache=True):
+        if not 0 <= alpha <= 1:
+            raise ValueError('alpha must be in range 0 <= alpha <= 1')
+        self.teacher = teacher
+        self.graph = tf.get_default_graph()
+        self.generator = data_generator(n_outputs=1, batch_size=batch_size,
+                                        validation=False, confidence=True)
+        self.n_outputs = n_outputs
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.augment = self.generator.augmenter is not None
+        self.cache = cache and not self.augment
+        n_channels = self.generator.n_output_channels
+        input_shape = (self.generator.height, self.generator.width,
+                       self.generator.n_channels)
+        if tuple(K.int_shape(teacher.train_model.inputs[0])[1:]) != input_shape:
+            raise ValueError('teacher and student must have the same input shape')
+        if K.int_shape(teacher.train_model.outputs[-1])[-1] != n_channels:
+            raise ValueError('teacher and student must have the same '
+                             'number of output channels')
+        if self.cache:
+            cache_shape = ((self.generator.n_samples,) +
+                           tuple(self.generator.output_shape) + (n_channels,))
+            self.teacher_cache = np.zeros(cache_shape, dtype=np.float16)
+            self.cached = np.zeros(self.generator.n_samples, dtype=bool)
+
+    def __len__(self):
+        return len(self.generator)
+
+    def predict_teacher(self, X):
+        with self.graph.as_default():
+            maps = self.teacher.train_model.predict_on_batch(X)
+        if isinstance(maps, list):
+            maps = maps[-1]
+        return _resize_maps(maps, self.generator.output_shape)
+
+    def _teacher_maps(self, X, sample_index):
+        if not self.cache:
+            return self.predict_teacher(X)
+        missing = ~self.cached[sample_index]
+        if np.any(missing):
+            self.teacher_cache[sample_index[missing]] = self.predict_teacher(X[missing])
+            self.cached[sample_index[missing]] = True
+        return self.teacher_cache[sample_index].astype(np.float32)
+
+    def __getitem__(self, index):
+        idx0 = index * self.batch_size
+        idx1 = (index + 1) * self.batch_size
+        indexes = self.generator.train_range[idx0:idx1]
+        sample_index = self.generator.train_index[indexes]
+
+        X, y = self.generator.load_batch(indexes)
+        if self.augment:
+            X, y = self.generator.augmenter(X, y)
+        y = self.generator.draw_confidence_maps(X, y)
+        y = self.alpha * y + (1 - self.alpha) * self._teacher_maps(X, sample_index)
+        if self.n_outputs > 1:
+            y = [y for idx in range(self.n_outputs)]
+        return X, y
+
+    def on_epoch_end(self):
+        self.generator.on_epoch_end()
+
+
+def distill_model(teacher, student, batch_size, alpha=0.5, epochs=1,
+                  validation_batch_size=1, callbacks=[], cache=True,
+                  **kwargs):
+    """
+    Trains a student model on a mix of ground truth and
+    teacher confidence maps, e.g. to train a fast LEAP or small
+    StackedDenseNet model from a large StackedDenseNet or DeepLabCut model.
+
+    The student is validated against the ground truth only,
+    so validation losses are comparable to standard training.
+    The teacher and student can use different downsample factors,
+    as the teacher outputs are resized to the student output shape.
+
+    Parameters
+    ----------
+    teacher : deepposekit BaseModel
+        The trained teacher model.
+    student : deepposekit BaseModel
+        The student model, with the TrainingGenerator used for training.
+    batch_size : int
+        Number of samples in each training batch
+    alpha : float, default = 0.5
+        The weight of the ground truth confidence maps.
+    epochs : int, default = 1
+        Number of epochs to train the student.
+    validation_batch_size : int, default = 1
+        Number of samples in each validation batch
+    callbacks : list, default = []
+        Keras callbacks, as for BaseModel.fit
+    cache : bool, default = True
+        Whether to cache teacher outputs for unaugmented images.
+        See DistillationGenerator.
+    **kwargs :
+        Passed to keras.Model.fit_generator
+
+    Returns
+    -------
+    history : keras History
+    """
+    if not student.train_model._is_compiled:
+        warnings.warn('''\nAutomatically compiling with default settings: model.compile('adam', 'mse')\n'''
+                      'Call model.compile() manually to use non-default settings.\n')
+        student.train_model.compile('adam', 'mse')
+    if kwargs.get('use_multiprocessing', False):
+        raise ValueError('the teacher model cannot be run with multiprocessing')
+
+    train_generator = DistillationGenerator(teacher, student.data_generator,
+                                            student.n_outputs, batch_size,
+                                            alpha, cache)
+    validation_generator = student.data_generator(student.n_outputs,
+                                                  validation_batch_size,
+                                                  validation=True,
+                                                  confidence=True)
+    activated_callbacks = []
+    for callback in callbacks:
+        if hasattr(callback, 'pass_model'):
+            callback.pass_model(student)
+        activated_callbacks.append(callback)
+
+    return student.train_model.fit_generator(generator=train_generator,
+                                             steps_per_epoch=len(train_generator),
+                                             epochs=epochs,
+                                             callbacks=activated_callbacks,
+                                             validation_data=validation_generator,
+                                             validation_steps=len(validation_generator),
+                                             **kwargs)
@@ -23,14 +23,28 @@ from .layers.convolutional import Maxima2D
 from ..utils.image import largest_factor
 from ..utils.keypoints import keypoint_errors
 from .saving import save_model
+from .export import export_model
+from .session import SessionConfig
+from .optimize import optimize_predict_model, validate_optimized_model
+
+SUBPIXEL_MODES = [False, True, 'roi', 'quadratic', 'centroid']
 
 
 class BaseModel:
-    def __init__(self, data_generator=None, subpixel=False, **kwargs):
+    def __init__(self, data_generator=None, subpixel=False,
+                 session_config=None, variable_shape=False, **kwargs):
 
         self.data_generator = data_generator
+        if subpixel not in SUBPIXEL_MODES:
+            raise ValueError('subpixel must be one of {}'.format(SUBPIXEL_MODES))
         self.subpixel = subpixel
+        self.variable_shape = variable_shape
+        if not isinstance(session_config, (SessionConfig, type(None))):
+            raise TypeError('session_config must be class SessionConfig or None')
+        self.session_config = session_config
         if self.train_model is NotImplemented and 'skip_init' not in kwargs:
+            if self.session_config is not None:
+                self.session_config.apply()
             self.__init_model__()
             self.__init_train_model__()
         if self.data_generator is not None:
@@ -44,6 +58,51 @@ class BaseModel:
                                         output_sigma)
 
     train_model = NotImplemented
+    input_divisor = 1
+
+    def __input_batch_shape__(self):
+        """Returns the batch shape of the model input, with variable
+        height and width if the model has a variable shape"""
+        if self.variable_shape:
+            return (None, None, None, self.data_generator.n_channels)
+        return (None,
+                self.data_generator.height,
+                self.data_generator.width,
+                self.data_generator.n_channels)
+
+    @property
+    def fixed_input_shape(self):
+        """The (height, width, channels) of the model input. Models with
+        a variable shape use the shape of the training data."""
+        input_shape = self.predict_model.input_shape[1:]
+        if None in input_shape:
+            if self.data_generator is None:
+                raise ValueError('model has a variable input shape '
+                                 'and no data generator')
+            input_shape = (self.data_generator.height,
+                           self.data_generator.width,
+                           input_shape[-1])
+        return tuple(input_shape)
+
+    def check_input_shape(self, shape):
+        """Raises ValueError if the height and width of `shape`
+        cannot be predicted by the model
+
+        Parameters
+        ----------
+        shape : tuple of int
+            The (height, width) of the inputs.
+        """
+        input_shape = self.predict_model.input_shape[1:3]
+        for size, model_size in zip(shape[:2], input_shape):
+            if model_size is None:
+                if size % self.input_divisor != 0:
+                    raise ValueError('input height and width must be divisible '
+                                     'by {}'.format(self.input_divisor))
+            elif size != model_size:
+                raise ValueError('input shape {} does not match the model input '
+                                 'shape {}'.format(tuple(shape[:2]),
+                                                   tuple(input_shape)))
 
     def __init_train_model__(self):
         if isinstance(self.train_model, Model):
@@ -60,17 +119,34 @@ class BaseModel:
                                downsample_factor, output_sigma=None, **kwargs):
 
         output = self.train_model.outputs[-1]
-        if self.subpixel:
-            kernel_size = np.min(output_shape)
-            kernel_size = (kernel_size //
-                           largest_factor(kernel_size)) + 1
+        if self.subpixel in ['quadratic', 'centroid']:
+            keypoints = Maxima2D(index=n_keypoints,
+                                 coordinate_scale=2**downsample_factor,
+                                 confidence_scale=255.,
+                                 refine=self.subpixel,
+                                 )(output)
+        elif self.subpixel:
+            if self.variable_shape:
+                # the kernel size is derived from sigma in the layer,
+                # as the output shape is only known at runtime
+                kernel_size = None
+            else:
+                kernel_size = np.min(output_shape)
+                kernel_size = (kernel_size //
+                               largest_factor(kernel_size)) + 1
             sigma = output_sigma
+            if self.subpixel == 'roi':
+                # the window covers +/- 4 standard deviations of the peak
+                roi_size = int(2 * np.ceil(4 * sigma) + 2)
+            else:
+                roi_size = None
             keypoints = SubpixelMaxima2D(kernel_size,
                                          sigma,
                                          upsample_factor=100,
                                          index=n_keypoints,
                                          coordinate_scale=2**downsample_factor,
                                          confidence_scale=255.,
+                                         roi_size=roi_size,
                                          )(output)
         else:
             keypoints = Maxima2D(index=n_keypoints,
@@ -147,8 +223,57 @@ class BaseModel:
 
         return evaluation_dict
 
-    def save(self, path, optimizer=True):
-        save_model(self, path, optimizer)
+    def save(self, path, optimizer=None, weights_dtype='float32'):
+        save_model(self, path, optimizer, weights_dtype)
+
+    def export(self, path):
+        export_model(self, path)
+
+    def optimize(self, images=None, fold_batchnorm=True, fold_normalization=True,
+                 slice_outputs=True, tolerance=1e-3, verbose=True):
+        """
+        Replaces `predict_model` with an optimized copy for inference.
+        See deepposekit.models.optimize.optimize_predict_model for details.
+
+        The optimized model shares unchanged layers with `train_model`
+        but folded layers are copied, so this should only be called
+        after training is finished. Saving the model is unaffected.
+
+        Parameters
+        ----------
+        images : array, shape = (n_samples, height, width, channels), default = None
+            Optional images used to validate the optimized model against
+            the original `predict_model`.
+        fold_batchnorm : bool, default = True
+            Whether to fold BatchNormalization layers.
+        fold_normalization : bool, default = True
+            Whether to fold ImageNormalization layers.
+        slice_outputs : bool, default = True
+            Whether to slice the output convolution to the keypoint channels.
+        tolerance : float, default = 1e-3
+            The tolerance used when validating the optimized model.
+        verbose : bool, default = True
+            Whether to print a summary of the optimizations.
+
+        Returns
+        -------
+        errors : dict or None
+            The validation errors if `images` is given, otherwise None.
+        """
+        optimized_model = optimize_predict_model(self,
+                                                 fold_batchnorm=fold_batchnorm,
+                                                 fold_normalization=fold_normalization,
+                                                 slice_outputs=slice_outputs,
+                                                 verbose=verbose)
+        errors = None
+        if images is not None:
+            errors = validate_optimized_model(self, optimized_model, images,
+                                              tolerance=tolerance)
+        self.predict_model = optimized_model
+        self.predict = self.predict_model.predict
+        self.predict_generator = self.predict_model.predict_generator
+        self.predict_on_batch = self.predict_model.predict_on_batch
+        return errors
 
     def get_config(self):
         config = {}
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import inspect
+import numpy as np
+
+from keras import layers
+from keras import backend as K
+from keras.engine.network import Network
+from keras.engine.input_layer import InputLayer
+from keras.backend import tf
+
+__all__ = ['layer_flops', 'count_flops', 'estimate_model', 'estimate_config']
+
+# layers that apply one operation per output element
+ELEMENTWISE_LAYERS = (layers.Activation, layers.ReLU, layers.LeakyReLU,
+                      layers.ELU, layers.PReLU, layers.Softmax)
+
+
+def _shapes(tensors):
+    return [K.int_shape(x) for x in tensors]
+
+
+def _size(shape):
+    if None in shape[1:]:
+        raise ValueError('cannot estimate layers with an unknown shape')
+    return int(np.prod(shape[1:]))
+
+
+def _has_fixed_shape(model):
+    return all(None not in K.int_shape(x)[1:] for x in model.inputs)
+
+
+def _set_input_shape(config, input_shape):
+    """Sets the height and width of the input layers in a network config,
+    including those of nested networks"""
+    for layer in config['layers']:
+        if layer['class_name'] == 'InputLayer':
+            batch_shape = list(layer['config']['batch_input_shape'])
+            if len(batch_shape) == 4:
+                batch_shape[1:3] = input_shape
+            layer['config']['batch_input_shape'] = tuple(batch_shape)
+        elif 'layers' in layer['config']:
+            _set_input_shape(layer['config'], input_shape)
+
+
+def _fixed_shape_model(model, input_shape=None):
+    """Returns the model, or for models with a variable input shape,
+    a copy with the given (height, width) built in a temporary graph"""
+    if _has_fixed_shape(model):
+        return model
+    if input_shape is None:
+        raise ValueError('model has a variable input shape, '
+                         'so input_shape must be given')
+    from .loading import CUSTOM_LAYERS
+
+    config = model.get_config()
+    _set_input_shape(config, tuple(input_shape[:2]))
+    with tf.Graph().as_default():
+        return model.__class__.from_config(config, custom_objects=CUSTOM_LAYERS)
+
+
+def layer_flops(layer, input_shapes, output_shapes):
+    """
+    Estimates the floating point operations of a layer call
+    for a single sample. Multiply-adds count as two operations.
+
+    Parameters
+    ----------
+    layer : keras Layer
+    input_shapes : list of tuple
+        The shapes of the inputs, including the batch dimension.
+    output_shapes : list of tuple
+        The shapes of the outputs, including the batch dimension.
+
+    Returns
+    -------
+    flops : int
+    """
+    input_shape = input_shapes[0]
+    output_shape = output_shapes[0]
+    n_outputs = _size(output_shape)
+    if isinstance(layer, layers.SeparableConv2D):
+        n_depthwise = input_shape[-1] * layer.depth_multiplier
+        flops = 2 * np.prod(output_shape[1:3]) * (np.prod(layer.kernel_size) * n_depthwise +
+                                                  n_depthwise * output_shape[-1])
+    elif isinstance(layer, layers.DepthwiseConv2D):
+        flops = 2 * n_outputs * np.prod(layer.kernel_size)
+    elif isinstance(layer, layers.Conv2DTranspose):
+        flops = 2 * np.prod(input_shape[1:3]) * np.prod(layer.kernel_size) * \
+            input_shape[-1] * output_shape[-1]
+    elif isinstance(layer, layers.Conv2D):
+        flops = 2 * n_outputs * np.prod(layer.kernel_size) * input_shape[-1]
+    elif isinstance(layer, layers.Dense):
+        flops = 2 * n_outputs * input_shape[-1]
+    elif isinstance(layer, layers.BatchNormalization):
+        # folded to one multiply-add per element at inference
+        flops = 2 * n_outputs
+    elif isinstance(layer, (layers.MaxPooling2D, layers.AveragePooling2D)):
+        flops = n_outputs * np.prod(layer.pool_size)
+    elif isinstance(layer, (layers.GlobalAveragePooling2D, layers.GlobalMaxPooling2D)):
+        flops = _size(input_shape)
+    elif isinstance(layer, (layers.Add, layers.Subtract, layers.Multiply,
+                            layers.Average, layers.Maximum)):
+        flops = n_outputs * (len(input_shapes) - 1)
+    elif isinstance(layer, ELEMENTWISE_LAYERS):
+        flops = n_outputs
+    else:
+        # reshaping, concatenation, padding, upsampling and casting
+        # layers, which are dominated by memory access
+        flops = 0
+    if getattr(layer, 'use_bias', False):
+        flops += n_outputs
+    return int(flops)
+
+
+def _network_nodes(network):
+    nodes = []
+    for depth in sorted(network._nodes_by_depth.keys(), reverse=True):
+        for node in network._nodes_by_depth[depth]:
+            if not isinstance(node.outbound_layer, InputLayer):
+                nodes.append(node)
+    return nodes
+
+
+def _walk(network, prefix=''):
+    """Returns the per-layer costs of a network and the peak number of
+    activation elements per sample that are alive at the same time
+    when the layers are run in order at inference"""
+    nodes = _network_nodes(network)
+    last_use = {}
+    for step, node in enumerate(nodes):
+        for x in node.input_tensors:
+            last_use[x.name] = step
+    for x in network.outputs:
+        last_use[x.name] = len(nodes)
+
+    entries = []
+    live = {x.name: _size(K.int_shape(x)) for x in network.inputs}
+    peak = sum(live.values())
+    counted = set()
+    for step, node in enumerate(nodes):
+        layer = node.outbound_layer
+        input_shapes = _shapes(node.input_tensors)
+        output_shapes = _shapes(node.output_tensors)
+        outputs = sum(_size(shape) for shape in output_shapes)
+        if isinstance(layer, Network):
+            nested_entries, nested_peak = _walk(layer, prefix + layer.name + '/')
+            entries += nested_entries
+            step_peak = sum(live.values()) + max(nested_peak, outputs)
+        else:
+            params = layer.count_params() if id(layer) not in counted else 0
+            entries.append({'name': prefix + layer.name,
+                            'class_name': layer.__class__.__name__,
+                            'output_shape': output_shapes[0] if len(output_shapes) == 1
+                            else output_shapes,
+                            'flops': layer_flops(layer, input_shapes, output_shapes),
+                            'params': params,
+                            'activations': outputs})
+            step_peak = sum(live.values()) + outputs
+        counted.add(id(layer))
+        peak = max(peak, step_peak)
+
+        for x in node.output_tensors:
+            live[x.name] = _size(K.int_shape(x))
+        for x in node.input_tensors:
+            if last_use.get(x.name) == step:
+                live.pop(x.name, None)
+    return entries, peak
+
+
+def count_flops(model, input_shape=None):
+    """
+    Counts the floating point operations of a keras model
+    for a single input sample. See `layer_flops`.
+
+    Parameters
+    ----------
+    model : keras.Model
+    input_shape : tuple of int, default = None
+        The (height, width) of the input, which must be given
+        for models with a variable input shape.
+
+    Returns
+    -------
+    flops : int
+    """
+    entries, peak = _walk(_fixed_shape_model(model, input_shape))
+    return sum(entry['flops'] for entry in entries)
+
+
+def estimate_model(model, inference_batch_size=1, training_batch_size=16,
+                   dtype_bytes=4, optimizer_slots=2, verbose=False,
+                   input_shape=None):
+    """
+    Estimates the computational cost of a model from its keras graph,
+    without running it.
+
+    Inference memory is the peak size of the activations that are alive
+    at the same time when layers run in order, plus the weights. Training
+    memory assumes all activations are kept for the backward pass, plus
+    the weights, their gradients and `optimizer_slots` copies of the
+    weights for the optimizer state (2 for Adam). The estimates exclude
+    framework workspace memory, so they are lower bounds.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel or keras.Model
+        For a BaseModel, inference is estimated with `predict_model`
+        and training with `train_model`.
+    inference_batch_size : int, default = 1
+    training_batch_size : int, default = 16
+    dtype_bytes : int, default = 4
+        The number of bytes per value, 4 for float32.
+    optimizer_slots : int, default = 2
+        The number of optimizer values per weight.
+    verbose : bool, default = False
+        Whether to print a per-layer table and the totals.
+    input_shape : tuple of int, default = None
+        The (height, width) of the input, which must be given
+        for models with a variable input shape, as the costs
+        depend on the frame size.
+
+    Returns
+    -------
+    estimate : dict
+        The per-layer 'layers' costs, the 'flops' per sample,
+        'params', and the 'inference_memory' and 'training_memory'
+        in bytes for the given batch sizes.
+    """
+    if hasattr(model, 'train_model'):
+        train_model = model.train_model
+        predict_model = getattr(model, 'predict_model', train_model)
+    else:
+        train_model = predict_model = model
+    train_model = _fixed_shape_model(train_model, input_shape)
+    predict_model = _fixed_shape_model(predict_model, input_shape)
+
+    entries, inference_peak = _walk(predict_model)
+    train_entries, train_peak = _walk(train_model)
+    params = predict_model.count_params()
+    train_params = train_model.count_params()
+    activations = (sum(entry['activations'] for entry in train_entries) +
+                   sum(_size(K.int_shape(x)) for x in train_model.inputs))
+
+    estimate = {'layers': entries,
+                'flops': sum(entry['flops'] for entry in entries),
+                'params': params,
+                'inference_memory': (inference_peak * inference_batch_size +
+                                     params) * dtype_bytes,
+                'training_memory': (activations * training_batch_size +
+                                    train_params * (2 + optimizer_slots)) * dtype_bytes}
+    if verbose:
+        print('{:<40} {:>22} {:>10} {:>10}'.format('layer', 'output shape',
+                                                  'MFLOPs', 'params'))
+        for entry in entries:
+            print('{:<40} {:>22} {:>10.2f} {:>10d}'.format(entry['name'][:40],
+                                                          str(entry['output_shape'])[:22],
+                                                          entry['flops'] / 1e6,
+                                                          entry['params']))
+        print('GFLOPs per sample: {:.3f}'.format(estimate['flops'] / 1e9))
+        print('parameters: {:d}'.format(estimate['params']))
+        print('inference memory (batch_size={}): {:.1f} MB'.format(inference_batch_size,
+                                                                 estimate['inference_memory'] / 1e6))
+        print('training memory (batch_size={}): {:.1f} MB'.format(training_batch_size,
+                                                                estimate['training_memory'] / 1e6))
+    return estimate
+
+
+def estimate_config(model_class, data_generator=None, inference_batch_size=1,
+                    training_batch_size=16, dtype_bytes=4, optimizer_slots=2,
+                    verbose=False, **config):
+    """
+    Estimates the cost of a model configuration, e.g. to reject
+    configurations that do not fit the budget before training.
+
+    The model is built in a temporary graph, which is discarded
+    afterwards, so the current keras session is not affected.
+    Pretrained weights are not loaded (e.g. DeepLabCut is built
+    with `pretrained=False`), as they do not change the estimate.
+
+    Parameters
+    ----------
+    model_class : class
+        The model class, e.g. StackedDenseNet
+    data_generator : TrainingGenerator or BenchmarkGenerator, default = None
+        Describes the frame size. Default is None, which uses
+        BenchmarkGenerator with default settings.
+    **config :
+        Arguments for `model_class`, e.g. n_stacks=3
+
+    Returns
+    -------
+    estimate : dict
+        See `estimate_model`.
+
+    Example
+    -------
+    generator = BenchmarkGenerator(height=512, width=512, n_keypoints=20)
+    estimate = estimate_config(StackedDenseNet, generator, n_stacks=3)
+    """
+    if data_generator is None:
+        from ..benchmark import BenchmarkGenerator
+        data_generator = BenchmarkGenerator()
+    if 'pretrained' in inspect.signature(model_class.__init__).parameters:
+        config.setdefault('pretrained', False)
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph).as_default() as session:
+        model = model_class(data_generator, **config)
+        estimate = estimate_model(model, inference_batch_size, training_batch_size,
+                                  dtype_bytes, optimizer_slots, verbose,
+                                  input_shape=(data_generator.height,
+                                               data_generator.width))
+    session.close()
+    return estimate
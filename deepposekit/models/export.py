@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import h5py
+import json
+
+from keras.backend import tf
+
+from ..utils.io import get_json_type
+from .session import create_session, clone_predict_model
+
+__all__ = ['export_model', 'load_exported_model',
+           'is_exported_model', 'ExportedModel']
+
+EXPORT_FORMAT = 'frozen_graph'
+
+
+def _check_path(path):
+    if isinstance(path, str):
+        if path.endswith('.h5') or path.endswith('.hdf5'):
+            return path
+        else:
+            raise ValueError('file must be .h5 file')
+    else:
+        raise TypeError('file must be type `str`')
+
+
+def freeze_predict_model(model):
+    """Returns a frozen tf.GraphDef of `model.predict_model` with the
+    weights stored as constants, along with the input and output names.
+    """
+    session = create_session()
+    predict_model = clone_predict_model(model, session)
+    input_name = predict_model.inputs[0].op.name
+    output_name = predict_model.outputs[0].op.name
+    with session.graph.as_default():
+        graph_def = session.graph.as_graph_def()
+        graph_def = tf.graph_util.convert_variables_to_constants(session,
+                                                                 graph_def,
+                                                                 [output_name])
+        graph_def = tf.graph_util.remove_training_nodes(graph_def,
+                                                        protected_nodes=[input_name,
+                                                                         output_name])
+    session.close()
+    return graph_def, input_name, output_name
+
+
+def export_model(model, path):
+    """
+    Exports the prediction model to an inference-only .h5 file.
+
+    The file contains a frozen TensorFlow graph of `model.predict_model`,
+    including the Maxima2D or SubpixelMaxima2D output layer, with the
+    weights stored as constants and the learning phase fixed to inference.
+    The model and data generator configs are stored as JSON metadata.
+
+    Unlike `save_model`, the exported file does not include the training
+    model or optimizer state, and `load_exported_model` does not rebuild
+    the model classes or custom layers, which makes loading much faster.
+    Exported models cannot be trained further.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`.
+    path : str
+        The path to the .h5 file.
+
+    Example
+    -------
+    export_model(model, 'model_inference.h5')
+    model = load_exported_model('model_inference.h5')
+    predictions = model.predict(images)
+    """
+    filepath = _check_path(path)
+    graph_def, input_name, output_name = freeze_predict_model(model)
+    predict_model = model.predict_model
+
+    with h5py.File(filepath, 'w') as h5file:
+        h5file.create_dataset('graph_def',
+                              data=np.void(graph_def.SerializeToString()))
+        h5file.attrs['format'] = EXPORT_FORMAT.encode('utf8')
+        h5file.attrs['export_config'] = json.dumps({
+            'input_name': input_name,
+            'output_name': output_name,
+            'input_shape': predict_model.input_shape,
+            'output_shape': predict_model.output_shape,
+        }, default=get_json_type).encode('utf8')
+
+        data_generator = model.data_generator
+        if data_generator is not None:
+            h5file.attrs['data_generator_config'] = json.dumps({
+                'class_name': data_generator.__class__.__name__,
+                'config': data_generator.get_config()
+            }, default=get_json_type).encode('utf8')
+
+        h5file.attrs['pose_model_config'] = json.dumps({
+            'class_name': model.__class__.__name__,
+            'config': model.get_config()
+        }, default=get_json_type).encode('utf8')
+
+
+def is_exported_model(path):
+    """Returns True if `path` was written with `export_model`"""
+    with h5py.File(_check_path(path), 'r') as h5file:
+        export_format = h5file.attrs.get('format')
+    if export_format is None:
+        return False
+    if isinstance(export_format, bytes):
+        export_format = export_format.decode('utf-8')
+    return export_format == EXPORT_FORMAT
+
+
+class ExportedModel:
+    """
+    An inference-only model loaded from a file written with `export_model`.
+
+    Parameters
+    ----------
+    path : str
+        The path to the exported .h5 file.
+    session_config : SessionConfig, default = None
+        The threading configuration for the session that runs the model.
+        Default is None, which uses the TensorFlow defaults.
+
+    Attributes
+    ----------
+    input_shape : tuple
+        The input shape of the model, (None, height, width, channels)
+    output_shape : tuple
+        The output shape of the model, (None, n_keypoints, 3)
+    session : tf.Session
+        The session that owns the graph of the model.
+    """
+    def __init__(self, path, session_config=None):
+        filepath = _check_path(path)
+        with h5py.File(filepath, 'r') as h5file:
+            serialized = h5file['graph_def'][()].tobytes()
+            export_config = json.loads(h5file.attrs['export_config'].decode('utf-8'))
+            model_config = h5file.attrs.get('pose_model_config')
+            data_generator_config = h5file.attrs.get('data_generator_config')
+
+        self.model_config = json.loads(model_config.decode('utf-8'))
+        if data_generator_config is not None:
+            self.data_generator_config = json.loads(data_generator_config.decode('utf-8'))
+        else:
+            self.data_generator_config = None
+        self.input_shape = tuple(export_config['input_shape'])
+        self.output_shape = tuple(export_config['output_shape'])
+
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(serialized)
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.session = create_session(graph=graph, session_config=session_config)
+        self.input_tensor = graph.get_tensor_by_name(export_config['input_name'] + ':0')
+        self.output_tensor = graph.get_tensor_by_name(export_config['output_name'] + ':0')
+        self._predict = self.session.make_callable(self.output_tensor,
+                                                   [self.input_tensor])
+        graph.finalize()
+
+    def predict_on_batch(self, x):
+        return self._predict(x)
+
+    def predict(self, x, batch_size=32):
+        """
+        Predict keypoints for an array of images.
+
+        Parameters
+        ----------
+        x : array, shape = (n_samples, height, width, channels)
+            The images to predict.
+        batch_size : int, default = 32
+            The number of images to run at once.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_samples, n_keypoints, 3)
+        """
+        outputs = [self._predict(x[idx:idx + batch_size])
+                   for idx in range(0, x.shape[0], batch_size)]
+        return np.concatenate(outputs)
+
+    def get_config(self):
+        config = dict(self.model_config['config'])
+        if self.data_generator_config is not None:
+            config.update(self.data_generator_config['config'])
+        return config
+
+    def close(self):
+        self.session.close()
+
+
+def load_exported_model(path, session_config=None):
+    '''
+    Load a model exported with `export_model` for inference
+
+    Example
+    -------
+    model = load_exported_model('model_inference.h5')
+    predictions = model.predict(images)
+
+    '''
+    return ExportedModel(path, session_config)
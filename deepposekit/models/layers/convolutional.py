@@ -125,6 +125,15 @@ class Maxima2D(Layer):
             It defaults to the `image_data_format` value found in your
             Keras config file at `~/.keras/keras.json`.
             If you never set it, then it will be "channels_last".
+        refine: A string,
+            one of `"quadratic"` or `"centroid"`.
+            Refines the integer maxima to subpixel precision with a local
+            quadratic fit or a weighted centroid in a window around each
+            maximum. This is much cheaper than SubpixelMaxima2D.
+            Default is None, which returns the integer maxima.
+        window_size: Integer,
+            The odd size of the window used to refine the maxima.
+            Default is 3.
     # Input shape
         4D tensor with shape:
         - If `data_format` is `"channels_last"`:
@@ -140,13 +149,20 @@ class Maxima2D(Layer):
     """
 
     def __init__(self, index=None, coordinate_scale=1.,
-                 confidence_scale=255., data_format=None, **kwargs):
+                 confidence_scale=255., data_format=None,
+                 refine=None, window_size=3, **kwargs):
         super(Maxima2D, self).__init__(**kwargs)
         self.data_format = normalize_data_format(data_format)
         self.input_spec = InputSpec(ndim=4)
         self.index = index
         self.coordinate_scale = coordinate_scale
         self.confidence_scale = confidence_scale
+        if refine not in [None, 'quadratic', 'centroid']:
+            raise ValueError('refine must be None, quadratic, or centroid')
+        if window_size % 2 == 0 or window_size < 3:
+            raise ValueError('window_size must be an odd integer >= 3')
+        self.refine = refine
+        self.window_size = window_size
 
     def compute_output_shape(self, input_shape):
         if self.data_format == 'channels_first':
@@ -164,14 +180,17 @@ class Maxima2D(Layer):
         elif self.data_format == 'channels_last':
             inputs = inputs[..., :self.index]
         outputs = find_maxima(inputs, self.coordinate_scale,
-                              self.confidence_scale, self.data_format)
+                              self.confidence_scale, self.data_format,
+                              self.refine, self.window_size)
         return outputs
 
     def get_config(self):
         config = {'data_format': self.data_format,
                   'index': self.index,
                   'coordinate_scale': self.coordinate_scale,
-                  'confidence_scale': self.confidence_scale}
+                  'confidence_scale': self.confidence_scale,
+                  'refine': self.refine,
+                  'window_size': self.window_size}
         base_config = super(Maxima2D, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
 
@@ -236,9 +255,20 @@ class RegisterRotation2D(Layer):
     """Register rotation layer for 2D inputs.
     Takes in target and source images and calculates
     the rotational shift that maximizes cross-correlation.
+    The FFT magnitude of each image is resampled onto a polar grid,
+    where a rotation becomes a shift along the angle axis.
     # Arguments
         upsample_factor : integer, optional
             The upsampling factor for subpixel resolution.  Defaults to 1.
+        rotation_resolution : float, optional
+            The angular resolution of the polar grid in degrees.
+            Defaults to 1.
+        rotation_guess : float, optional
+            The expected angle in degrees, used to resolve the
+            180 degree ambiguity of the FFT magnitude. Defaults to 0.
+        chunk_size : integer, optional
+            The number of angles resampled at once, which bounds
+            the memory used for fine resolutions. Defaults to 64.
         data_format: A string,
             one of `channels_last` (default) or `channels_first`.
             The ordering of the dimensions in the inputs.
@@ -265,12 +295,13 @@ class RegisterRotation2D(Layer):
 
     def __init__(self, upsample_factor=1,
                  rotation_resolution=1, rotation_guess=0,
-                 data_format=None, **kwargs):
+                 data_format=None, chunk_size=64, **kwargs):
         super(RegisterRotation2D, self).__init__(**kwargs)
         self.data_format = normalize_data_format(data_format)
         self.upsample_factor = upsample_factor
         self.rotation_resolution = rotation_resolution
         self.rotation_guess = rotation_guess
+        self.chunk_size = chunk_size
 
     def compute_output_shape(self, input_shape):
         return (input_shape[0], 1)
@@ -281,13 +312,15 @@ class RegisterRotation2D(Layer):
                              [target_images, src_images]''')
         return register_rotation(inputs[0], inputs[1],
                                  self.rotation_resolution, self.rotation_guess,
-                                 self.upsample_factor, self.data_format)
+                                 self.upsample_factor, self.data_format,
+                                 self.chunk_size)
 
     def get_config(self):
         config = {'data_format': self.data_format,
                   'upsample_factor': self.upsample_factor,
                   'rotation_resolution': self.rotation_resolution,
-                  'rotation_guess': self.rotation_guess}
+                  'rotation_guess': self.rotation_guess,
+                  'chunk_size': self.chunk_size}
         base_config = super(RegisterRotation2D, self).get_config()
 
         return dict(list(base_config.items()) + list(config.items()))
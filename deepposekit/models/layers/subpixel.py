@@ -15,7 +15,9 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from ..backend import find_subpixel_maxima
+import numpy as np
+
+from ..backend import find_subpixel_maxima, subpixel_constants
 from keras.engine import Layer
 from keras.engine import InputSpec
 
@@ -35,6 +37,14 @@ class SubpixelMaxima2D(Layer):
     for the channels in the input.
     The output is ordered as [row, col, maximum].
     # Arguments
+        kernel_size: Integer,
+            The odd size of the Gaussian kernel. If None, the size
+            is derived from `sigma` to cover +/- 3 standard deviations,
+            which does not depend on the input shape.
+        sigma: float,
+            The standard deviation of the Gaussian kernel.
+        upsample_factor: Integer,
+            The upsampling factor for subpixel precision.
         index: Integer,
             The index to slice the channels to.
             Default is None, which does not slice the channels.
@@ -48,6 +58,10 @@ class SubpixelMaxima2D(Layer):
             It defaults to the `image_data_format` value found in your
             Keras config file at `~/.keras/keras.json`.
             If you never set it, then it will be "channels_last".
+        roi_size: Integer,
+            The size of the window around the integer peak of each
+            channel that is used to find the subpixel maxima.
+            Default is None, which uses the full input.
     # Input shape
         4D tensor with shape:
         - If `data_format` is `"channels_last"`:
@@ -64,16 +78,33 @@ class SubpixelMaxima2D(Layer):
 
     def __init__(self, kernel_size, sigma, upsample_factor, index=None,
                  coordinate_scale=1., confidence_scale=255., data_format=None,
-                 **kwargs):
+                 roi_size=None, **kwargs):
         super(SubpixelMaxima2D, self).__init__(**kwargs)
         self.data_format = normalize_data_format(data_format)
         self.input_spec = InputSpec(ndim=4)
+        if kernel_size is None:
+            kernel_size = int(2 * np.ceil(3 * sigma) + 1)
         self.kernel_size = kernel_size
         self.sigma = sigma
         self.upsample_factor = upsample_factor
         self.index = index
         self.coordinate_scale = coordinate_scale
         self.confidence_scale = confidence_scale
+        self.roi_size = roi_size
+        self.constants = None
+
+    def build(self, input_shape):
+        if self.data_format == 'channels_first':
+            shape = input_shape[2:]
+        elif self.data_format == 'channels_last':
+            shape = input_shape[1:3]
+        # the kernel FFT and DFT matrices only depend on the input shape,
+        # so they are computed once here instead of in every graph run
+        if self.roi_size is not None or None not in shape:
+            self.constants = subpixel_constants(shape, self.kernel_size,
+                                                self.sigma, self.upsample_factor,
+                                                self.roi_size)
+        super(SubpixelMaxima2D, self).build(input_shape)
 
     def compute_output_shape(self, input_shape):
         if self.data_format == 'channels_first':
@@ -91,7 +122,8 @@ class SubpixelMaxima2D(Layer):
             inputs = inputs[..., :self.index]
         outputs = find_subpixel_maxima(inputs, self.kernel_size, self.sigma,
                                        self.upsample_factor, self.coordinate_scale,
-                                       self.confidence_scale, self.data_format)
+                                       self.confidence_scale, self.data_format,
+                                       self.roi_size, self.constants)
         return outputs
 
     def get_config(self):
@@ -101,6 +133,7 @@ class SubpixelMaxima2D(Layer):
                   'upsample_factor': self.upsample_factor,
                   'index': self.index,
                   'coordinate_scale': self.coordinate_scale,
-                  'confidence_scale': self.confidence_scale}
+                  'confidence_scale': self.confidence_scale,
+                  'roi_size': self.roi_size}
         base_config = super(SubpixelMaxima2D, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
@@ -18,7 +18,7 @@ limitations under the License.
 from keras.engine import Layer
 import keras.backend as K
 
-__all__ = ['Float', 'ImageNormalization']
+__all__ = ['Float', 'ImageNormalization', 'GatherChannel', 'BiasMap2D']
 
 class Float(Layer):
     """
@@ -60,3 +60,62 @@ class ImageNormalization(Layer):
 
     def compute_output_shape(self, input_shape):
         return input_shape
+
+
+class GatherChannel(Layer):
+    """Gather channel layer.
+    Selects one channel of each sample, given by an index per sample,
+    e.g. to train a network with one output channel per keypoint on
+    samples that are each labeled for a single keypoint.
+    # Input shape
+        A list of a 4D tensor with shape `(batch, rows, cols, channels)`
+        and an integer tensor with shape `(batch, 1)`.
+    # Output shape
+        4D tensor with shape `(batch, rows, cols, 1)`.
+    """
+
+    def __init__(self, **kwargs):
+        super(GatherChannel, self).__init__(**kwargs)
+
+    def call(self, inputs):
+        if not isinstance(inputs, list):
+            raise ValueError('inputs must be a list [maps, index]')
+        maps, index = inputs
+        n_channels = K.int_shape(maps)[-1]
+        mask = K.one_hot(K.cast(K.flatten(index), 'int32'), n_channels)
+        mask = K.reshape(mask, (-1, 1, 1, n_channels))
+        return K.sum(maps * mask, axis=-1, keepdims=True)
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0][:-1] + (1,)
+
+
+class BiasMap2D(Layer):
+    """Bias map layer.
+    Adds a fixed bias to each position and channel of the input,
+    e.g. a convolution bias that differs at the borders of the
+    input when an affine transform is folded into the kernel.
+    The bias is a non-trainable weight set with `set_weights`.
+    # Input shape
+        4D tensor with shape `(batch, rows, cols, channels)`.
+    # Output shape
+        Same shape as input.
+    """
+
+    def __init__(self, **kwargs):
+        super(BiasMap2D, self).__init__(**kwargs)
+
+    def build(self, input_shape):
+        if None in input_shape[1:]:
+            raise ValueError('BiasMap2D requires a fixed input shape')
+        self.bias = self.add_weight(name='bias',
+                                    shape=tuple(input_shape[1:]),
+                                    initializer='zeros',
+                                    trainable=False)
+        super(BiasMap2D, self).build(input_shape)
+
+    def call(self, inputs):
+        return inputs + self.bias
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
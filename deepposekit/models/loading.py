@@ -16,17 +16,22 @@ limitations under the License.
 """
 
 from keras.engine import saving
+from keras import backend as K
+import numpy as np
 import h5py
 import json
 import inspect
 
-from .layers.util import ImageNormalization, Float
+from .layers.util import ImageNormalization, Float, GatherChannel, BiasMap2D
 from .layers.convolutional import (UpSampling2D,
                                    SubPixelDownscaling,
-                                   SubPixelUpscaling)
+                                   SubPixelUpscaling,
+                                   Maxima2D)
+from .layers.subpixel import SubpixelMaxima2D
 from .layers.deeplabcut import ResNetPreprocess
 
 from ..io import TrainingGenerator
+from .session import SessionConfig
 from .LEAP import LEAP
 from .StackedDenseNet import StackedDenseNet
 from .StackedHourglass import StackedHourglass
@@ -43,13 +48,62 @@ CUSTOM_LAYERS = {'Float': Float,
                  'UpSampling2D': UpSampling2D,
                  'SubPixelDownscaling': SubPixelDownscaling,
                  'SubPixelUpscaling': SubPixelUpscaling,
-                 'ResNetPreprocess': ResNetPreprocess}
+                 'ResNetPreprocess': ResNetPreprocess,
+                 'Maxima2D': Maxima2D,
+                 'SubpixelMaxima2D': SubpixelMaxima2D,
+                 'GatherChannel': GatherChannel,
+                 'BiasMap2D': BiasMap2D}
 
 
-def load_model(path, augmenter=None, custom_objects=None, datapath=None):
+def _weights_dtype(h5file):
+    weights_dtype = h5file.attrs.get('weights_dtype', b'float32')
+    if isinstance(weights_dtype, bytes):
+        weights_dtype = weights_dtype.decode('utf-8')
+    return weights_dtype
+
+
+def _load_upcast_model(filepath, custom_objects):
+    """Loads a keras model stored with float16 weights
+    and upcasts the weights to floatx"""
+    with h5py.File(filepath, 'r') as h5file:
+        model_config = json.loads(h5file.attrs['model_config'].decode('utf-8'))
+        train_model = saving.model_from_config(model_config,
+                                               custom_objects=custom_objects)
+        weights_group = h5file['model_weights']
+        weight_value_tuples = []
+        for layer in train_model.layers:
+            if layer.name not in weights_group or not layer.weights:
+                continue
+            layer_group = weights_group[layer.name]
+            weight_names = [name.decode('utf-8') if isinstance(name, bytes) else name
+                            for name in layer_group.attrs['weight_names']]
+            weight_values = [np.asarray(layer_group[name], dtype=K.floatx())
+                             for name in weight_names]
+            if len(weight_values) != len(layer.weights):
+                raise ValueError('layer {} expects {} weights, '
+                                 'but the saved layer has {}'.format(layer.name,
+                                                                     len(layer.weights),
+                                                                     len(weight_values)))
+            weight_value_tuples += zip(layer.weights, weight_values)
+        K.batch_set_value(weight_value_tuples)
+    return train_model
+
+
+def load_model(path, augmenter=None, custom_objects=None, datapath=None,
+               session_config=None):
     '''
     Load the model
 
+    Models saved with float16 weights are upcast to float32
+    and are not compiled, as they do not store an optimizer.
+
+    Parameters
+    ----------
+    session_config : SessionConfig, default = None
+        The threading and allocator configuration for the keras
+        session the model is loaded into. Default is None, which
+        uses the current keras session.
+
     Example
     -------
     model = load_model('model.h5', augmenter)
@@ -71,8 +125,18 @@ def load_model(path, augmenter=None, custom_objects=None, datapath=None):
     else:
         raise TypeError('file must be type `str`')
 
-    train_model = saving.load_model(filepath,
-                                    custom_objects=custom_objects)
+    if session_config is not None:
+        if not isinstance(session_config, SessionConfig):
+            raise TypeError('session_config must be class SessionConfig')
+        session_config.apply()
+
+    with h5py.File(filepath, 'r') as h5file:
+        weights_dtype = _weights_dtype(h5file)
+    if weights_dtype == 'float16':
+        train_model = _load_upcast_model(filepath, custom_objects)
+    else:
+        train_model = saving.load_model(filepath,
+                                        custom_objects=custom_objects)
 
     with h5py.File(filepath, 'r') as h5file:
         data_generator_config = h5file.attrs.get('data_generator_config')
@@ -106,11 +170,13 @@ def load_model(path, augmenter=None, custom_objects=None, datapath=None):
     keys.remove('data_generator')
     if 'kwargs' in keys:
         keys.remove('kwargs')
-    kwargs = {key: model_config[key] for key in keys}
+    # options added after the model was saved keep their defaults
+    kwargs = {key: model_config[key] for key in keys if key in model_config}
     kwargs['data_generator'] = data_generator
     kwargs['skip_init'] = True
 
     model = Model(**kwargs)
+    model.session_config = session_config
     model.train_model = train_model
     model.__init_train_model__()
 
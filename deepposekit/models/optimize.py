@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+from collections import defaultdict
+import warnings
+
+from keras import Input, Model
+from keras.engine.network import Network
+from keras.engine.input_layer import InputLayer
+from keras.layers import Conv2D, Conv2DTranspose, BatchNormalization, Activation
+from keras import backend as K
+
+from .layers.util import ImageNormalization, BiasMap2D
+from .layers.convolutional import Maxima2D
+from .layers.subpixel import SubpixelMaxima2D
+
+__all__ = ['optimize_predict_model', 'validate_optimized_model']
+
+
+def _affine_params(layer):
+    """Returns the per-channel (scale, shift) of an affine layer
+    at inference, or None if the layer cannot be folded"""
+    if isinstance(layer, ImageNormalization):
+        n_channels = layer.input_shape[-1]
+        if n_channels is None:
+            return None
+        scale = np.full(n_channels, 2.0 / 255.)
+        shift = np.full(n_channels, -1.0)
+        return scale, shift
+    if type(layer) is BatchNormalization:
+        if layer.axis not in (-1, len(layer.input_shape) - 1):
+            return None
+        weights = layer.get_weights()
+        gamma = weights.pop(0) if layer.scale else 1.
+        beta = weights.pop(0) if layer.center else 0.
+        moving_mean, moving_variance = weights
+        scale = gamma / np.sqrt(moving_variance + layer.epsilon)
+        shift = beta - moving_mean * scale
+        scale = np.ones_like(moving_mean) * scale
+        shift = np.ones_like(moving_mean) * shift
+        return scale, shift
+    return None
+
+
+def _is_conv(layer):
+    return (type(layer) in (Conv2D, Conv2DTranspose)
+            and layer.data_format == 'channels_last')
+
+
+def _can_fold_input(layer, x, shift):
+    """Whether an affine transform of the input `x` can be folded
+    exactly into the kernel and bias of a Conv2D layer"""
+    if type(layer) is not Conv2D or layer.data_format != 'channels_last':
+        return False
+    if (tuple(layer.kernel_size) == (1, 1) or layer.padding == 'valid' or
+            np.all(shift == 0)):
+        return True
+    # with zero padding, the bias differs at the borders,
+    # which needs a bias map with a fixed shape
+    return None not in K.int_shape(x)[1:3]
+
+
+def _needs_bias_map(layer, shift):
+    return not (tuple(layer.kernel_size) == (1, 1) or layer.padding == 'valid' or
+                np.all(shift == 0))
+
+
+def _padding_masks(layer, input_shape):
+    """Returns, for each spatial axis, which kernel taps of each
+    output position fall inside the input of a 'same' convolution"""
+    masks = []
+    for size, kernel_size, stride, dilation in zip(input_shape, layer.kernel_size,
+                                                   layer.strides, layer.dilation_rate):
+        n_outputs = int(np.ceil(size / float(stride)))
+        padding = max((n_outputs - 1) * stride + (kernel_size - 1) * dilation + 1
+                      - size, 0) // 2
+        index = (np.arange(n_outputs)[:, None] * stride - padding +
+                 np.arange(kernel_size)[None, :] * dilation)
+        masks.append((index >= 0) & (index < size))
+    return masks
+
+
+def _conv_weights(layer):
+    weights = layer.get_weights()
+    kernel = weights[0]
+    if layer.use_bias:
+        bias = weights[1]
+    else:
+        n_filters = kernel.shape[2] if type(layer) is Conv2DTranspose else kernel.shape[3]
+        bias = np.zeros(n_filters, dtype=kernel.dtype)
+    return kernel, bias
+
+
+def _fold_input(kernel, bias, scale, shift):
+    # kernel shape is (rows, cols, in_channels, out_channels)
+    bias = bias + np.einsum('hwio,i->o', kernel, shift)
+    kernel = kernel * scale[None, None, :, None]
+    return kernel, bias
+
+
+def _fold_padded_input(layer, input_shape, kernel, bias, scale, shift):
+    """Folds an affine transform of the input into a convolution with
+    zero padding. The kernel taps in the padding see zeros instead of
+    the shift, so the bias becomes a (rows, cols, out_channels) map"""
+    row_mask, col_mask = _padding_masks(layer, input_shape)
+    tap_shift = np.einsum('hwio,i->hwo', kernel, shift)
+    bias = bias + np.einsum('rh,cw,hwo->rco', row_mask.astype(kernel.dtype),
+                            col_mask.astype(kernel.dtype), tap_shift)
+    kernel = kernel * scale[None, None, :, None]
+    return kernel, bias
+
+
+def _fold_output(layer, kernel, bias, scale, shift):
+    if type(layer) is Conv2DTranspose:
+        kernel = kernel * scale[None, None, :, None]
+    else:
+        kernel = kernel * scale[None, None, None, :]
+    bias = bias * scale + shift
+    return kernel, bias
+
+
+def _slice_output(layer, kernel, bias, index):
+    if type(layer) is Conv2DTranspose:
+        kernel = kernel[:, :, :index]
+    else:
+        kernel = kernel[..., :index]
+    return kernel, bias[..., :index]
+
+
+def _build_conv(layer, inputs, kernel, bias):
+    config = layer.get_config()
+    config.pop('name')
+    config['filters'] = bias.shape[-1]
+    if bias.ndim == 1:
+        config['use_bias'] = True
+        new_layer = layer.__class__.from_config(config)
+        outputs = new_layer(inputs)
+        new_layer.set_weights([kernel.astype(np.float32), bias.astype(np.float32)])
+        return outputs
+    # the bias map is added before the activation
+    activation = config['activation']
+    config['use_bias'] = False
+    config['activation'] = 'linear'
+    new_layer = layer.__class__.from_config(config)
+    outputs = new_layer(inputs)
+    new_layer.set_weights([kernel.astype(np.float32)])
+    bias_layer = BiasMap2D()
+    outputs = bias_layer(outputs)
+    bias_layer.set_weights([bias.astype(np.float32)])
+    if activation != 'linear':
+        outputs = Activation(activation)(outputs)
+    return outputs
+
+
+def _count_layers(network, layer_class):
+    """Counts the layers of a class, including those of nested networks"""
+    count = 0
+    for layer in network.layers:
+        if isinstance(layer, Network):
+            count += _count_layers(layer, layer_class)
+        elif type(layer) is layer_class:
+            count += 1
+    return count
+
+
+def _network_nodes(network):
+    nodes = []
+    for depth in sorted(network._nodes_by_depth.keys(), reverse=True):
+        for node in network._nodes_by_depth[depth]:
+            if not isinstance(node.outbound_layer, InputLayer):
+                nodes.append(node)
+    return nodes
+
+
+def _call_layer(layer, node, inputs):
+    if len(inputs) == 1:
+        inputs = inputs[0]
+    arguments = node.arguments if node.arguments else {}
+    outputs = layer(inputs, **arguments)
+    if not isinstance(outputs, list):
+        outputs = [outputs]
+    return outputs
+
+
+def _rewrite_network(network, inputs, options, summary):
+    tensor_map = {}
+    pending = {}
+    for x, new_x in zip(network.inputs, inputs):
+        tensor_map[x.name] = new_x
+
+    nodes = _network_nodes(network)
+    consumers = defaultdict(list)
+    for node in nodes:
+        for x in node.input_tensors:
+            consumers[x.name].append(node)
+    for x in network.outputs:
+        # outputs of the network have consumers outside of it
+        consumers[x.name].append(None)
+
+    def single_consumer(x):
+        x_consumers = consumers[x.name]
+        if len(x_consumers) == 1 and x_consumers[0] is not None:
+            return x_consumers[0]
+        return None
+
+    absorbed = set()
+    for node in nodes:
+        if id(node) in absorbed:
+            continue
+        layer = node.outbound_layer
+        input_tensors = node.input_tensors
+        output_tensors = node.output_tensors
+
+        if isinstance(layer, Network):
+            new_inputs = [tensor_map[x.name] for x in input_tensors]
+            new_outputs, _ = _rewrite_network(layer, new_inputs, options, summary)
+            for x, new_x in zip(output_tensors, new_outputs):
+                tensor_map[x.name] = new_x
+            continue
+
+        affine = None
+        if isinstance(layer, ImageNormalization) and options['fold_normalization']:
+            affine = _affine_params(layer)
+        elif isinstance(layer, BatchNormalization) and options['fold_batchnorm']:
+            affine = _affine_params(layer)
+        if affine is not None and len(input_tensors) == 1:
+            scale, shift = affine
+            x_consumers = consumers[output_tensors[0].name]
+            if all([x_node is not None and
+                    _can_fold_input(x_node.outbound_layer, output_tensors[0], shift)
+                    for x_node in x_consumers]):
+                pending[output_tensors[0].name] = (tensor_map[input_tensors[0].name],
+                                                   scale, shift)
+                summary[layer.__class__.__name__] += 1
+                continue
+
+        if _is_conv(layer) and len(input_tensors) == 1:
+            x = input_tensors[0]
+            output = output_tensors[0]
+            modified = False
+            if x.name in pending:
+                new_x, scale, shift = pending[x.name]
+                kernel, bias = _conv_weights(layer)
+                if _needs_bias_map(layer, shift):
+                    kernel, bias = _fold_padded_input(layer, K.int_shape(x)[1:3],
+                                                      kernel, bias, scale, shift)
+                else:
+                    kernel, bias = _fold_input(kernel, bias, scale, shift)
+                modified = True
+            else:
+                new_x = tensor_map[x.name]
+                kernel, bias = _conv_weights(layer)
+
+            activation = layer.get_config()['activation']
+            batchnorm_node = single_consumer(output)
+            if (options['fold_batchnorm'] and activation == 'linear' and
+                    batchnorm_node is not None and
+                    type(batchnorm_node.outbound_layer) is BatchNormalization):
+                affine = _affine_params(batchnorm_node.outbound_layer)
+                if affine is not None:
+                    kernel, bias = _fold_output(layer, kernel, bias, *affine)
+                    absorbed.add(id(batchnorm_node))
+                    output = batchnorm_node.output_tensors[0]
+                    summary['BatchNormalization'] += 1
+                    modified = True
+
+            maxima_node = single_consumer(output)
+            if (options['slice_outputs'] and maxima_node is not None and
+                    isinstance(maxima_node.outbound_layer, (Maxima2D, SubpixelMaxima2D))):
+                index = maxima_node.outbound_layer.index
+                if index is not None and index < bias.shape[-1]:
+                    kernel, bias = _slice_output(layer, kernel, bias, index)
+                    summary['sliced_channels'] += layer.filters - index
+                    modified = True
+
+            if modified:
+                tensor_map[output.name] = _build_conv(layer, new_x, kernel, bias)
+            else:
+                tensor_map[output.name] = layer(new_x)
+            continue
+
+        new_inputs = []
+        for x in input_tensors:
+            if x.name in pending:
+                raise RuntimeError('affine layer folded without a foldable consumer')
+            new_inputs.append(tensor_map[x.name])
+        new_outputs = _call_layer(layer, node, new_inputs)
+        for x, new_x in zip(output_tensors, new_outputs):
+            tensor_map[x.name] = new_x
+
+    outputs = [tensor_map[x.name] for x in network.outputs]
+    return outputs, tensor_map
+
+
+def optimize_predict_model(model, fold_batchnorm=True, fold_normalization=True,
+                           slice_outputs=True, verbose=True):
+    """
+    Builds an optimized copy of `model.predict_model` for inference.
+
+    The optimizations are exact, so the outputs should only differ
+    by floating point error:
+
+    - BatchNormalization layers directly following a convolution with a
+      linear activation are folded into the convolution kernel and bias.
+    - BatchNormalization and ImageNormalization layers whose outputs are
+      only used by convolutions are folded into the kernels and biases of
+      those convolutions. For convolutions with 'same' padding, the kernel
+      taps in the zero padding do not see the shift, so the bias differs
+      at the borders and is added as a fixed bias map (BiasMap2D). This
+      needs a fixed input shape, so these layers are not folded in models
+      with a variable shape. Layers followed by an activation are not
+      folded. The number of folded layers is printed with `verbose` and
+      returned by `validate_optimized_model`.
+    - The last convolution is sliced to only compute the keypoint channels
+      that are read by the Maxima2D or SubpixelMaxima2D output layer,
+      dropping the edge and summary confidence maps.
+
+    Layers that are not changed are shared with the original model,
+    so the optimized model should only be used after training.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`.
+    fold_batchnorm : bool, default = True
+        Whether to fold BatchNormalization layers.
+    fold_normalization : bool, default = True
+        Whether to fold ImageNormalization layers.
+    slice_outputs : bool, default = True
+        Whether to slice the output convolution to the keypoint channels.
+    verbose : bool, default = True
+        Whether to print a summary of the optimizations.
+
+    Returns
+    -------
+    predict_model : keras.Model
+        The optimized prediction model.
+    """
+    predict_model = model.predict_model
+    options = {'fold_batchnorm': fold_batchnorm,
+               'fold_normalization': fold_normalization,
+               'slice_outputs': slice_outputs}
+    summary = defaultdict(int)
+
+    input_layer = Input(batch_shape=predict_model.inputs[0]._keras_shape,
+                        dtype=predict_model.inputs[0].dtype.name)
+    outputs, _ = _rewrite_network(predict_model, [input_layer], options, summary)
+    optimized_model = Model(input_layer, outputs[0],
+                            name=predict_model.name + '_optimized')
+    if verbose:
+        n_batchnorm = _count_layers(predict_model, BatchNormalization)
+        print('folded {} of {} BatchNormalization layers, '
+              '{} ImageNormalization layers, '
+              'sliced {} output channels'.format(summary['BatchNormalization'],
+                                                 n_batchnorm,
+                                                 summary['ImageNormalization'],
+                                                 summary['sliced_channels']))
+    return optimized_model
+
+
+def validate_optimized_model(model, optimized_model, images, batch_size=8,
+                             tolerance=1e-3):
+    """
+    Compares the outputs of an optimized prediction model
+    with the outputs of `model.predict_model`.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The original model.
+    optimized_model : keras.Model
+        The model returned by `optimize_predict_model`.
+    images : array, shape = (n_samples, height, width, channels)
+        The images to compare predictions for. Real images
+        should be used, as ties between peaks in random images
+        can change the predicted coordinates.
+    batch_size : int, default = 8
+        The batch size for prediction.
+    tolerance : float, default = 1e-3
+        The maximum relative difference of the keypoint
+        confidence values before a warning is issued.
+
+    Returns
+    -------
+    errors : dict
+        The maximum absolute differences of the keypoint coordinates
+        and of the confidence values, the maximum relative
+        difference of the confidence values, and the number of
+        BatchNormalization layers in the original model and
+        the number that were folded.
+    """
+    y_true = model.predict_model.predict(images, batch_size=batch_size)
+    y_pred = optimized_model.predict(images, batch_size=batch_size)
+    coordinate_error = np.abs(y_true[..., :2] - y_pred[..., :2]).max()
+    confidence_error = np.abs(y_true[..., 2] - y_pred[..., 2]).max()
+    confidence_scale = np.maximum(np.abs(y_true[..., 2]).max(), 1e-12)
+    relative_error = confidence_error / confidence_scale
+
+    if relative_error > tolerance:
+        warnings.warn('optimized model outputs differ from the original model '
+                      '(relative confidence error {:.2e})'.format(relative_error),
+                      RuntimeWarning)
+    n_batchnorm = _count_layers(model.predict_model, BatchNormalization)
+    n_remaining = _count_layers(optimized_model, BatchNormalization)
+    return {'coordinate_error': coordinate_error,
+            'confidence_error': confidence_error,
+            'relative_error': relative_error,
+            'batchnorm_layers': n_batchnorm,
+            'folded_batchnorm': n_batchnorm - n_remaining}
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+from collections import defaultdict
+import warnings
+
+from keras import Model
+from keras import backend as K
+from keras.engine.network import Network
+from keras.engine.input_layer import InputLayer
+from keras import layers
+
+from .layers.util import ImageNormalization, Float
+from .layers.convolutional import UpSampling2D
+from .estimate import count_flops
+
+__all__ = ['rank_filters', 'prune_filters', 'prune_model']
+
+# layers that operate on each channel independently, so pruned
+# channels can be passed through them to the next convolution
+CHANNELWISE_LAYERS = (layers.BatchNormalization, layers.Activation,
+                      layers.ReLU, layers.LeakyReLU, layers.ELU,
+                      layers.AveragePooling2D, layers.MaxPooling2D,
+                      layers.UpSampling2D, layers.ZeroPadding2D,
+                      layers.Cropping2D, layers.Dropout,
+                      layers.SpatialDropout2D, UpSampling2D,
+                      ImageNormalization, Float)
+
+
+def _is_conv(layer):
+    return (type(layer) in (layers.Conv2D, layers.Conv2DTranspose)
+            and layer.data_format == 'channels_last')
+
+
+def _kernel_axes(layer):
+    """Returns the (input, output) channel axes of the kernel"""
+    if type(layer) is layers.Conv2DTranspose:
+        return 3, 2
+    return 2, 3
+
+
+def _is_concatenate(layer):
+    return isinstance(layer, layers.Concatenate) and layer.axis in (-1, 3)
+
+
+def _network_nodes(network):
+    nodes = []
+    for depth in sorted(network._nodes_by_depth.keys(), reverse=True):
+        for node in network._nodes_by_depth[depth]:
+            if not isinstance(node.outbound_layer, InputLayer):
+                nodes.append(node)
+    return nodes
+
+
+def _consumers(network, nodes):
+    consumers = defaultdict(list)
+    for node in nodes:
+        for x in node.input_tensors:
+            consumers[x.name].append(node)
+    for x in network.outputs:
+        # outputs are used by the loss, so their channels are fixed
+        consumers[x.name].append(None)
+    return consumers
+
+
+def _prunable_layers(network):
+    """Returns the convolutions whose output channels only reach
+    other convolutions, through channelwise and concatenate layers"""
+    nodes = _network_nodes(network)
+    for node in nodes:
+        if isinstance(node.outbound_layer, Network):
+            raise ValueError('pruning nested models is not supported')
+    consumers = _consumers(network, nodes)
+
+    def reaches_only_convs(x):
+        stack = [x]
+        while stack:
+            x = stack.pop()
+            for node in consumers[x.name]:
+                if node is None:
+                    return False
+                layer = node.outbound_layer
+                if len(layer._inbound_nodes) > 1:
+                    # shared layers must see the same channels on every call
+                    return False
+                elif _is_conv(layer):
+                    continue
+                elif (isinstance(layer, CHANNELWISE_LAYERS) or _is_concatenate(layer)):
+                    stack.extend(node.output_tensors)
+                else:
+                    return False
+        return True
+
+    prunable = []
+    for node in nodes:
+        layer = node.outbound_layer
+        if (_is_conv(layer) and len(layer._inbound_nodes) == 1 and
+                reaches_only_convs(node.output_tensors[0])):
+            prunable.append(layer)
+    return prunable
+
+
+def rank_filters(model, criterion='magnitude', images=None):
+    """
+    Scores the output filters of each prunable convolution.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+    criterion : str, default = 'magnitude'
+        'magnitude' scores filters by the mean absolute value of their
+        kernel weights. 'activation' scores filters by their mean
+        absolute activation over `images`.
+    images : array, shape = (n_samples, height, width, channels)
+        The images for the 'activation' criterion.
+
+    Returns
+    -------
+    scores : dict
+        The filter scores for the name of each prunable layer,
+        normalized by the mean score of the layer so that
+        scores are comparable across layers.
+    """
+    prunable = _prunable_layers(model.train_model)
+    if criterion == 'magnitude':
+        scores = {}
+        for layer in prunable:
+            kernel = K.get_value(layer.kernel)
+            input_axis, output_axis = _kernel_axes(layer)
+            axes = tuple(axis for axis in range(4) if axis != output_axis)
+            scores[layer.name] = np.mean(np.abs(kernel), axis=axes)
+    elif criterion == 'activation':
+        if images is None:
+            raise ValueError('images must be given for the activation criterion')
+        outputs = [layer.output for layer in prunable]
+        function = K.function(model.train_model.inputs, outputs)
+        activations = function([images])
+        scores = {layer.name: np.mean(np.abs(activation), axis=(0, 1, 2))
+                  for layer, activation in zip(prunable, activations)}
+    else:
+        raise ValueError('criterion must be magnitude or activation')
+    for name, score in scores.items():
+        scores[name] = score / np.maximum(score.mean(), K.epsilon())
+    return scores
+
+
+def _select_filters(scores, fraction, min_filters):
+    """Returns the filters to keep for each layer after
+    removing the `fraction` of filters with the lowest scores"""
+    candidates = []
+    for name, score in scores.items():
+        order = np.argsort(score)
+        n_removable = max(0, score.shape[0] - min_filters)
+        for idx in order[:n_removable]:
+            candidates.append((score[idx], name, idx))
+    n_filters = sum(score.shape[0] for score in scores.values())
+    n_remove = min(int(np.ceil(fraction * n_filters)), len(candidates))
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    removed = defaultdict(set)
+    for score, name, idx in candidates[:n_remove]:
+        removed[name].add(idx)
+    plan = {}
+    for name, score in scores.items():
+        if removed[name]:
+            plan[name] = np.array([idx for idx in range(score.shape[0])
+                                   if idx not in removed[name]])
+    return plan
+
+
+def _take(weights, keep, axis):
+    if keep is None:
+        return weights
+    return np.take(weights, keep, axis=axis)
+
+
+def _copy_layer(layer, inputs, node, weights, **config):
+    layer_config = layer.get_config()
+    layer_config.update(config)
+    new_layer = layer.__class__.from_config(layer_config)
+    arguments = node.arguments if node.arguments else {}
+    outputs = new_layer(inputs, **arguments)
+    new_layer.set_weights(weights)
+    return new_layer, outputs
+
+
+def prune_filters(train_model, plan):
+    """
+    Rebuilds a keras model with the output filters of convolutions removed.
+
+    Parameters
+    ----------
+    train_model : keras.Model
+        The model to prune.
+    plan : dict
+        The indices of the filters to keep for each layer name.
+        Layers must be prunable as determined by `rank_filters`.
+
+    Returns
+    -------
+    pruned_model : keras.Model
+        A new model with copies of the weights. Layer names are
+        unchanged so the outputs can be matched to losses.
+    """
+    nodes = _network_nodes(train_model)
+    tensor_map = {}
+    for x, name in zip(train_model.inputs, train_model.input_names):
+        new_x = layers.Input(batch_shape=K.int_shape(x), dtype=x.dtype.name,
+                             name=name)
+        tensor_map[x.name] = (new_x, None)
+    copies = {}
+
+    for node in nodes:
+        layer = node.outbound_layer
+        inputs = [tensor_map[x.name] for x in node.input_tensors]
+        keeps = [keep for new_x, keep in inputs]
+        new_inputs = [new_x for new_x, keep in inputs]
+        if len(new_inputs) == 1:
+            new_inputs = new_inputs[0]
+        weights = layer.get_weights()
+        output_keep = None
+        unchanged = all(keep is None for keep in keeps) and layer.name not in plan
+
+        if unchanged and id(layer) in copies:
+            # reuse the copies of shared layers to keep sharing their weights
+            arguments = node.arguments if node.arguments else {}
+            outputs = copies[id(layer)](new_inputs, **arguments)
+        elif _is_conv(layer):
+            input_axis, output_axis = _kernel_axes(layer)
+            output_keep = plan.get(layer.name)
+            weights[0] = _take(weights[0], keeps[0], input_axis)
+            weights[0] = _take(weights[0], output_keep, output_axis)
+            if layer.use_bias:
+                weights[1] = _take(weights[1], output_keep, 0)
+            new_layer, outputs = _copy_layer(layer, new_inputs, node, weights,
+                                             filters=weights[0].shape[output_axis])
+        elif isinstance(layer, CHANNELWISE_LAYERS):
+            output_keep = keeps[0]
+            weights = [_take(weight, output_keep, 0) for weight in weights]
+            new_layer, outputs = _copy_layer(layer, new_inputs, node, weights)
+        elif _is_concatenate(layer):
+            if any(keep is not None for keep in keeps):
+                output_keep = []
+                offset = 0
+                for x, keep in zip(node.input_tensors, keeps):
+                    n_channels = K.int_shape(x)[-1]
+                    if keep is None:
+                        keep = np.arange(n_channels)
+                    output_keep.append(keep + offset)
+                    offset += n_channels
+                output_keep = np.concatenate(output_keep)
+            new_layer, outputs = _copy_layer(layer, new_inputs, node, weights)
+        else:
+            if not unchanged:
+                raise ValueError('cannot prune the inputs of '
+                                 'layer {}'.format(layer.name))
+            new_layer, outputs = _copy_layer(layer, new_inputs, node, weights)
+        if unchanged and id(layer) not in copies:
+            copies[id(layer)] = new_layer
+
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        for x, new_x in zip(node.output_tensors, outputs):
+            tensor_map[x.name] = (new_x, output_keep)
+
+    new_inputs = [tensor_map[x.name][0] for x in train_model.inputs]
+    new_outputs = [tensor_map[x.name][0] for x in train_model.outputs]
+    if len(new_outputs) == 1:
+        new_outputs = new_outputs[0]
+    return Model(new_inputs, new_outputs, name=train_model.name)
+
+
+def _replace_train_model(model, train_model):
+    model.train_model = train_model
+    model.__init_train_model__()
+    data_generator = model.data_generator
+    if model.subpixel:
+        output_sigma = data_generator.output_sigma
+    else:
+        output_sigma = None
+    model.__init_predict_model__(data_generator.output_shape,
+                                 data_generator.n_keypoints,
+                                 data_generator.downsample_factor,
+                                 output_sigma)
+
+
+def _measure(model, batch_size, n_runs):
+    from ..benchmark import time_function
+
+    input_shape = model.fixed_input_shape
+    images = np.random.RandomState(0).randint(0, 256, size=(1,) + tuple(input_shape))
+    images = images.astype(np.uint8)
+    latency = time_function(lambda: model.predict_on_batch(images), n_runs).mean()
+    evaluation = model.evaluate(batch_size)
+    return {'flops': count_flops(model.train_model, input_shape),
+            'params': model.train_model.count_params(),
+            'latency': latency * 1000,
+            'euclidean': np.mean(evaluation['euclidean'])}
+
+
+def prune_model(model, target_flops=0.5, criterion='magnitude',
+                step_fraction=0.1, min_filters=1, epochs_per_step=1,
+                batch_size=16, optimizer='adam', loss='mse', n_runs=20,
+                verbose=True, **kwargs):
+    """
+    Iteratively prunes convolution filters to a FLOP budget
+    and fine-tunes the model after each pruning step.
+
+    Filters are ranked with `rank_filters` and removed structurally,
+    so the resulting model is a smaller dense keras model that is faster
+    without sparse kernels. Only convolutions whose outputs reach other
+    convolutions through channelwise layers (BatchNormalization,
+    activations, pooling, upsampling) and concatenations can be pruned,
+    which includes the DenseConv2D, ConvBatchNorm2D and ConvBlock2D
+    layers and the bottleneck convolutions of ResidualBlock layers.
+    Convolutions that feed residual additions or model outputs keep
+    their filters.
+
+    The pruned model is saved and loaded as usual, as the saved
+    model config contains the pruned filter counts.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A trained model with a TrainingGenerator. It is modified in place.
+    target_flops : float, default = 0.5
+        The FLOP budget. Values <= 1 are a fraction of the
+        FLOPs of the original model.
+    criterion : str, default = 'magnitude'
+        The ranking criterion, 'magnitude' or 'activation'.
+        See `rank_filters`.
+    step_fraction : float, default = 0.1
+        The fraction of the prunable filters removed in each step.
+    min_filters : int, default = 1
+        The minimum number of filters kept in each layer.
+    epochs_per_step : int, default = 1
+        The number of fine-tuning epochs after each step.
+    batch_size : int, default = 16
+        The batch size for fine-tuning and evaluation.
+    optimizer, loss :
+        Passed to `model.compile` after each step.
+    n_runs : int, default = 20
+        The number of single-image predictions used to measure latency.
+    verbose : bool, default = True
+        Whether to print a report after each step.
+    **kwargs :
+        Passed to `model.fit`
+
+    Returns
+    -------
+    report : list of dict
+        The FLOPs, parameter count, single-image latency (ms), and mean
+        euclidean keypoint error on the validation set before pruning
+        and after each step.
+    """
+    data_generator = model.data_generator
+    if data_generator is None:
+        raise ValueError('model must have a data_generator for fine-tuning')
+    if target_flops <= 1:
+        target_flops = target_flops * count_flops(model.train_model,
+                                                  model.fixed_input_shape)
+
+    report = [dict(step=0, **_measure(model, batch_size, n_runs))]
+    if verbose:
+        print('{:>6} {:>12} {:>10} {:>12} {:>10}'.format('step', 'MFLOPs', 'params',
+                                                        'latency(ms)', 'error'))
+
+    def print_step(result):
+        print('{:>6d} {:>12.1f} {:>10d} {:>12.2f} {:>10.3f}'.format(result['step'],
+                                                                   result['flops'] / 1e6,
+                                                                   result['params'],
+                                                                   result['latency'],
+                                                                   result['euclidean']))
+    if verbose:
+        print_step(report[0])
+
+    step = 0
+    while report[-1]['flops'] > target_flops:
+        images = None
+        if criterion == 'activation':
+            generator = data_generator(n_outputs=1, batch_size=batch_size,
+                                       validation=False, confidence=False)
+            images = generator[0][0]
+        scores = rank_filters(model, criterion, images)
+        plan = _select_filters(scores, step_fraction, min_filters)
+        if len(plan) == 0:
+            warnings.warn('no prunable filters left before reaching the FLOP budget')
+            break
+
+        step += 1
+        _replace_train_model(model, prune_filters(model.train_model, plan))
+        model.compile(optimizer, loss)
+        if epochs_per_step > 0:
+            model.fit(batch_size, epochs=epochs_per_step, **kwargs)
+
+        report.append(dict(step=step, **_measure(model, batch_size, n_runs)))
+        if verbose:
+            print_step(report[-1])
+    return report
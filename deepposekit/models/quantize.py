@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import time
+import warnings
+
+from keras import Model
+from keras.backend import tf
+
+from .layers.convolutional import Maxima2D
+from .layers.subpixel import SubpixelMaxima2D
+from .session import create_session, clone_predict_model
+from ..utils.keypoints import keypoint_errors
+
+__all__ = ['quantize_model', 'load_quantized_model',
+           'QuantizedModel', 'evaluate_quantized_model']
+
+
+def _check_path(path):
+    if isinstance(path, str):
+        if path.endswith('.tflite'):
+            return path
+        else:
+            raise ValueError('file must be .tflite file')
+    else:
+        raise TypeError('file must be type `str`')
+
+
+def _check_data_generator(model):
+    data_generator = model.data_generator
+    if data_generator is None or not hasattr(data_generator, 'generator'):
+        raise ValueError('model must have a TrainingGenerator with annotation '
+                         'data, e.g. load_model(path, datapath=datapath)')
+    return data_generator
+
+
+def _calibration_index(data_generator, n_samples, random_seed=None):
+    random_state = np.random.RandomState(random_seed)
+    index = data_generator.train_index
+    n_samples = min(n_samples, index.shape[0])
+    return np.sort(random_state.choice(index, n_samples, replace=False))
+
+
+def _has_subpixel_head(predict_model):
+    return isinstance(predict_model.layers[-1], SubpixelMaxima2D)
+
+
+def _maxima_model(predict_model):
+    """Returns the predict model with the SubpixelMaxima2D
+    output layer replaced by Maxima2D"""
+    output_layer = predict_model.layers[-1]
+    keypoints = Maxima2D(index=output_layer.index,
+                         coordinate_scale=output_layer.coordinate_scale,
+                         confidence_scale=output_layer.confidence_scale,
+                         )(output_layer.input)
+    return Model(predict_model.inputs[0], keypoints, name=predict_model.name)
+
+
+def _quantization_model(predict_model):
+    """Returns a predict model that only uses ops supported by TFLite.
+    The spectral ops of SubpixelMaxima2D are not supported,
+    so integer peaks are found with Maxima2D instead."""
+    if not _has_subpixel_head(predict_model):
+        return predict_model
+    warnings.warn('SubpixelMaxima2D is not supported by TFLite. '
+                  'The quantized model finds peaks with Maxima2D instead.')
+    return _maxima_model(predict_model)
+
+
+def quantize_model(model, path, n_calibration=100, random_seed=None):
+    """
+    Quantizes `model.predict_model` to int8 and saves it to a .tflite file.
+
+    Weights and activations are quantized with TFLite post-training
+    integer quantization. Activation ranges are calibrated on images
+    from the training split of `model.data_generator`, so the
+    validation split can be used to measure the accuracy loss with
+    `evaluate_quantized_model`. Ops without an int8 kernel, such as the
+    peak finding in the output layer, fall back to float.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with a TrainingGenerator, e.g. from
+        load_model(path, datapath=datapath)
+    path : str
+        The path to the .tflite file.
+    n_calibration : int, default = 100
+        The number of training images used to calibrate
+        the activation ranges.
+    random_seed : int, default = None
+        The random seed for selecting calibration images.
+
+    Example
+    -------
+    quantize_model(model, 'model_int8.tflite')
+    quantized = load_quantized_model('model_int8.tflite')
+    report = evaluate_quantized_model(model, quantized)
+    """
+    filepath = _check_path(path)
+    data_generator = _check_data_generator(model)
+    calibration_index = _calibration_index(data_generator, n_calibration,
+                                           random_seed)
+
+    def representative_dataset():
+        for idx in calibration_index:
+            X, y = data_generator.generator[int(idx)]
+            yield [X]
+
+    session = create_session()
+    predict_model = clone_predict_model(model, session)
+    with session.graph.as_default(), session.as_default():
+        predict_model = _quantization_model(predict_model)
+        converter = tf.lite.TFLiteConverter.from_session(session,
+                                                         predict_model.inputs,
+                                                         predict_model.outputs)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        flatbuffer = converter.convert()
+    session.close()
+
+    with open(filepath, 'wb') as tflite_file:
+        tflite_file.write(flatbuffer)
+
+
+class QuantizedModel:
+    """
+    An int8 model loaded from a file written with `quantize_model`.
+
+    Parameters
+    ----------
+    path : str
+        The path to the .tflite file.
+    n_threads : int, default = None
+        The number of threads used by the interpreter.
+        Default is None, which uses the TFLite default.
+
+    Attributes
+    ----------
+    input_shape : tuple
+        The input shape of the model, (1, height, width, channels)
+    output_shape : tuple
+        The output shape of the model, (1, n_keypoints, 3)
+    """
+    def __init__(self, path, n_threads=None):
+        filepath = _check_path(path)
+        self.interpreter = tf.lite.Interpreter(model_path=filepath)
+        if n_threads is not None:
+            self.interpreter.set_num_threads(n_threads)
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        self._input_index = input_details['index']
+        self._output_index = output_details['index']
+        self._input_dtype = input_details['dtype']
+        self.input_shape = tuple(input_details['shape'])
+        self.output_shape = tuple(output_details['shape'])
+
+    def predict_on_batch(self, x):
+        outputs = []
+        for image in x:
+            self.interpreter.set_tensor(self._input_index,
+                                        image[np.newaxis].astype(self._input_dtype))
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self._output_index))
+        return np.concatenate(outputs)
+
+    def predict(self, x, batch_size=32):
+        """
+        Predict keypoints for an array of images.
+        Images are run one at a time, as the interpreter
+        has a fixed batch size of 1.
+
+        Parameters
+        ----------
+        x : array, shape = (n_samples, height, width, channels)
+            The images to predict.
+        batch_size : int, default = 32
+            Unused. For compatibility with keras.Model.predict
+
+        Returns
+        -------
+        keypoints : array, shape = (n_samples, n_keypoints, 3)
+        """
+        return self.predict_on_batch(x)
+
+
+def load_quantized_model(path, n_threads=None):
+    '''
+    Load a model quantized with `quantize_model` for inference
+
+    Example
+    -------
+    model = load_quantized_model('model_int8.tflite')
+    predictions = model.predict(images)
+
+    '''
+    return QuantizedModel(path, n_threads)
+
+
+def _evaluate(predict, data_generator, batch_size):
+    keypoint_generator = data_generator(n_outputs=1,
+                                        batch_size=batch_size,
+                                        validation=True,
+                                        confidence=False)
+    metrics = []
+    n_samples = 0
+    elapsed = 0.
+    for idx in range(len(keypoint_generator)):
+        X, y_true = keypoint_generator[idx]
+        start = time.perf_counter()
+        y_pred = predict(X)
+        elapsed += time.perf_counter() - start
+        n_samples += X.shape[0]
+        y_pred = y_pred[..., :2]
+        y_error, euclidean, mae, mse, rmse = keypoint_errors(y_true, y_pred)
+        metrics.append([euclidean, mae, mse, rmse])
+    euclidean, mae, mse, rmse = np.hstack(metrics)
+    return {'euclidean': euclidean,
+            'mae': mae,
+            'mse': mse,
+            'rmse': rmse,
+            'latency': elapsed / max(n_samples, 1)}
+
+
+def evaluate_quantized_model(model, quantized_model, batch_size=1,
+                             verbose=True):
+    """
+    Compares the keypoint errors and latency of the original and
+    quantized models on the validation split of `model.data_generator`,
+    using the same metrics as BaseModel.evaluate
+
+    If the original model finds peaks with SubpixelMaxima2D, which the
+    quantized model replaces with Maxima2D, the float model is also
+    evaluated with Maxima2D. The error of the quantized model is then
+    split into the `readout_error` from integer peaks and the
+    `quantization_error` from int8 weights and activations.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The original model with a TrainingGenerator.
+    quantized_model : QuantizedModel
+        The model returned by `load_quantized_model`.
+    batch_size : int, default = 1
+        The batch size for the original model. The quantized model
+        always runs one image at a time, so the default compares
+        single frame latency.
+    verbose : bool, default = True
+        Whether to print a summary of the comparison.
+
+    Returns
+    -------
+    report : dict
+        The evaluation dicts of the `original` and `quantized` models,
+        and of the `float_maxima` model if the original model uses
+        SubpixelMaxima2D, with per-keypoint errors and per-image
+        `latency` in seconds. Also the `speedup` of the quantized model,
+        and the `quantization_error` (and `readout_error`), the change
+        in mean euclidean error in pixels from each source.
+    """
+    data_generator = _check_data_generator(model)
+    original = _evaluate(model.predict_model.predict_on_batch,
+                         data_generator, batch_size)
+    quantized = _evaluate(quantized_model.predict_on_batch,
+                          data_generator, batch_size)
+    report = {'original': original,
+              'quantized': quantized,
+              'speedup': original['latency'] / quantized['latency']}
+    keys = ['original', 'quantized']
+    baseline = original
+    if _has_subpixel_head(model.predict_model):
+        # compare against the float model with the same peak finding
+        baseline = _evaluate(_maxima_model(model.predict_model).predict_on_batch,
+                             data_generator, batch_size)
+        report['float_maxima'] = baseline
+        report['readout_error'] = (np.mean(baseline['euclidean']) -
+                                   np.mean(original['euclidean']))
+        keys = ['original', 'float_maxima', 'quantized']
+    report['quantization_error'] = (np.mean(quantized['euclidean']) -
+                                    np.mean(baseline['euclidean']))
+    if verbose:
+        print('{:>12} {:>12} {:>12} {:>12}'.format('', 'euclidean',
+                                                   'p95', 'latency (ms)'))
+        for key in keys:
+            euclidean = report[key]['euclidean']
+            print('{:>12} {:>12.3f} {:>12.3f} {:>12.2f}'.format(key,
+                                                                np.mean(euclidean),
+                                                                np.percentile(euclidean, 95),
+                                                                report[key]['latency'] * 1000))
+        if 'readout_error' in report:
+            print('readout error: {:+.3f} px'.format(report['readout_error']))
+        print('quantization error: {:+.3f} px'.format(report['quantization_error']))
+        print('speedup: {:.2f}x'.format(report['speedup']))
+    return report
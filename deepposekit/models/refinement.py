@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import warnings
+
+from keras import Model
+from keras.layers import Input, Conv2D
+from keras.utils import Sequence
+
+from .layers.util import Float, ImageNormalization, GatherChannel
+from .layers.leap import ConvBlock2D
+
+__all__ = ['build_refinement_head', 'extract_patches', 'RefinementGenerator',
+           'train_refinement_head', 'load_refinement_head']
+
+
+def build_refinement_head(patch_size, n_channels, n_keypoints, filters=32,
+                          n_layers=4, activation='relu'):
+    """
+    Builds a lightweight network that refines a keypoint
+    on a small full-resolution patch around a coarse estimate.
+
+    The network predicts one confidence map per keypoint type at the
+    resolution of the patch, and the map for the keypoint of each patch
+    is selected with its index, so one network refines all keypoints.
+
+    Parameters
+    ----------
+    patch_size : int
+        The height and width of the patches.
+    n_channels : int
+        The number of channels of the images.
+    n_keypoints : int
+        The number of keypoints.
+    filters : int, default = 32
+        The number of filters of each convolutional layer.
+    n_layers : int, default = 4
+        The number of 3x3 convolutional layers.
+    activation : str, default = 'relu'
+        The activation of the convolutional layers.
+
+    Returns
+    -------
+    head : keras.Model
+        A model with inputs [patches, keypoint_index], where patches
+        are uint8 with shape (batch, patch_size, patch_size, n_channels)
+        and keypoint_index is int32 with shape (batch, 1), and output
+        confidence maps with shape (batch, patch_size, patch_size, 1).
+    """
+    patches = Input(batch_shape=(None, patch_size, patch_size, n_channels),
+                    dtype='uint8')
+    index = Input(batch_shape=(None, 1), dtype='int32')
+    x = Float()(patches)
+    x = ImageNormalization()(x)
+    x = ConvBlock2D(n_layers, filters, 3, activation)(x)
+    maps = Conv2D(n_keypoints, 1, padding='same')(x)
+    maps = GatherChannel()([maps, index])
+    return Model([patches, index], maps, name='RefinementHead')
+
+
+def _patch_maps(positions, patch_size, sigma):
+    """Draws a gaussian confidence map at each [x, y] patch position"""
+    grid = np.arange(patch_size, dtype=np.float32)
+    x = positions[:, 0, None, None]
+    y = positions[:, 1, None, None]
+    maps = np.exp(-((grid[None, None, :] - x)**2 + (grid[None, :, None] - y)**2)
+                  / (2 * sigma**2))
+    return (maps * 255)[..., np.newaxis].astype(np.float32)
+
+
+def extract_patches(images, centers, patch_size):
+    """
+    Crops square patches from images at integer centers.
+
+    Parameters
+    ----------
+    images : array, shape = (n_images, height, width, channels)
+        The images.
+    centers : array, shape = (n_images, n_keypoints, 2)
+        The [x, y] patch centers, which are rounded to integers.
+    patch_size : int
+        The height and width of the patches.
+
+    Returns
+    -------
+    patches : array, shape = (n_images * n_keypoints, patch_size, patch_size, channels)
+        The patches, zero-padded outside the images.
+    origins : array, shape = (n_images, n_keypoints, 2)
+        The [x, y] position of the top left pixel of each patch.
+    """
+    origins = np.round(centers).astype(np.int64) - patch_size // 2
+    padded = np.pad(images, [(0, 0), (patch_size, patch_size),
+                             (patch_size, patch_size), (0, 0)], mode='constant')
+    height, width = images.shape[1:3]
+    patches = []
+    for idx in range(images.shape[0]):
+        for col, row in origins[idx]:
+            row = np.clip(row, -patch_size, height) + patch_size
+            col = np.clip(col, -patch_size, width) + patch_size
+            patches.append(padded[idx, row:row + patch_size, col:col + patch_size])
+    return np.stack(patches), origins
+
+
+class RefinementGenerator(Sequence):
+    """
+    Generates training patches for a refinement head from a TrainingGenerator.
+
+    Each annotated image yields one patch per keypoint, centered on the
+    annotation plus uniform random jitter to simulate the error of the
+    coarse model, with a gaussian confidence map at the annotation.
+
+    Parameters
+    ----------
+    data_generator : TrainingGenerator
+        The annotated data.
+    patch_size : int
+        The height and width of the patches.
+    batch_size : int
+        The number of images in each batch, which
+        yields batch_size * n_keypoints patches.
+    jitter : float, default = 4.
+        The maximum offset of the patch center from the annotation in pixels,
+        e.g. the scale factor of the coarse model input times its
+        2**downsample_factor.
+    sigma : float, default = 2.
+        The standard deviation of the confidence peaks in pixels.
+    validation : bool, default = False
+        Whether to generate patches from the validation set.
+        Validation patches use fixed jitter for comparable losses.
+    """
+    def __init__(self, data_generator, patch_size, batch_size, jitter=4.,
+                 sigma=2., validation=False):
+        if jitter >= patch_size // 2:
+            raise ValueError('jitter must be smaller than half the patch size')
+        self.generator = data_generator(n_outputs=1, batch_size=batch_size,
+                                        validation=validation, confidence=False)
+        self.patch_size = patch_size
+        self.batch_size = batch_size
+        self.jitter = jitter
+        self.sigma = sigma
+        self.validation = validation
+        self.n_keypoints = self.generator.n_keypoints
+        self.random_state = np.random.RandomState(0 if validation else None)
+
+    def __len__(self):
+        return len(self.generator)
+
+    def __getitem__(self, index):
+        if self.validation:
+            self.random_state.seed(index)
+        X, y = self.generator[index]
+        y = y[..., :2]
+        offsets = self.random_state.uniform(-self.jitter, self.jitter, size=y.shape)
+        patches, origins = extract_patches(X, y + offsets, self.patch_size)
+        positions = (y - origins).reshape(-1, 2)
+        keypoint_index = np.tile(np.arange(self.n_keypoints), X.shape[0])
+        keypoint_index = keypoint_index.reshape(-1, 1).astype(np.int32)
+        maps = _patch_maps(positions, self.patch_size, self.sigma)
+        return [patches, keypoint_index], maps
+
+    def on_epoch_end(self):
+        self.generator.on_epoch_end()
+
+
+def train_refinement_head(head, data_generator, batch_size, jitter=4., sigma=2.,
+                          epochs=1, validation_batch_size=1, callbacks=[],
+                          **kwargs):
+    """
+    Trains a refinement head on patches from a TrainingGenerator.
+
+    Parameters
+    ----------
+    head : keras.Model
+        A model from `build_refinement_head`.
+    data_generator : TrainingGenerator
+        The annotated data, with full-resolution images.
+    batch_size : int
+        Number of images in each training batch.
+    jitter : float, default = 4.
+        See RefinementGenerator.
+    sigma : float, default = 2.
+        See RefinementGenerator.
+    epochs : int, default = 1
+        Number of epochs to train the head.
+    validation_batch_size : int, default = 1
+        Number of images in each validation batch.
+    callbacks : list, default = []
+        Keras callbacks.
+    **kwargs :
+        Passed to keras.Model.fit_generator
+
+    Returns
+    -------
+    history : keras History
+    """
+    if not head._is_compiled:
+        warnings.warn('''\nAutomatically compiling with default settings: head.compile('adam', 'mse')\n'''
+                      'Call head.compile() manually to use non-default settings.\n')
+        head.compile('adam', 'mse')
+    patch_size = head.input_shape[0][1]
+    train_generator = RefinementGenerator(data_generator, patch_size, batch_size,
+                                          jitter, sigma)
+    if data_generator.validation_split > 0:
+        validation_generator = RefinementGenerator(data_generator, patch_size,
+                                                   validation_batch_size,
+                                                   jitter, sigma, validation=True)
+        validation_steps = len(validation_generator)
+    else:
+        validation_generator = None
+        validation_steps = None
+    return head.fit_generator(generator=train_generator,
+                              steps_per_epoch=len(train_generator),
+                              epochs=epochs,
+                              callbacks=callbacks,
+                              validation_data=validation_generator,
+                              validation_steps=validation_steps,
+                              **kwargs)
+
+
+def load_refinement_head(path):
+    """Loads a refinement head saved with head.save(path)"""
+    from keras.models import load_model
+    from .loading import CUSTOM_LAYERS
+    return load_model(path, custom_objects=CUSTOM_LAYERS)
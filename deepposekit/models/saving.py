@@ -16,12 +16,75 @@ limitations under the License.
 """
 
 from keras.models import save_model as keras_save_model
+import numpy as np
 import h5py
 import json
+import os
+import tempfile
 from ..utils.io import get_json_type
 
 
-def save_model(model, path, optimizer=True):
+def _copy_attrs(source, dest):
+    for name, value in source.attrs.items():
+        dest.attrs[name] = value
+
+
+def _copy_cast(source, dest, dtype):
+    """Recursively copies an h5py group, casting float32 datasets"""
+    _copy_attrs(source, dest)
+    for key, item in source.items():
+        if isinstance(item, h5py.Group):
+            _copy_cast(item, dest.create_group(key), dtype)
+        elif item.dtype == np.float32:
+            dataset = dest.create_dataset(key, data=item[()].astype(dtype))
+            _copy_attrs(item, dataset)
+        else:
+            source.copy(item, dest, name=key)
+
+
+def _save_cast_weights(keras_model, filepath, dtype, include_optimizer):
+    """Saves a keras model with its weights cast to `dtype`.
+    The model is saved to a temporary file and copied into a new file,
+    as HDF5 does not reclaim the space of datasets replaced in place."""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    handle, tmp_path = tempfile.mkstemp(suffix='.h5', dir=directory)
+    os.close(handle)
+    try:
+        keras_save_model(keras_model, tmp_path,
+                         include_optimizer=include_optimizer)
+        with h5py.File(tmp_path, 'r') as source, h5py.File(filepath, 'w') as dest:
+            _copy_attrs(source, dest)
+            for key, item in source.items():
+                if key == 'model_weights':
+                    _copy_cast(item, dest.create_group(key), dtype)
+                else:
+                    source.copy(item, dest, name=key)
+    finally:
+        os.remove(tmp_path)
+
+
+def save_model(model, path, optimizer=None, weights_dtype='float32'):
+    """
+    Saves a model to an .h5 file that can be loaded with `load_model`.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        The model to save.
+    path : str
+        The path to the .h5 file.
+    optimizer : bool, default = None
+        Whether to save the optimizer state, which is needed to resume
+        training but roughly doubles or triples the file size.
+        Default is None, which saves the optimizer state only for
+        float32 weights, as float16 files are intended for inference.
+    weights_dtype : str, default = 'float32'
+        The dtype of the stored model weights, 'float32' or 'float16'.
+        Storing float16 weights halves the file size, and the weights
+        are upcast to float32 by `load_model`. The rounding error is
+        far below the accuracy of the keypoint predictions for
+        trained models, but can be checked with `model.evaluate`.
+    """
 
     if isinstance(path, str):
         if path.endswith('.h5') or path.endswith('.hdf5'):
@@ -31,10 +94,20 @@ def save_model(model, path, optimizer=True):
     else:
         raise TypeError('file must be type `str`')
 
-    keras_save_model(model.train_model, path, include_optimizer=optimizer)
+    if weights_dtype not in ['float32', 'float16']:
+        raise ValueError('weights_dtype must be float32 or float16')
+    if optimizer is None:
+        optimizer = weights_dtype == 'float32'
+
+    if weights_dtype == 'float16':
+        _save_cast_weights(model.train_model, filepath, np.float16, optimizer)
+    else:
+        keras_save_model(model.train_model, path, include_optimizer=optimizer)
 
     with h5py.File(filepath, 'r+') as h5file:
 
+        h5file.attrs['weights_dtype'] = weights_dtype.encode('utf8')
+
         data_generator = model.data_generator
 
         h5file.attrs['data_generator_config'] = json.dumps({
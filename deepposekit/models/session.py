@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import warnings
+
+from keras import Model
+from keras.backend import tf
+import keras.backend as K
+
+__all__ = ['SessionConfig', 'create_session', 'clone_predict_model',
+           'clone_keras_model']
+
+
+class SessionConfig:
+    """
+    Threading and allocator configuration for TensorFlow sessions.
+
+    Running several training or inference processes on one node with
+    the TensorFlow defaults oversubscribes the cores, as every process
+    starts one thread per core for each of its thread pools. Pass a
+    SessionConfig to the model constructor or to `load_model` to give
+    each process a fixed budget of threads (and optionally cores).
+
+    Parameters
+    ----------
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops
+        (e.g. a single convolution). Default is None, which
+        lets TensorFlow use all available cores.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops
+        in parallel. Default is None, which lets TensorFlow
+        use all available cores.
+    cpu_affinity : list of int, default = None
+        The CPU cores to pin the process to (Linux only).
+        Default is None, which does not change the affinity.
+    set_omp_threads : bool, default = False
+        Whether to also set OMP_NUM_THREADS to `intra_op_threads`
+        for MKL builds of TensorFlow. This changes the environment
+        of the whole process, including other libraries, so it
+        should only be used in processes dedicated to one model.
+        It only has an effect if it is applied before TensorFlow
+        initializes OpenMP.
+    allow_growth : bool, default = False
+        Whether to allocate GPU memory as needed instead of
+        reserving all GPU memory when the session is created.
+    gpu_memory_fraction : float, default = None
+        The fraction of GPU memory to reserve for the process.
+    allocator_type : str, default = None
+        The GPU allocator to use, e.g. 'BFC'.
+        Default is None, which uses the TensorFlow default.
+    device_count : dict, default = None
+        The maximum number of devices of each type to use,
+        e.g. {'GPU': 0} for CPU-only inference.
+    allow_soft_placement : bool, default = True
+        Whether to place ops on the CPU if no GPU kernel is available.
+    """
+    def __init__(self, intra_op_threads=None, inter_op_threads=None,
+                 cpu_affinity=None, set_omp_threads=False,
+                 allow_growth=False, gpu_memory_fraction=None,
+                 allocator_type=None, device_count=None,
+                 allow_soft_placement=True):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity is not None else None
+        self.set_omp_threads = set_omp_threads
+        self.allow_growth = allow_growth
+        self.gpu_memory_fraction = gpu_memory_fraction
+        self.allocator_type = allocator_type
+        self.device_count = device_count
+        self.allow_soft_placement = allow_soft_placement
+
+    def to_proto(self):
+        """Returns the configuration as a tf.ConfigProto"""
+        config = tf.ConfigProto()
+        if self.intra_op_threads:
+            config.intra_op_parallelism_threads = int(self.intra_op_threads)
+        if self.inter_op_threads:
+            config.inter_op_parallelism_threads = int(self.inter_op_threads)
+        config.allow_soft_placement = self.allow_soft_placement
+        config.gpu_options.allow_growth = self.allow_growth
+        if self.gpu_memory_fraction:
+            config.gpu_options.per_process_gpu_memory_fraction = self.gpu_memory_fraction
+        if self.allocator_type:
+            config.gpu_options.allocator_type = self.allocator_type
+        if self.device_count:
+            for key, value in self.device_count.items():
+                config.device_count[key] = int(value)
+        return config
+
+    def _set_process_options(self):
+        if self.cpu_affinity is not None:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, self.cpu_affinity)
+            else:
+                raise OSError('cpu_affinity is not supported on this platform')
+        if self.set_omp_threads and self.intra_op_threads:
+            os.environ['OMP_NUM_THREADS'] = str(int(self.intra_op_threads))
+
+    def create_session(self, graph=None):
+        """
+        Creates a tf.Session with this configuration.
+
+        Parameters
+        ----------
+        graph : tf.Graph, default = None
+            The graph to launch the session on. Default is None,
+            which creates a new, empty graph.
+
+        Returns
+        -------
+        session : tf.Session
+        """
+        self._set_process_options()
+        if graph is None:
+            graph = tf.Graph()
+        return tf.Session(graph=graph, config=self.to_proto())
+
+    def apply(self):
+        """
+        Sets a session with this configuration as the keras session.
+
+        The variables of models that already exist in the current keras
+        session are not transferred to a new session, so if the default
+        graph already has variables, the current session is kept and
+        a warning is issued unless it was created with the same
+        configuration. Apply the configuration before building or
+        loading any models to use it.
+
+        Returns
+        -------
+        session : tf.Session
+        """
+        graph = tf.get_default_graph()
+        if len(graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)) > 0:
+            session = K.get_session()
+            applied = getattr(session, '_deepposekit_config', None)
+            if applied is None or applied != self.get_config():
+                warnings.warn('models already exist in the keras session, '
+                              'so the session configuration is not applied')
+            return session
+        session = self.create_session(graph)
+        session._deepposekit_config = self.get_config()
+        K.set_session(session)
+        return session
+
+    def get_config(self):
+        config = {'intra_op_threads': self.intra_op_threads,
+                  'inter_op_threads': self.inter_op_threads,
+                  'cpu_affinity': self.cpu_affinity,
+                  'set_omp_threads': self.set_omp_threads,
+                  'allow_growth': self.allow_growth,
+                  'gpu_memory_fraction': self.gpu_memory_fraction,
+                  'allocator_type': self.allocator_type,
+                  'device_count': self.device_count,
+                  'allow_soft_placement': self.allow_soft_placement}
+        return config
+
+
+def create_session(intra_op_threads=None, inter_op_threads=None, graph=None,
+                   session_config=None):
+    """Creates a tf.Session with a fixed number of threads.
+
+    Parameters
+    ----------
+    intra_op_threads : int, default = None
+        The number of threads used within individual ops
+        (e.g. a single convolution). Default is None, which
+        lets TensorFlow use all available cores.
+    inter_op_threads : int, default = None
+        The number of threads used for running independent ops
+        in parallel. Default is None, which lets TensorFlow
+        use all available cores.
+    graph : tf.Graph, default = None
+        The graph to launch the session on. Default is None,
+        which creates a new, empty graph.
+    session_config : SessionConfig, default = None
+        A full session configuration. If given, the thread
+        arguments are ignored.
+
+    Returns
+    -------
+    session : tf.Session
+    """
+    if session_config is None:
+        session_config = SessionConfig(intra_op_threads, inter_op_threads)
+    elif not isinstance(session_config, SessionConfig):
+        raise TypeError('session_config must be class SessionConfig')
+    return session_config.create_session(graph)
+
+
+def clone_keras_model(keras_model, session, custom_objects=None,
+                      learning_phase=0):
+    """Rebuilds a keras.Model inside the graph of `session`
+    and copies the current weights into it.
+    See `clone_predict_model` for details.
+
+    Parameters
+    ----------
+    keras_model : keras.Model
+        The model to rebuild.
+    session : tf.Session
+        The session to build the clone in.
+    custom_objects : dict, default = None
+        Additional custom layers needed to rebuild the model.
+    learning_phase : int, default = 0
+        The fixed keras learning phase for the graph of `session`.
+
+    Returns
+    -------
+    clone : keras.Model
+        The rebuilt model, which lives in `session.graph`.
+    """
+    from .loading import CUSTOM_LAYERS
+
+    if custom_objects:
+        custom_objects = dict(list(CUSTOM_LAYERS.items()) +
+                              list(custom_objects.items()))
+    else:
+        custom_objects = CUSTOM_LAYERS
+
+    config = keras_model.get_config()
+    weights = keras_model.get_weights()
+    with session.graph.as_default(), session.as_default():
+        if learning_phase is not None:
+            K.set_learning_phase(learning_phase)
+        clone = Model.from_config(config, custom_objects=custom_objects)
+        clone.set_weights(weights)
+
+    return clone
+
+
+def clone_predict_model(model, session, custom_objects=None,
+                        learning_phase=0):
+    """Rebuilds `model.predict_model` inside the graph of `session`
+    and copies the current weights into it.
+
+    The clone does not share any state with the keras default session,
+    so it can be run with its own threading configuration.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`.
+    session : tf.Session
+        The session to build the clone in, e.g. from `create_session`.
+    custom_objects : dict, default = None
+        Additional custom layers needed to rebuild the model.
+    learning_phase : int, default = 0
+        The fixed keras learning phase for the graph of `session`.
+        The default is 0, which builds layers such as BatchNormalization
+        in inference mode only, without switching on the learning phase.
+        Set to None to leave the learning phase unset.
+
+    Returns
+    -------
+    predict_model : keras.Model
+        The rebuilt prediction model, which lives in `session.graph`.
+    """
+    return clone_keras_model(model.predict_model, session,
+                             custom_objects, learning_phase)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import struct
+import json
+
+from keras import Model
+from keras import backend as K
+from keras.backend import tf
+
+from ..utils.io import get_json_type
+from .session import create_session
+
+__all__ = ['save_shared_weights', 'load_shared_model', 'is_shared_model',
+           'get_shared_config', 'SharedWeightsModel']
+
+MAGIC = b'DPKSHARED'
+ALIGNMENT = 64
+
+
+def _check_path(path):
+    if isinstance(path, str):
+        if path.endswith('.mmap'):
+            return path
+        else:
+            raise ValueError('file must be .mmap file')
+    else:
+        raise TypeError('file must be type `str`')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_shared_weights(model, path):
+    """
+    Saves `model.predict_model` to a file that can be memory-mapped
+    read-only by many inference processes with `load_shared_model`.
+
+    The file has a JSON header with the model configs, followed by the raw
+    weight arrays aligned to 64 bytes. Processes that map the file share a
+    single copy of the weights through the page cache, instead of each
+    holding its own copy in TensorFlow variables, so the memory per process
+    is only the graph and the activations.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`.
+    path : str
+        The path to the .mmap file.
+    """
+    filepath = _check_path(path)
+    predict_model = model.predict_model
+    weights = [np.ascontiguousarray(weight)
+               for weight in predict_model.get_weights()]
+
+    header = {'model_config': predict_model.get_config(),
+              'input_shape': predict_model.input_shape,
+              'output_shape': predict_model.output_shape,
+              'pose_model_config': {'class_name': model.__class__.__name__,
+                                    'config': model.get_config()},
+              'weights': []}
+    data_generator = model.data_generator
+    if data_generator is not None:
+        header['data_generator_config'] = {'class_name': data_generator.__class__.__name__,
+                                           'config': data_generator.get_config()}
+
+    # offsets are relative to the aligned start of the weights
+    offsets = []
+    offset = 0
+    for weight in weights:
+        offset = _align(offset)
+        offsets.append(offset)
+        header['weights'].append({'shape': weight.shape,
+                                  'dtype': weight.dtype.str,
+                                  'offset': offset})
+        offset += weight.nbytes
+    header = json.dumps(header, default=get_json_type).encode('utf8')
+    data_offset = _align(len(MAGIC) + 8 + len(header))
+
+    with open(filepath, 'wb') as mmap_file:
+        mmap_file.write(MAGIC)
+        mmap_file.write(struct.pack('<Q', len(header)))
+        mmap_file.write(header)
+        for weight, offset in zip(weights, offsets):
+            mmap_file.seek(data_offset + offset)
+            mmap_file.write(weight.tobytes())
+
+
+def _read_header(filepath):
+    with open(filepath, 'rb') as mmap_file:
+        if mmap_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('file was not written with save_shared_weights')
+        header_size = struct.unpack('<Q', mmap_file.read(8))[0]
+        header = json.loads(mmap_file.read(header_size).decode('utf-8'))
+    data_offset = _align(len(MAGIC) + 8 + header_size)
+    return header, data_offset
+
+
+def is_shared_model(path):
+    """Returns True if `path` was written with `save_shared_weights`"""
+    if not isinstance(path, str) or not path.endswith('.mmap'):
+        return False
+    with open(path, 'rb') as mmap_file:
+        return mmap_file.read(len(MAGIC)) == MAGIC
+
+
+def get_shared_config(path):
+    """Returns the header of a file written with `save_shared_weights`
+    without mapping the weights"""
+    header, data_offset = _read_header(_check_path(path))
+    return header
+
+
+class SharedWeightsModel:
+    """
+    An inference-only model that reads its weights directly from a
+    read-only memory-mapped file written with `save_shared_weights`.
+
+    The prediction graph is rebuilt in a new session, but its variables
+    are never initialized. Instead, the memory-mapped weight arrays are
+    fed in place of the variable reads on every call. As the arrays are
+    aligned, TensorFlow uses the mapped memory without copying it,
+    so the physical memory for the weights is shared by all processes
+    that load the same file, whether they are forked or spawned.
+
+    Parameters
+    ----------
+    path : str
+        The path to the .mmap file.
+    session_config : SessionConfig, default = None
+        The threading configuration for the session that runs the model.
+        Default is None, which uses the TensorFlow defaults.
+
+    Attributes
+    ----------
+    input_shape : tuple
+        The input shape of the model, (None, height, width, channels)
+    output_shape : tuple
+        The output shape of the model, (None, n_keypoints, 3)
+    session : tf.Session
+        The session that owns the graph of the model.
+    """
+    def __init__(self, path, session_config=None):
+        from .loading import CUSTOM_LAYERS
+
+        filepath = _check_path(path)
+        header, data_offset = _read_header(filepath)
+        self.model_config = header['pose_model_config']
+        self.data_generator_config = header.get('data_generator_config')
+
+        buffer = np.memmap(filepath, dtype=np.uint8, mode='r')
+        self.weights = [np.ndarray(tuple(info['shape']), np.dtype(info['dtype']),
+                                   buffer=buffer,
+                                   offset=data_offset + info['offset'])
+                        for info in header['weights']]
+
+        graph = tf.Graph()
+        self.session = create_session(graph=graph, session_config=session_config)
+        with graph.as_default():
+            K.set_learning_phase(0)
+            predict_model = Model.from_config(header['model_config'],
+                                              custom_objects=CUSTOM_LAYERS)
+        # the weights are saved in the layer-by-layer order of get_weights,
+        # which interleaves trainable and non-trainable weights,
+        # unlike the order of predict_model.weights
+        variables = [weight for layer in predict_model.layers
+                     for weight in layer.weights]
+        if len(variables) != len(self.weights):
+            raise ValueError('model expects {} weights, but the file '
+                             'has {}'.format(len(variables), len(self.weights)))
+        for variable, weight in zip(variables, self.weights):
+            if K.int_shape(variable) != weight.shape:
+                raise ValueError('weight {} has shape {}, but the file has '
+                                 '{}'.format(variable.name, K.int_shape(variable),
+                                             weight.shape))
+        self.input_shape = predict_model.input_shape
+        self.output_shape = predict_model.output_shape
+        # feeding the variable snapshots prunes the variables from the graph
+        self._weight_tensors = [variable.value() for variable in variables]
+        self._predict = self.session.make_callable(predict_model.outputs[0],
+                                                   [predict_model.inputs[0]] +
+                                                   self._weight_tensors)
+        graph.finalize()
+
+    def predict_on_batch(self, x):
+        return self._predict(x, *self.weights)
+
+    def predict(self, x, batch_size=32):
+        """
+        Predict keypoints for an array of images.
+
+        Parameters
+        ----------
+        x : array, shape = (n_samples, height, width, channels)
+            The images to predict.
+        batch_size : int, default = 32
+            The number of images to run at once.
+
+        Returns
+        -------
+        keypoints : array, shape = (n_samples, n_keypoints, 3)
+        """
+        outputs = [self._predict(x[idx:idx + batch_size], *self.weights)
+                   for idx in range(0, x.shape[0], batch_size)]
+        return np.concatenate(outputs)
+
+    def get_config(self):
+        config = dict(self.model_config['config'])
+        if self.data_generator_config is not None:
+            config.update(self.data_generator_config['config'])
+        return config
+
+    def close(self):
+        self.session.close()
+
+
+def load_shared_model(path, session_config=None):
+    '''
+    Load a model saved with `save_shared_weights` for inference
+
+    Example
+    -------
+    save_shared_weights(model, 'model.mmap')
+
+    # in each worker process
+    model = load_shared_model('model.mmap')
+    predictions = model.predict(images)
+
+    '''
+    return SharedWeightsModel(path, session_config)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+from collections import defaultdict
+
+from keras.engine.network import Network
+from keras.backend import tf
+
+from .models.session import SessionConfig, clone_predict_model
+
+__all__ = ['CATEGORIES', 'profile_model']
+
+# architectural categories for aggregating layer classes
+CATEGORIES = {'Conv2D': 'convolution',
+              'SeparableConv2D': 'convolution',
+              'DepthwiseConv2D': 'convolution',
+              'Dense': 'convolution',
+              'BatchNormalization': 'normalization',
+              'Activation': 'activation',
+              'ReLU': 'activation',
+              'LeakyReLU': 'activation',
+              'Concatenate': 'concatenate',
+              'Add': 'residual',
+              'Multiply': 'squeeze_excite',
+              'GlobalAveragePooling2D': 'squeeze_excite',
+              'Reshape': 'squeeze_excite',
+              'MaxPooling2D': 'downsampling',
+              'AveragePooling2D': 'downsampling',
+              'SubPixelDownscaling': 'downsampling',
+              'UpSampling2D': 'upsampling',
+              'SubPixelUpscaling': 'upsampling',
+              'Conv2DTranspose': 'upsampling',
+              'Float': 'preprocessing',
+              'ImageNormalization': 'preprocessing',
+              'ResNetPreprocess': 'preprocessing',
+              'Maxima2D': 'head',
+              'SubpixelMaxima2D': 'head'}
+
+
+def _layer_names(model, prefix=''):
+    """Returns the class name for the name scope of each layer"""
+    names = {}
+    for layer in model.layers:
+        names[prefix + layer.name] = layer.__class__.__name__
+        if isinstance(layer, Network):
+            names.update(_layer_names(layer, prefix + layer.name + '/'))
+    return names
+
+
+def _match_layer(node_name, layer_names):
+    """Returns the innermost layer whose name scope contains an op"""
+    parts = node_name.split('/')
+    match = None
+    for idx in range(1, len(parts)):
+        scope = '/'.join(parts[:idx])
+        if scope in layer_names:
+            match = scope
+    return match
+
+
+def _aggregate(totals, key):
+    grouped = defaultdict(lambda: {'time': 0., 'memory': 0, 'n_ops': 0})
+    for entry in totals:
+        group = grouped[entry[key]]
+        group['time'] += entry['time']
+        group['memory'] += entry['memory']
+        group['n_ops'] += entry['n_ops']
+    grouped = [dict(name=name, **values) for name, values in grouped.items()]
+    return sorted(grouped, key=lambda entry: -entry['time'])
+
+
+def profile_model(model, images=None, batch_size=1, n_runs=10, warmup=3,
+                  trace_path=None, session_config=None, top=20, verbose=True):
+    """
+    Profiles the time and memory of each layer of `model.predict_model`.
+
+    The model is rebuilt in a new session and run with full tracing.
+    The time and output memory of each TensorFlow op are attributed to
+    the keras layer whose name scope contains the op, and aggregated per
+    layer, per layer class, and per architectural category, such as
+    'convolution', 'upsampling', or the 'head' that finds the maxima.
+    Tracing adds overhead to each op, so times are best compared
+    relative to each other.
+
+    Parameters
+    ----------
+    model : deepposekit BaseModel
+        A model with an initialized `predict_model`.
+    images : array, shape = (n_samples, height, width, channels), default = None
+        The images to run. Default is None, which uses
+        random images with `batch_size` samples, at the
+        training shape for models with a variable shape.
+    batch_size : int, default = 1
+        The number of random images if `images` is None.
+    n_runs : int, default = 10
+        The number of traced runs to average.
+    warmup : int, default = 3
+        The number of untraced runs before tracing.
+    trace_path : str, default = None
+        The path for a Chrome trace file of the last run, which can be
+        viewed offline at chrome://tracing. Default is None, which
+        does not write a trace.
+    session_config : SessionConfig, default = None
+        The threading configuration for the profiled session.
+    top : int, default = 20
+        The number of layers printed in the report.
+    verbose : bool, default = True
+        Whether to print the report.
+
+    Returns
+    -------
+    report : dict
+        Lists of 'layers', 'classes' and 'categories' sorted by time,
+        with the mean 'time' (ms) per run, the output 'memory' (bytes)
+        and the number of ops, along with the 'total' time (ms).
+    """
+    if images is None:
+        input_shape = model.fixed_input_shape
+        random_state = np.random.RandomState(0)
+        images = random_state.randint(0, 256, size=(batch_size,) + tuple(input_shape))
+        images = images.astype(np.uint8)
+    if session_config is None:
+        session_config = SessionConfig()
+    session = session_config.create_session()
+    predict_model = clone_predict_model(model, session)
+    layer_names = _layer_names(predict_model)
+    feed_dict = {predict_model.inputs[0]: images}
+    output = predict_model.outputs[0]
+
+    for idx in range(warmup):
+        session.run(output, feed_dict)
+    options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    times = defaultdict(float)
+    memory = defaultdict(int)
+    n_ops = defaultdict(int)
+    for idx in range(n_runs):
+        run_metadata = tf.RunMetadata()
+        session.run(output, feed_dict, options=options, run_metadata=run_metadata)
+        for device in run_metadata.step_stats.dev_stats:
+            for node in device.node_stats:
+                layer = _match_layer(node.node_name, layer_names)
+                if layer is None:
+                    layer = '(other)'
+                times[layer] += node.all_end_rel_micros / 1000.
+                if idx == 0:
+                    n_ops[layer] += 1
+                    for node_output in node.output:
+                        allocation = node_output.tensor_description.allocation_description
+                        memory[layer] += allocation.requested_bytes
+    session.close()
+
+    if trace_path is not None:
+        from tensorflow.python.client import timeline
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(trace_path, 'w') as trace_file:
+            trace_file.write(trace.generate_chrome_trace_format(show_memory=True))
+
+    layers = []
+    for name in times.keys():
+        class_name = layer_names.get(name, '(other)')
+        layers.append({'name': name,
+                       'class_name': class_name,
+                       'category': CATEGORIES.get(class_name, 'other'),
+                       'time': times[name] / n_runs,
+                       'memory': memory[name],
+                       'n_ops': n_ops[name]})
+    layers = sorted(layers, key=lambda entry: -entry['time'])
+    total = sum(entry['time'] for entry in layers)
+    report = {'layers': layers,
+              'classes': _aggregate(layers, 'class_name'),
+              'categories': _aggregate(layers, 'category'),
+              'total': total}
+
+    if verbose:
+        row = '{:<40} {:>10} {:>8} {:>12}'
+        for key in ['categories', 'classes', 'layers']:
+            print(row.format(key, 'time(ms)', '%', 'memory(MB)'))
+            for entry in report[key][:top]:
+                print(row.format(entry['name'][:40],
+                                 '{:.3f}'.format(entry['time']),
+                                 '{:.1f}'.format(100 * entry['time'] / max(total, 1e-12)),
+                                 '{:.2f}'.format(entry['memory'] / 1e6)))
+            print()
+        print('total: {:.3f} ms (batch_size={})'.format(total, images.shape[0]))
+    return report
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import multiprocessing
+import tempfile
+import h5py
+import os
+import time
+
+from keras.callbacks import Callback
+
+__all__ = ['cache_dataset', 'sample_configs', 'pareto_front',
+           'search_architectures']
+
+
+class _TimeBudget(Callback):
+    """Stops training after a fixed amount of time"""
+    def __init__(self, seconds):
+        super(_TimeBudget, self).__init__()
+        self.seconds = seconds
+
+    def on_train_begin(self, logs=None):
+        self.start = time.time()
+
+    def on_batch_end(self, batch, logs=None):
+        if time.time() - self.start > self.seconds:
+            self.model.stop_training = True
+
+
+def cache_dataset(datapath, dataset='images', cache_dir=None, chunk_size=1000):
+    """
+    Copies the images and annotations of an annotation file
+    to an uncompressed, contiguous .h5 file in a local directory.
+
+    All trials of a search read the same cached file, so
+    the dataset is decompressed once and worker processes
+    share the file through the page cache. Each call creates
+    a new file with a unique name, which the caller removes.
+
+    Parameters
+    ----------
+    datapath : str
+        The path to the annotation .h5 file.
+    dataset : str, default = 'images'
+        The image dataset in the annotation file.
+    cache_dir : str, default = None
+        The directory for the cached file. Default is None,
+        which uses the system temporary directory.
+    chunk_size : int, default = 1000
+        The number of images copied at once.
+
+    Returns
+    -------
+    cache_path : str
+        The path to the cached .h5 file.
+    """
+    if cache_dir is None:
+        cache_dir = tempfile.gettempdir()
+    name = os.path.splitext(os.path.basename(datapath))[0]
+    handle, cache_path = tempfile.mkstemp(prefix=name + '_', suffix='_cache.h5',
+                                          dir=cache_dir)
+    os.close(handle)
+    with h5py.File(datapath, 'r') as source, h5py.File(cache_path, 'w') as cache:
+        for key in [dataset, 'annotations', 'annotated', 'skeleton']:
+            data = source[key]
+            cached = cache.create_dataset(key, shape=data.shape, dtype=data.dtype)
+            for idx in range(0, data.shape[0], chunk_size):
+                cached[idx:idx + chunk_size] = data[idx:idx + chunk_size]
+    return cache_path
+
+
+def sample_configs(search_space, n_trials, random_seed=None):
+    """
+    Samples unique model configurations from a search space.
+
+    Parameters
+    ----------
+    search_space : dict
+        The candidate values for each model argument, e.g.
+        {'n_stacks': [1, 2], 'growth_rate': [16, 24, 32]}
+    n_trials : int
+        The maximum number of configurations.
+    random_seed : int, default = None
+
+    Returns
+    -------
+    configs : list of dict
+    """
+    random_state = np.random.RandomState(random_seed)
+    keys = sorted(search_space.keys())
+    n_possible = int(np.prod([len(search_space[key]) for key in keys]))
+    n_trials = min(n_trials, n_possible)
+    configs = []
+    seen = set()
+    while len(configs) < n_trials:
+        values = tuple(search_space[key][random_state.randint(len(search_space[key]))]
+                       for key in keys)
+        if values not in seen:
+            seen.add(values)
+            configs.append(dict(zip(keys, values)))
+    return configs
+
+
+def pareto_front(results, x='latency', y='euclidean'):
+    """
+    Returns the results that are not dominated by any other result,
+    i.e. where no other result has both a lower `x` and a lower `y`,
+    sorted by `x`.
+    """
+    results = [result for result in results if result.get(y) is not None]
+    results = sorted(results, key=lambda result: (result[x], result[y]))
+    front = []
+    for result in results:
+        if len(front) == 0 or result[y] < front[-1][y]:
+            front.append(result)
+    return front
+
+
+def _train_trial(args):
+    (model_name, config, cache_path, generator_kwargs,
+     epochs, time_budget, batch_size, n_threads) = args
+
+    from .models.session import SessionConfig
+    from .models.loading import MODELS
+    from .io import TrainingGenerator
+
+    SessionConfig(intra_op_threads=n_threads, inter_op_threads=n_threads,
+                  set_omp_threads=True).apply()
+    data_generator = TrainingGenerator(cache_path, **generator_kwargs)
+    model = MODELS[model_name](data_generator, **config)
+    model.compile('adam', 'mse')
+    callbacks = []
+    if time_budget is not None:
+        callbacks.append(_TimeBudget(time_budget))
+    start = time.time()
+    model.fit(batch_size, epochs=epochs, callbacks=callbacks, verbose=0)
+    train_time = time.time() - start
+    # small validation sets would otherwise have no full batches
+    evaluation = model.evaluate(min(batch_size, data_generator.n_validation))
+    return {'euclidean': float(np.mean(evaluation['euclidean'])),
+            'train_time': train_time}
+
+
+def search_architectures(model_class, datapath, search_space, n_trials=20,
+                         dataset='images', generator_kwargs=None,
+                         max_latency=None, epochs=10, time_budget=None,
+                         batch_size=16, n_workers=1, n_threads=None,
+                         latency_threads=1, n_runs=20, cache_dir=None,
+                         random_seed=None, verbose=True):
+    """
+    Random search over model configurations for the
+    trade-off between keypoint error and CPU inference latency.
+
+    The search runs in two phases. First, every sampled configuration is
+    built in this process and its FLOPs and single-image latency are
+    measured one at a time, so measurements are not disturbed by training.
+    Configurations slower than `max_latency` are rejected without training.
+    The remaining configurations are then trained on a fixed budget in
+    parallel worker processes, which read a shared cached copy of the
+    dataset, and evaluated on the validation set.
+
+    Parameters
+    ----------
+    model_class : class
+        The model class, e.g. StackedDenseNet
+    datapath : str
+        The path to the annotation .h5 file.
+    search_space : dict
+        The candidate values for each model argument, e.g.
+        {'n_stacks': [1, 2], 'n_layers': [1, 2, 3], 'growth_rate': [16, 32]}
+    n_trials : int, default = 20
+        The number of configurations to sample.
+    dataset : str, default = 'images'
+        The image dataset in the annotation file.
+    generator_kwargs : dict, default = None
+        Arguments for TrainingGenerator. The same validation set is
+        used for all trials, so `random_seed` defaults to 1.
+    max_latency : float, default = None
+        The maximum latency in ms of configurations to train.
+    epochs : int, default = 10
+        The maximum number of training epochs for each trial.
+    time_budget : float, default = None
+        The maximum training time in seconds for each trial.
+    batch_size : int, default = 16
+        The batch size for training and evaluation.
+    n_workers : int, default = 1
+        The number of trials trained in parallel.
+    n_threads : int, default = None
+        The number of threads for each worker. Default is None,
+        which divides the available cores between workers.
+    latency_threads : int, default = 1
+        The number of threads used to measure latency,
+        e.g. the thread budget of each deployed process.
+    n_runs : int, default = 20
+        The number of timed predictions for each configuration.
+    cache_dir : str, default = None
+        The directory for the cached dataset. See `cache_dataset`.
+    random_seed : int, default = None
+        The random seed for sampling configurations.
+    verbose : bool, default = True
+        Whether to print the results and the Pareto front.
+
+    Returns
+    -------
+    results : list of dict
+        The config, FLOPs, parameter count, latency (ms), training time (s)
+        and mean euclidean validation error of each trial. Rejected
+        trials have an error of None.
+    front : list of dict
+        The results on the latency/error Pareto front.
+    """
+    from keras import backend as K
+    from .benchmark import benchmark_threads
+    from .models.estimate import count_flops
+    from .io import TrainingGenerator
+
+    model_name = model_class.__name__
+    generator_kwargs = dict(generator_kwargs or {})
+    generator_kwargs.setdefault('random_seed', 1)
+    generator_kwargs['dataset'] = dataset
+    if n_threads is None:
+        n_threads = int(np.maximum(1, (os.cpu_count() or 1) // n_workers))
+
+    cache_path = cache_dataset(datapath, dataset, cache_dir)
+    try:
+        data_generator = TrainingGenerator(cache_path, **generator_kwargs)
+        if data_generator.n_validation == 0:
+            raise ValueError('the search requires a validation set, '
+                             'e.g. generator_kwargs={\'validation_split\': 0.1}')
+        results = []
+        for config in sample_configs(search_space, n_trials, random_seed):
+            K.clear_session()
+            model = model_class(data_generator, **config)
+            latency = benchmark_threads(model, [latency_threads], batch_size=1,
+                                        n_runs=n_runs, verbose=False)[0]['mean_latency']
+            results.append({'config': config,
+                            'flops': count_flops(model.train_model,
+                                                 model.fixed_input_shape),
+                            'params': model.train_model.count_params(),
+                            'latency': latency,
+                            'train_time': None,
+                            'euclidean': None})
+        K.clear_session()
+
+        trials = [result for result in results
+                  if max_latency is None or result['latency'] <= max_latency]
+        tasks = [(model_name, result['config'], cache_path, generator_kwargs,
+                  epochs, time_budget, batch_size, n_threads) for result in trials]
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(n_workers, maxtasksperchild=1)
+        try:
+            for result, trial in zip(trials, pool.imap(_train_trial, tasks)):
+                result.update(trial)
+                if verbose:
+                    print('{} - {:.2f} ms - error {:.3f}'.format(result['config'],
+                                                                 result['latency'],
+                                                                 result['euclidean']))
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        # only the cache created by this search is removed
+        os.remove(cache_path)
+
+    front = pareto_front(results)
+    if verbose:
+        print('Pareto front ({} of {} trials)'.format(len(front), len(results)))
+        print('{:>12} {:>12} {:>10}  {}'.format('latency(ms)', 'MFLOPs',
+                                                'error', 'config'))
+        for result in front:
+            print('{:>12.2f} {:>12.1f} {:>10.3f}  {}'.format(result['latency'],
+                                                             result['flops'] / 1e6,
+                                                             result['euclidean'],
+                                                             result['config']))
+    return results, front
@@ -2,4 +2,5 @@ from __future__ import absolute_import
 
 from . import keypoints
 from . import image
-from . import io
\ No newline at end of file
+from . import io
+from . import filters
\ No newline at end of file
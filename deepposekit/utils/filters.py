@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+
+__all__ = ['KeypointFilter']
+
+
+class KeypointFilter:
+    """
+    Online constant-velocity Kalman filter for keypoint coordinates.
+
+    Each keypoint coordinate is filtered independently with a
+    position/velocity state. Frames that are dropped, or keypoints
+    with low confidence, are bridged using the predicted state
+    for up to `max_missing` consecutive frames.
+
+    Parameters
+    ----------
+    n_keypoints : int
+        The number of keypoints to filter.
+    process_noise : float, default = 1.0
+        The variance of the (unmodeled) acceleration of each
+        keypoint in pixels per frame squared. Larger values
+        track fast movements more closely but smooth less.
+    measurement_noise : float, default = 1.0
+        The variance of the predicted keypoint coordinates in pixels.
+    confidence_threshold : float, default = 0.0
+        Keypoints with a confidence below this value are treated
+        as missing and are bridged with the predicted state.
+    max_missing : int, default = 5
+        The maximum number of consecutive frames to bridge for
+        a keypoint. After this the filter is reset for that keypoint
+        and NaN is returned until it is observed again.
+    """
+    def __init__(self, n_keypoints, process_noise=1.0, measurement_noise=1.0,
+                 confidence_threshold=0.0, max_missing=5):
+        self.n_keypoints = n_keypoints
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.confidence_threshold = confidence_threshold
+        self.max_missing = max_missing
+
+        shape = (n_keypoints, 2)
+        self._position = np.zeros(shape)
+        self._velocity = np.zeros(shape)
+        self._p00 = np.zeros(shape)
+        self._p01 = np.zeros(shape)
+        self._p11 = np.zeros(shape)
+        self._missing = np.zeros(n_keypoints, dtype=np.int64)
+        self._output = np.zeros((n_keypoints, 3))
+        self.reset()
+
+    def reset(self):
+        """Resets the state of all keypoints"""
+        self._position[:] = 0
+        self._velocity[:] = 0
+        self._p00[:] = 0
+        self._p01[:] = 0
+        self._p11[:] = 0
+        self._missing[:] = self.max_missing + 1
+        self._output[:] = np.nan
+
+    @property
+    def initialized(self):
+        return self._missing <= self.max_missing
+
+    def _predict(self):
+        q = self.process_noise
+        self._position += self._velocity
+        self._p00 += 2 * self._p01 + self._p11 + q / 4.
+        self._p01 += self._p11 + q / 2.
+        self._p11 += q
+
+    def __call__(self, keypoints=None):
+        """
+        Advance the filter by one frame.
+
+        Parameters
+        ----------
+        keypoints : array, shape = (n_keypoints, 3) or None
+            The predicted keypoints for the frame as [x, y, confidence].
+            Default is None, which marks the frame as dropped.
+
+        Returns
+        -------
+        filtered : array, shape = (n_keypoints, 3)
+            The filtered keypoints as [x, y, confidence]. Bridged
+            keypoints have a confidence of zero. This array is reused
+            between calls, so copy it to keep the values.
+        """
+        self._predict()
+
+        initialized = self.initialized
+        if keypoints is None:
+            measured = np.zeros(self.n_keypoints, dtype=bool)
+        else:
+            keypoints = np.asarray(keypoints)
+            measured = keypoints[:, 2] >= self.confidence_threshold
+            measured &= np.all(np.isfinite(keypoints[:, :2]), axis=-1)
+
+        r = self.measurement_noise
+        update = measured & initialized
+        if np.any(update):
+            z = keypoints[update, :2]
+            p00 = self._p00[update]
+            p01 = self._p01[update]
+            gain = 1. / (p00 + r)
+            k0 = p00 * gain
+            k1 = p01 * gain
+            residual = z - self._position[update]
+            self._position[update] += k0 * residual
+            self._velocity[update] += k1 * residual
+            self._p11[update] -= k1 * p01
+            self._p01[update] = (1 - k0) * p01
+            self._p00[update] = (1 - k0) * p00
+
+        start = measured & ~initialized
+        if np.any(start):
+            self._position[start] = keypoints[start, :2]
+            self._velocity[start] = 0
+            self._p00[start] = r
+            self._p01[start] = 0
+            self._p11[start] = r
+
+        self._missing[measured] = 0
+        self._missing[~measured] += 1
+        active = self.initialized
+
+        self._output[:, :2] = self._position
+        self._output[:, 2] = 0
+        if keypoints is not None:
+            self._output[measured, 2] = keypoints[measured, 2]
+        self._output[~active] = np.nan
+        return self._output
@@ -98,6 +98,8 @@ if __name__ == "__main__":
           download_url=DOWNLOAD_URL,
           install_requires=install_requires,
           packages=find_packages(),
+          entry_points={'console_scripts':
+                        ['deepposekit=deepposekit.cli:main']},
           zip_safe=False,
           classifiers=['Intended Audience :: Science/Research',
                        'Programming Language :: Python :: 2.7',
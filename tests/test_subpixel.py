@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018 Jacob M. Graving <jgraving@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+from deepposekit.benchmark import BenchmarkGenerator
+from deepposekit.models import StackedDenseNet
+from deepposekit.models.layers.subpixel import SubpixelMaxima2D
+
+
+@pytest.mark.parametrize('subpixel', [True, 'roi'])
+def test_default_predict_model_builds(subpixel):
+    # SubpixelMaxima2D computes its constants when it is built
+    # with a static input shape, as in the default predict model
+    graph = tf.Graph()
+    with graph.as_default(), tf.Session(graph=graph).as_default():
+        generator = BenchmarkGenerator(128, 128, n_keypoints=8)
+        model = StackedDenseNet(generator, subpixel=subpixel)
+        output_layer = model.predict_model.layers[-1]
+        assert isinstance(output_layer, SubpixelMaxima2D)
+        assert output_layer.constants is not None
+        assert model.predict_model.output_shape == (None, 8, 3)